@@ -0,0 +1,527 @@
+from urllib.parse import urlparse, parse_qs
+from os import path
+import githubStandIn
+import subprocess
+import argparse
+import tracing
+import shutil
+import json
+import time
+import sys
+import os
+
+# Offline benchmark for the release tools. It generates synthetic bare repos that mimic the CDAP topology
+# (cdap-build with nested .gitmodules, repos with hundreds of pom files), starts local stand-ins for GitHub
+# (PR API and licenses) and for the other hosts (JIRA search and plain-text license URLs), then runs the tools
+# end to end against them and records throughput and latency numbers
+workspaceFolder = "workspace_benchmark"  # Update the entry in the .gitignore if this folder name is changed
+resultsFilename = "benchmarkResults.json"  # Update the entry in the .gitignore if this file name is changed
+toolsPath = path.dirname(path.abspath(__file__))
+
+version = "6.1.4"
+cdapBranch = "release/6.1"
+pluginsBranch = "release/2.3"
+pluginsVersion = "2.3.4"
+releaseNotesField = 'customfield_10300'
+scenarioNames = ['plan', 'remove_snapshot', 'bump_to_snapshot', 'update_submodules', 'licenses', 'licenses_cached', 'licenses_revalidated',
+                 'licenses_rate_limited', 'release_notes']
+
+pomTemplate = """<?xml version="1.0" encoding="UTF-8"?>
+<project xmlns="http://maven.apache.org/POM/4.0.0">
+  <modelVersion>4.0.0</modelVersion>
+%(parent)s
+  <groupId>io.cdap.%(repo)s</groupId>
+  <artifactId>%(module)s</artifactId>
+  <version>%(version)s</version>
+  <name>%(module)s</name>
+
+  <properties>
+    <cdap.version>%(cdapVersion)s</cdap.version>
+    <guava.version>13.0.1</guava.version>
+  </properties>
+
+  <dependencies>
+%(dependencies)s
+  </dependencies>
+</project>
+"""
+parentTemplate = """  <parent>
+    <groupId>io.cdap.%(repo)s</groupId>
+    <artifactId>%(repo)s</artifactId>
+    <version>%(version)s</version>
+  </parent>"""
+dependencyTemplate = """    <dependency>
+      <groupId>io.cdap.cdap</groupId>
+      <artifactId>cdap-%s</artifactId>
+      <version>${cdap.version}</version>
+    </dependency>"""
+
+
+class HostStandInHandler(githubStandIn.StandInHandler):
+    """ Request handler for the JIRA search API and plain-text license URLs """
+
+    def route(self, method):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        if self.server.latency > 0:
+            time.sleep(self.server.latency)
+
+        if url.path == "/rest/api/2/serverInfo":
+            self.sendJSON(200, {'baseUrl': self.server.getURL(), 'version': "8.5.0", 'versionNumbers': [8, 5, 0],
+                                'deploymentType': "Server", 'buildNumber': 805000, 'serverTitle': "JIRA"})
+        elif url.path == "/rest/auth/1/session":
+            self.sendJSON(200, {'name': "benchmark", 'self': "%s/rest/api/2/user?username=benchmark" % self.server.getURL()})
+        elif url.path == "/rest/api/2/field":
+            self.sendJSON(200, [{'id': releaseNotesField, 'name': "Release Notes", 'custom': True},
+                                {'id': "status", 'name': "Status", 'custom': False},
+                                {'id': "resolution", 'name': "Resolution", 'custom': False},
+                                {'id': "issuetype", 'name': "Issue Type", 'custom': False}])
+        elif url.path == "/rest/api/2/search":
+            self.sendJSON(200, self.server.searchIssues(params.get('jql', [''])[0], int(params.get('startAt', [0])[0]),
+                                                        int(params.get('maxResults', [50])[0])))
+        elif url.path.startswith("/licenses/"):
+            self.sendText(200, "Synthetic license for %s\n" % url.path[len("/licenses/"):])
+        else:
+            self.sendJSON(404, {'message': 'Not Found'})
+
+
+class HostStandIn(githubStandIn.StandInServer):
+    """ Stand-in for the hosts that are not GitHub, the JIRA issues are generated up front """
+
+    handlerClass = HostStandInHandler
+
+    def __init__(self, address, issues, latency=0):
+        githubStandIn.StandInServer.__init__(self, address, {}, latency=latency)
+        self.issues = issues
+
+    def searchIssues(self, jql, startAt, maxResults):
+        """ Answers the two searches of generateReleaseNotes, the only part of the JQL that is looked at is the release notes filter """
+
+        withNotes = 'is not EMPTY' in jql
+        issues = [issue for issue in self.issues if (issue['fields'][releaseNotesField] is not None) == withNotes]
+        return {'startAt': startAt, 'maxResults': maxResults, 'total': len(issues), 'issues': issues[startAt:startAt+maxResults]}
+
+
+class Fixture():
+    """ Class to hold the paths and synthetic data of a benchmark run """
+
+    def __init__(self, basePath, pluginRepos, modules, artifacts, issues):
+        self.basePath = basePath
+        self.remotesPath = path.join(basePath, "remotes")
+        self.sourcesPath = path.join(basePath, "sources")
+        self.runPath = path.join(basePath, "run")  # Working directory of the tools, holds repos.txt and their workspaces
+        self.plugins = ["data-integrations/plugin-%03d" % i for i in range(pluginRepos)]
+        self.repos = ["cdapio/cdap", "cdapio/hydrator-plugins"] + self.plugins + ["cdapio/cdap-build"]
+        self.modules = modules
+        self.artifacts = artifacts
+        self.issues = issues
+
+
+def getGitEnv(fixture):
+    """ Returns the environment for the tools, git@github.com URLs are rewritten to the synthetic bare repos """
+
+    config = [("url.%s/.insteadOf" % fixture.remotesPath, "git@github.com:"), ("protocol.file.allow", "always"),
+              ("user.name", "Release Benchmark"), ("user.email", "benchmark@example.com"), ("init.defaultBranch", "develop")]
+    env = dict(os.environ, GH_TOKEN="benchmark", GIT_CONFIG_COUNT=str(len(config)))
+    for i, (key, value) in enumerate(config):
+        env["GIT_CONFIG_KEY_%d" % i] = key
+        env["GIT_CONFIG_VALUE_%d" % i] = value
+    return env
+
+def runGit(cwd, args, env):
+    return subprocess.run(['git'] + args, cwd=cwd, env=env, check=True, stdout=subprocess.PIPE).stdout.decode('utf-8').strip()
+
+def createPoms(repoPath, repo, modules, repoVersion, cdapVersion):
+    """ Writes a root pom and one pom per module, every module depends on a few CDAP artifacts """
+
+    name = repo.split("/")[-1]
+    dependencies = "\n".join(dependencyTemplate % artifact for artifact in ["api", "common", "etl-api", "formats"])
+    for i in range(modules):
+        module = name if i == 0 else "%s-module-%03d" % (name, i)
+        pomPath = path.join(repoPath, "pom.xml") if i == 0 else path.join(repoPath, module, "pom.xml")
+        os.makedirs(path.dirname(pomPath), exist_ok=True)
+        with open(pomPath, 'w') as pomFile:
+            pomFile.write(pomTemplate % {'parent': "" if i == 0 else parentTemplate % {'repo': name, 'version': repoVersion},
+                                         'repo': name, 'module': module, 'version': repoVersion, 'cdapVersion': cdapVersion,
+                                         'dependencies': dependencies})
+
+def createRepo(fixture, repo, branch, repoVersion, submodules, env):
+    """
+    Creates a synthetic repo with the given release branch and publishes it as a bare repo in the remotes folder.
+    submodules is a list of (repo, branch, sha) that are added as gitlinks together with a .gitmodules file. Returns the sha of the branch
+    """
+
+    sourcePath = path.join(fixture.sourcesPath, repo)
+    os.makedirs(sourcePath)
+    runGit(sourcePath, ['init', '-q'], env)
+    createPoms(sourcePath, repo, fixture.modules, repoVersion + "-SNAPSHOT", version + "-SNAPSHOT")
+    if len(submodules) > 0:
+        with open(path.join(sourcePath, ".gitmodules"), 'w') as modulesFile:
+            for submodule, submoduleBranch, sha in submodules:
+                modulePath = submodule.split("/")[-1] if submodule.startswith("cdapio/") else "app-artifacts/" + submodule.split("/")[-1]
+                modulesFile.write('[submodule "%s"]\n\tpath = %s\n\turl = ../../%s.git\n\tbranch = %s\n' % (modulePath, modulePath, submodule, submoduleBranch))
+    # The gitlinks are added after the files, 'add -A' would remove them again since the submodules are not checked out
+    runGit(sourcePath, ['add', '-A'], env)
+    for submodule, submoduleBranch, sha in submodules:
+        modulePath = submodule.split("/")[-1] if submodule.startswith("cdapio/") else "app-artifacts/" + submodule.split("/")[-1]
+        runGit(sourcePath, ['update-index', '--add', '--cacheinfo', "160000,%s,%s" % (sha, modulePath)], env)
+    runGit(sourcePath, ['commit', '-q', '-m', "Initial commit"], env)
+    runGit(sourcePath, ['branch', branch], env)
+    runGit(fixture.basePath, ['clone', '-q', '--bare', sourcePath, path.join(fixture.remotesPath, repo + ".git")], env)
+    return runGit(sourcePath, ['rev-parse', 'HEAD'], env)
+
+def createRepos(fixture, env):
+    """
+    Creates the synthetic topology: cdap-build has cdap, hydrator-plugins and the first half of the plugins as submodules,
+    hydrator-plugins has the other half as submodules (so the submodules are nested)
+    """
+
+    half = len(fixture.plugins) // 2
+    pluginShas = [(plugin, pluginsBranch, createRepo(fixture, plugin, pluginsBranch, pluginsVersion, [], env)) for plugin in fixture.plugins]
+    cdapSha = createRepo(fixture, "cdapio/cdap", cdapBranch, version, [], env)
+    hydratorSha = createRepo(fixture, "cdapio/hydrator-plugins", pluginsBranch, pluginsVersion, pluginShas[half:], env)
+    createRepo(fixture, "cdapio/cdap-build", cdapBranch, version,
+               [("cdapio/cdap", cdapBranch, cdapSha), ("cdapio/hydrator-plugins", pluginsBranch, hydratorSha)] + pluginShas[:half], env)
+    with open(path.join(fixture.runPath, "repos.txt"), 'w') as reposFile:
+        reposFile.write("\n".join(fixture.repos) + "\n")
+
+def createLicenseData(fixture, hostURL):
+    """
+    Returns the (artifact, url, license) triples for generateLicenses, the local artifact -> URL map and the GitHub licenses.
+    Every URL is shared by two artifacts. The URLs are a mix of GitHub repos (API), GitHub license files (raw),
+    plain-text URLs and broken URLs that fall back to the local map
+    """
+
+    data = []
+    localMap = {}
+    licenses = {}
+    for i in range(fixture.artifacts):
+        artifact = "io.bench:artifact-%04d" % i
+        library = "bench-libs/lib-%04d" % (i // 2)
+        licenses[library] = "Apache License, Version 2.0 (synthetic copy for %s)\n" % library
+        kind = (i // 2) % 5
+        if kind <= 1:
+            url = "https://github.com/%s" % library
+        elif kind == 2:
+            url = "https://github.com/%s/blob/master/LICENSE" % library
+        elif kind == 3:
+            url = "%s/licenses/lib-%04d.txt" % (hostURL, i // 2)
+        else:
+            url = "%s/moved/lib-%04d" % (hostURL, i // 2)
+            localMap[artifact] = "https://github.com/%s" % library
+        data.append(("%s:1.0.%d" % (artifact, i % 3), url, "Apache License, Version 2.0"))
+    return data, localMap, licenses
+
+def createIssues(fixture):
+    """ Returns synthetic JIRA issues for the version, 4 out of 5 have release notes """
+
+    issueTypes = ['New Feature', 'Improvement', 'Bug', 'Task']
+    issues = []
+    for i in range(fixture.issues):
+        note = "Synthetic release note %d" % i if i % 5 != 0 else None
+        issues.append({'key': "CDAP-%d" % (10000 + i), 'fields': {
+            'status': {'name': "Closed"}, 'resolution': {'name': "Fixed"}, 'issuetype': {'name': issueTypes[i % len(issueTypes)]},
+            releaseNotesField: note}})
+    return issues
+
+def mergePR(fixture, repo, pr, env):
+    """ Merges a PR of the stand-in by moving the base branch of the bare repo to the head branch, the data lock must be held """
+
+    runGit(path.join(fixture.remotesPath, repo + ".git"), ['update-ref', "refs/heads/%s" % pr['baseRefName'], "refs/heads/%s" % pr['headRefName']], env)
+    pr['state'] = 'MERGED'
+
+def mergePRs(fixture, github, env):
+    """ Merges every open PR in the stand-in, the tools have to notice that the release branches moved """
+
+    with github.dataLock:
+        for repo, prs in github.prs.items():
+            for pr in prs:
+                if pr.get('state', 'OPEN') == 'OPEN':
+                    mergePR(fixture, repo, pr, env)
+
+def advanceBranch(fixture, repo, branch, env):
+    """ Adds an empty commit to a branch of the bare repo, like a change merged by someone else """
+
+    gitDir = path.join(fixture.remotesPath, repo + ".git")
+    sha = runGit(gitDir, ['commit-tree', "refs/heads/%s^{tree}" % branch, '-p', "refs/heads/%s" % branch, '-m', "Change on %s" % branch], env)
+    runGit(gitDir, ['update-ref', "refs/heads/%s" % branch, sha], env)
+
+def percentile(values, p):
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+def getLatencies(durations):
+    """ Returns the count and latency percentiles (milliseconds) for a list of durations in seconds """
+
+    if len(durations) == 0:
+        return {'count': 0}
+    return {'count': len(durations), 'p50': percentile(durations, 50) * 1000, 'p95': percentile(durations, 95) * 1000,
+            'max': max(durations) * 1000, 'total': sum(durations)}
+
+def createResult(scenario, seconds, items, unit, spans, checks):
+    """ Builds the result of a scenario from its wall time and the spans (name, category, seconds) recorded while it ran """
+
+    failed = [check for check, passed in checks.items() if not passed]
+    for check in failed:
+        print("WARN: %s: check failed: %s" % (scenario, check))
+    return {'scenario': scenario, 'seconds': seconds, 'items': items, 'unit': unit, 'throughput': items / seconds if seconds > 0 else None,
+            'git': getLatencies([s[2] for s in spans if s[1] == tracing.gitCategory]),
+            'http': getLatencies([s[2] for s in spans if s[1] == tracing.httpCategory]),
+            'phases': {s[0]: s[2] for s in spans if s[1] == tracing.phaseCategory},
+            'ok': len(failed) == 0}
+
+def runModifyVersions(fixture, scenario, args, github, env, verbose):
+    """ Runs modifyVersions with a trace and returns (seconds, spans, exit code) """
+
+    tracePath = path.join(fixture.basePath, "%s.trace.json" % scenario)
+    command = [sys.executable, path.join(toolsPath, "modifyVersions.py"), version] + args + \
+              ['--no-input', '--github-api', github.getURL(), '--trace', tracePath,
+               '--on', 'snapshot_cdap_version=fix', '--on', 'non_snapshot_pom=skip', '--on', 'snapshot_pom=skip']
+    start = time.time()
+    with open(path.join(fixture.basePath, "%s.log" % scenario), 'w') as logFile:
+        code = subprocess.call(command, cwd=fixture.runPath, env=env, stdout=None if verbose else logFile, stderr=subprocess.STDOUT)
+    seconds = time.time() - start
+    if code != 0:
+        print("WARN: %s exited with code %d, see %s" % (scenario, code, logFile.name))
+    spans = []
+    if path.exists(tracePath):
+        with open(tracePath) as traceFile:
+            spans = [(e['name'], e['cat'], e['dur'] / 1000000.0) for e in json.load(traceFile)['traceEvents'] if e['ph'] == 'X']
+    return seconds, spans, code
+
+def benchmarkPlan(fixture, github, env, verbose):
+    seconds, spans, _ = runModifyVersions(fixture, 'plan', ['plan'], github, env, verbose)
+    with open(path.join(fixture.runPath, "releasePlan.json")) as planFile:
+        plan = json.load(planFile)
+    checks = {'every repo is planned': all('error' not in plan['repos'].get(repo, {'error': None}) for repo in fixture.repos)}
+    return createResult('plan', seconds, len(fixture.repos), 'repos', spans, checks)
+
+def benchmarkVersions(fixture, operation, github, env, verbose):
+    prsBefore = sum(len(prs) for prs in github.prs.values())
+    seconds, spans, _ = runModifyVersions(fixture, operation, [operation], github, env, verbose)
+    prsCreated = sum(len(prs) for prs in github.prs.values()) - prsBefore
+    checks = {'a PR is created for every repo': prsCreated == len(fixture.repos)}
+    if operation == 'bump_to_snapshot':
+        checks['every repo is tagged'] = sum(len(refs) for refs in github.refs.values()) == len(fixture.repos)
+    result = createResult(operation, seconds, len(fixture.repos), 'repos', spans, checks)
+    result['poms'] = len(fixture.repos) * fixture.modules
+    return result
+
+def benchmarkSubmodules(fixture, github, env, verbose):
+    """
+    Moves the release branch of every repo that is a submodule and runs update_submodules. The stand-in merges every PR as soon
+    as it is created, so the repos are updated in dependency order without waiting for a review
+    """
+
+    withSubmodules = ["cdapio/hydrator-plugins", "cdapio/cdap-build"]
+    advanceBranch(fixture, "cdapio/cdap", cdapBranch, env)
+    for plugin in fixture.plugins:
+        advanceBranch(fixture, plugin, pluginsBranch, env)
+    prsBefore = {repo: len(github.prs.get(repo, [])) for repo in withSubmodules}
+    github.onPRCreated = lambda repo, pr: mergePR(fixture, repo, pr, env)
+    try:
+        seconds, spans, code = runModifyVersions(fixture, 'update_submodules', ['update_submodules', '--restart'], github, env, verbose)
+    finally:
+        github.onPRCreated = None
+    checks = {'a PR is created for every repo with submodules': all(len(github.prs.get(repo, [])) > prsBefore[repo] for repo in withSubmodules),
+              'the run succeeds': code == 0}
+    return createResult('update_submodules', seconds, len(withSubmodules), 'repos', spans, checks)
+
+def getSpans(start):
+    """ Returns the spans that were recorded by this process since the given index """
+
+    return [(s['name'], s['cat'], s['duration']) for s in tracing.spans[start:]]
+
+def benchmarkLicenses(fixture, scenario, host, github, verbose):
+    """
+    Runs createArtifactLicenseMap in this process against the stand-ins. The licenses scenario starts with an empty license cache,
+    licenses_cached reuses the cache of the earlier scenarios as-is and licenses_revalidated revalidates every cached license.
+    licenses_rate_limited starts with an empty cache too and uses the REST API for every GitHub repo, the GitHub stand-in allows
+    about a tenth of those requests per second
+    """
+
+    import generateLicenses
+    import githubRateLimit
+    import licenseCache
+    if scenario in ['licenses', 'licenses_rate_limited'] and path.exists(licenseCache.getCachePath()):
+        os.remove(licenseCache.getCachePath())
+    licenseCache.cacheLoaded = False
+    licenseCache.cache = {section: {} for section in licenseCache.cache}
+    licenseCache.setFreshTTL(0 if scenario == 'licenses_revalidated' else 24*60*60)
+    licenseCache.stats.update({stat: 0 for stat in licenseCache.stats})
+    githubRateLimit.quotas.clear()
+    githubRateLimit.stats.update({stat: 0 for stat in githubRateLimit.stats})
+    github.rateLimit = max(20, fixture.artifacts // 10) if scenario == 'licenses_rate_limited' else None
+    github.rateLimitWindow = 1
+    github.rateLimitUsage.clear()
+    github.rateLimitRejected = 0
+    data, localMap, licenses = createLicenseData(fixture, host.getURL())
+    github.licenses.update(licenses)
+    generateLicenses.githubAPIURL = github.getURL()
+    generateLicenses.githubRawURL = github.getURL() + "/raw"
+    generateLicenses.githubToken = "benchmark"
+    generateLicenses.localArtifactUrlMap.update(localMap)
+    generateLicenses.setGraphQLBatchSize(0 if scenario == 'licenses_rate_limited' else 100)
+
+    spansStart = len(tracing.spans)
+    start = time.time()
+    with tracing.phase(scenario):
+        if verbose:
+            licenseMap = generateLicenses.createArtifactLicenseMap(data)
+        else:
+            with open(path.join(fixture.basePath, "%s.log" % scenario), 'w') as logFile:
+                stdout = sys.stdout
+                sys.stdout = logFile
+                try:
+                    licenseMap = generateLicenses.createArtifactLicenseMap(data)
+                finally:
+                    sys.stdout = stdout
+    seconds = time.time() - start
+    spans = getSpans(spansStart)
+    checks = {'a license is found for every artifact': len(licenseMap) == len(data)}
+    if scenario in ['licenses_cached', 'licenses_revalidated']:
+        checks['no license is downloaded again'] = licenseCache.stats['downloaded'] == 0
+        checks['urls without a license are skipped'] = licenseCache.stats['skipped'] == len(set(url for artifact, url, lic in data if '/moved/' in url))
+    if scenario == 'licenses_cached':
+        checks['no request is sent'] = not any(s[1] == tracing.httpCategory for s in spans)
+    if scenario == 'licenses_rate_limited':
+        checks['no request is rejected by the rate limit'] = github.rateLimitRejected == 0
+        checks['no wait is longer than the rate limit window'] = all(s[2] <= github.rateLimitWindow + githubRateLimit.clockSkew + 1
+                                                                    for s in spans if s[1] == tracing.waitCategory)
+    github.rateLimit = None
+    return createResult(scenario, seconds, len(data), 'artifacts', spans, checks)
+
+def benchmarkReleaseNotes(fixture, host):
+    """ Runs the JIRA search and writes the release notes in this process against the stand-in """
+
+    try:
+        import jira
+        import generateReleaseNotes
+    except ImportError:
+        print("WARN: Skipping the release_notes scenario, the jira module is not installed (see setup.sh)")
+        return None
+
+    spansStart = len(tracing.spans)
+    start = time.time()
+    with tracing.phase("release notes"):
+        agent = jira.JIRA(host.getURL(), auth=("benchmark", "benchmark"))
+        tracing.instrumentSession(agent._session)
+        releaseNotes, noReleaseNotesResults = generateReleaseNotes.fetchReleaseNotes(agent, version)
+        generateReleaseNotes.writeReleaseNotes(releaseNotes, path.join(fixture.basePath, "releaseNotes.rst"))
+    seconds = time.time() - start
+    notes = sum(len(notesOfType) for notesOfType in releaseNotes.values())
+    checks = {'every release note is found': notes + noReleaseNotesResults['total'] == fixture.issues}
+    return createResult('release_notes', seconds, fixture.issues, 'issues', getSpans(spansStart), checks)
+
+def printResults(results):
+    """ Prints one line per scenario with its throughput and the latency of its git commands and HTTP requests """
+
+    print("\n%-22s %8s %14s %12s %26s %26s" % ("Scenario", "Seconds", "Items", "Throughput", "git p50/p95 (count)", "http p50/p95 (count)"))
+    for result in results:
+        cells = []
+        for category in ['git', 'http']:
+            latencies = result[category]
+            cells.append("%.1f/%.1fms (%d)" % (latencies['p50'], latencies['p95'], latencies['count']) if latencies['count'] > 0 else "-")
+        print("%-22s %7.2fs %14s %12s %26s %26s%s" % (result['scenario'], result['seconds'], "%d %s" % (result['items'], result['unit']),
+              "%.1f/s" % result['throughput'], cells[0], cells[1], "" if result['ok'] else "  (checks failed)"))
+
+def parseArgs():
+    """ Parse command line arguments """
+
+    parser = argparse.ArgumentParser(
+        description='Offline benchmark for the release tools, runs them end to end against synthetic repos and local stand-ins for GitHub and JIRA.')
+
+    parser.add_argument('--repos',
+                        type=int,
+                        default=10,
+                        help='number of plugin repos besides cdap, hydrator-plugins and cdap-build, default is 10')
+
+    parser.add_argument('--modules',
+                        type=int,
+                        default=200,
+                        help='number of pom files in every repo, default is 200')
+
+    parser.add_argument('--artifacts',
+                        type=int,
+                        default=400,
+                        help='number of third-party artifacts to fetch licenses for, default is 400')
+
+    parser.add_argument('--issues',
+                        type=int,
+                        default=500,
+                        help='number of JIRA issues for the version, default is 500')
+
+    parser.add_argument('--latency',
+                        type=float,
+                        default=20,
+                        help='milliseconds the stand-ins wait before every response to mimic the network, default is 20')
+
+    parser.add_argument('-s', '--scenarios',
+                        nargs='+',
+                        choices=scenarioNames,
+                        default=scenarioNames,
+                        help='scenarios to run, default is all of them. bump_to_snapshot merges the PRs of remove_snapshot first if it was run')
+
+    parser.add_argument('-o', '--output',
+                        type=str,
+                        default=resultsFilename,
+                        help='JSON file for the results, default is %s' % resultsFilename)
+
+    parser.add_argument('-v', '--verbose',
+                        action='store_true',
+                        help='show the output of the tools')
+
+    return parser.parse_args()
+
+
+def main():
+    args = parseArgs()
+    basePath = path.join(os.getcwd(), workspaceFolder)
+    outputPath = path.abspath(args.output)
+    if path.exists(basePath):
+        shutil.rmtree(basePath)
+    fixture = Fixture(basePath, args.repos, args.modules, args.artifacts, args.issues)
+    for folder in [fixture.remotesPath, fixture.sourcesPath, fixture.runPath]:
+        os.makedirs(folder)
+    env = getGitEnv(fixture)
+
+    print("Generating %d repos with %d pom files each in '%s'" % (len(fixture.repos), fixture.modules, basePath))
+    start = time.time()
+    createRepos(fixture, env)
+    print("Generated the repos in %.2fs" % (time.time() - start))
+
+    github = githubStandIn.startStandIn({}, latency=args.latency / 1000)
+    host = HostStandIn(('127.0.0.1', 0), createIssues(fixture), latency=args.latency / 1000)
+    githubStandIn.startServer(host)
+    tracing.setTraceFilename(path.join(basePath, "benchmark.trace.json"))
+
+    results = []
+    os.chdir(fixture.runPath)  # The tools read repos.txt from the working directory
+    for scenario in args.scenarios:
+        print("Running %s" % scenario)
+        if scenario == 'plan':
+            results.append(benchmarkPlan(fixture, github, env, args.verbose))
+        elif scenario in ['remove_snapshot', 'bump_to_snapshot']:
+            if scenario == 'bump_to_snapshot':
+                mergePRs(fixture, github, env)
+            results.append(benchmarkVersions(fixture, scenario, github, env, args.verbose))
+        elif scenario == 'update_submodules':
+            results.append(benchmarkSubmodules(fixture, github, env, args.verbose))
+        elif scenario.startswith('licenses'):
+            results.append(benchmarkLicenses(fixture, scenario, host, github, args.verbose))
+        elif scenario == 'release_notes':
+            result = benchmarkReleaseNotes(fixture, host)
+            if result is not None:
+                results.append(result)
+
+    printResults(results)
+    with open(outputPath, 'w') as outputFile:
+        json.dump({'parameters': vars(args), 'results': results}, outputFile, indent=2)
+    print("Results written to %s" % outputPath)
+    return 0 if all(result['ok'] for result in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
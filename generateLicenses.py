@@ -1,10 +1,18 @@
-from subprocess import call
+from tracing import call
 import git
+import journal
+import refIndex
+import tracing
+import githubRateLimit
+import licenseCache
 from os import path
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import requests
 import os
 import re
-import requests
-import subprocess
 import json
 import time
 import sys
@@ -18,10 +26,32 @@ reposFilename = "repos.txt"
 combinedFilename = 'combinedThirdParty.txt'
 dependencySumFilePath = 'summary.tsv'
 missingSumFilePath = 'missingSummary.tsv'
+missingSumHeader = 'artifact\turl\tlicense\treason'  # Every row has all four columns, the reason is empty if it is not known
 
 cdapBuildRepo = 'cdapio/cdap-build'
 cdapRepo = 'cdapio/cdap'
 
+# Both can be pointed at a local stand-in (see githubStandIn.py)
+githubAPIURL = os.environ.get("GITHUB_API_URL", "https://api.github.com")
+githubRawURL = os.environ.get("GITHUB_RAW_URL", "https://raw.githubusercontent.com")
+
+# Licenses are downloaded concurrently through one keep-alive session, with a limit on the requests in flight per host
+fetchWorkers = 32
+maxRequestsPerHost = 8
+requestTimeout = 30
+graphQLBatchSize = 100  # GitHub repos whose license is looked up with a single GraphQL query, 0 uses the REST API for every repo
+rateLimitRetries = 3  # Times a rate limited GitHub API request is retried, the scheduler holds it back until the limit is lifted
+session = None
+sessionLock = threading.Lock()
+hostSlots = {}  # Map of host -> semaphore that limits the requests in flight to that host
+hostSlotsLock = threading.Lock()
+
+# How a license is extracted from the response of the URL it was downloaded from
+rawKind = 'raw'  # Raw file from Github
+apiKind = 'api'  # Github license API
+textKind = 'text'  # Plain text file from any other host
+graphQLKind = 'graphql'  # Raw file from Github that was looked up with GraphQL, the etag of the cached license is the git blob id
+
 
 # Regex needed for matching and cleaning urls
 licenseRegex = r'\((.*)\) .* \((.*) - (http.*)\)'
@@ -31,9 +61,20 @@ githubURLSub = r'https://github.com/\1/\2'
 nonGithubURLRegex = r'https?:\/\/([^\.]*)\.([^\.^\/]*)\.[a-zA-Z]\/?.*'
 nonGithubURLSub = r'https://github.com/\2/\1'
 githubLicenseRegex = r'https?:\/\/github\.com\/([^\/]*)\/([^\/]*)[\/blob\/]*(.*)'
-githubLicenseSub = r'https://raw.githubusercontent.com/\1/\2/\3'
+githubLicenseSub = r'%s/\1/\2/\3'
 uiPomVersionRegex = r'<nodeVersion>v(.*)</nodeVersion>$'
 
+# The licenses of GitHub repos are looked up in batches with GraphQL. Every repo is aliased (l0, l1, ...) and the common
+# license file names are tried at the root of its default branch, repos whose license file has another name fall back to the REST API
+licenseFileNames = ['LICENSE', 'LICENSE.txt', 'LICENSE.md', 'LICENSE-2.0.txt', 'LICENCE', 'COPYING']
+licenseRepoQuery = """
+  l%(i)d: repository(owner: $o%(i)d, name: $n%(i)d) {
+    licenseInfo { spdxId }
+    defaultBranchRef { name }%(files)s
+  }"""
+licenseFileQuery = """
+    f%(j)d: object(expression: "HEAD:%(name)s") { ... on Blob { oid text } }"""
+
 # Read repos contents
 reposFilePath = path.join(os.getcwd(), reposFilename)
 reposFile = open(reposFilePath)
@@ -115,12 +156,108 @@ def getGithubAuthHeader():
     return {'Authorization': 'token %s' % githubToken}
 
 
-def getLicenseFromGithub(url, redirectURL=None):
+def setFetchWorkers(workers):
+    global fetchWorkers
+    fetchWorkers=max(1, workers)
+
+def setGraphQLBatchSize(size):
+    global graphQLBatchSize
+    graphQLBatchSize=max(0, size)
+
+def setMaxRequestsPerHost(maxRequests):
+    global maxRequestsPerHost
+    maxRequestsPerHost=max(1, maxRequests)
+
+def getSession():
+    """ Returns the shared keep-alive session, it keeps up to maxRequestsPerHost connections open to each host """
+
+    global session
+    with sessionLock:
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=fetchWorkers, pool_maxsize=maxRequestsPerHost)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+    return session
+
+def getHostSlot(url):
+    """ Returns the semaphore that limits the requests in flight to the host of a URL """
+
+    host = urlparse(url).netloc
+    with hostSlotsLock:
+        if host not in hostSlots:
+            hostSlots[host] = threading.BoundedSemaphore(maxRequestsPerHost)
+        return hostSlots[host]
+
+def fetch(url, headers=None):
+    """ Sends a GET request through the shared session once the host of the URL has a free slot, GitHub API requests also wait for the rate limit """
+
+    with getHostSlot(url):
+        if url.startswith(githubAPIURL) and not url.startswith(githubRawURL):
+            return githubRateLimit.request("GET", url, session=getSession(), headers=headers, timeout=requestTimeout)
+        return tracing.request("GET", url, session=getSession(), headers=headers, timeout=requestTimeout)
+
+
+class DownloadedLicense():
+    """ Class to hold a downloaded license together with the URL and response it came from, so it can be cached """
+
+    def __init__(self, content, resolvedURL, kind, response):
+        self.content = content
+        self.resolvedURL = resolvedURL
+        self.kind = kind  # One of the *Kind constants, tells how the license was extracted from the response
+        self.response = response
+
+
+def extractLicense(kind, resp):
+    """ Returns the license contents of a successful response, None if the response does not contain a license """
+
+    if kind in [rawKind, graphQLKind]:
+        return base64.encodebytes(resp.text.encode('utf-8')).decode('utf-8')  # base64 encoded
+    if kind == apiKind:
+        return resp.json().get('content')  # base64 encoded
+    if resp.headers.get('content-type') == "text/plain":
+        return resp.text
+    return None
+
+
+def getGithubRepo(url):
+    """ Returns the repo (ex. 'cdapio/cdap') of a Github URL, None for other URLs """
+
+    match = re.match(githubURLRegex, url)
+    if match is None:
+        return None
+    return "%s/%s" % match.groups()
+
+def getGithubRepoOfRepoURL(url):
+    """ Returns the repo of a URL that points at a whole Github repo (ex. https://github.com/cdapio/cdap), None for links to files and other URLs """
+
+    repo = getGithubRepo(url)
+    if repo is None or re.sub(githubURLRegex, githubURLSub, url) != url.rstrip('/'):
+        return None
+    return repo
+
+
+def recordFailure(failures, source, resp=None, error=None):
+    """ Adds the reason a request did not return a license to the failures list (if one is given) """
+
+    if failures is None:
+        return
+    if error is not None:
+        failures.append(("%s: %s" % (source, type(error).__name__), True))
+    elif resp.status_code == 200:
+        failures.append(("%s: not a license (%s)" % (source, resp.headers.get('content-type')), False))
+    else:
+        failures.append(("%s: HTTP %d" % (source, resp.status_code),
+                         resp.status_code >= 500 or resp.status_code == 429 or githubRateLimit.getRetryWait(resp) is not None))
+
+
+def getLicenseFromGithub(url, redirectURL=None, failures=None):
     """
     Gets the base64 encoded license contents from the given Github URL. If the url 
     provided is a direct link to a license file then it is downloaded normally.
     However if that fails then the Github API is used to fetch the license contents.
     If that also fails that means this is not a valid Github repo URL.
+    Returns a DownloadedLicense, or None if no license was found. The reasons are added to failures as (reason, transient) tuples
     """
 
     if url is None:
@@ -129,13 +266,19 @@ def getLicenseFromGithub(url, redirectURL=None):
     # First attempt to fetch the license directly from this URL
     # Regex is used to convert the URL in the 'raw.githubusercontent' domain
     # so we can download the raw file contents instead of HTML
-    directURL = re.sub(githubLicenseRegex, githubLicenseSub, url)
+    directURL = re.sub(githubLicenseRegex, githubLicenseSub % githubRawURL, url)
     if directURL != url:
-        resp = requests.get(directURL)
+        try:
+            resp = fetch(directURL)
+        except requests.exceptions.RequestException as e:
+            resp = None
+            recordFailure(failures, "raw file", error=e)
 
         # If this works then return the string in base64 (to save space)
-        if resp.status_code == 200:
-            return base64.encodebytes(resp.text.encode('utf-8')).decode('utf-8')  # base64 encoded
+        if resp is not None and resp.status_code == 200:
+            return DownloadedLicense(extractLicense(rawKind, resp), directURL, rawKind, resp)
+        if resp is not None:
+            recordFailure(failures, "raw file", resp)
 
     # If this URL is not a redirect URL and it is not a Github URL then quit
     if redirectURL is None and re.match(githubURLRegex, url) is None:
@@ -146,52 +289,213 @@ def getLicenseFromGithub(url, redirectURL=None):
     if redirectURL is not None:
         githubUrl = redirectURL
     else:
-        apiRequestRegexSub = r'https://api.github.com/repos/\1/\2/license'
+        apiRequestRegexSub = githubAPIURL + r'/repos/\1/\2/license'
         githubUrl = re.sub(githubURLRegex, apiRequestRegexSub, url)
     try:
-      resp = requests.get(githubUrl, headers=getGithubAuthHeader())
-
-      # This should not happen if the user is authenticated unless we are processing >4000 licenses
-      if resp.status_code == 403:
-          print("WARN: Hit GitHub rate limit. Sleeping for 5 minutes...")
-          time.sleep(5*60)
-          return getLicenseFromGithub(url)
+      # Rate limits should not be hit if the user is authenticated unless we are processing >4000 licenses.
+      # The retry waits in fetch until the advertised reset, a 403 that is not a rate limit is a permission error
+      for attempt in range(rateLimitRetries + 1):
+          resp = fetch(githubUrl, headers=getGithubAuthHeader())
+          if githubRateLimit.getRetryWait(resp) is None or attempt == rateLimitRetries:
+              break
+          print("WARN: Hit GitHub rate limit, retrying %s once it is lifted" % githubUrl)
 
       # If the request fails then quit
       if resp.status_code != 200:
+          recordFailure(failures, "license API", resp)
           return None
 
       # Extract the base64 encoded license from the response
       respJson = resp.json()
       if 'content' in respJson:
-          return respJson['content']  # base64 encoded
+          return DownloadedLicense(respJson['content'], githubUrl, apiKind, resp)
 
       # If Github responds with a redirect url
       if 'message' in respJson and respJson['message'] == 'Moved Permanently':
-          return getLicenseFromGithub(url, redirectURL=resp['url'])
-    except:
+          return getLicenseFromGithub(url, redirectURL=respJson['url'], failures=failures)
+    except Exception as e:
       print("unexpected error")
+      recordFailure(failures, "license API", error=e)
       return None
 
     # Should never get here
     return None
     
-def getLicenseFromUrl(url):
+def getLicenseFromUrl(url, failures=None):
+    """
+    Downloads the license for a URL from Github or as a plain text file. Returns a DownloadedLicense, or None if no license was found.
+    The reasons are added to failures as (reason, transient) tuples
+    """
+
     if url is None:
         return None
-    resp = getLicenseFromGithub(url)
+    resp = getLicenseFromGithub(url, failures=failures)
     if resp is not None:
         return resp
     #attempt a text download
     try:
-         resp = requests.get(url)
-         if resp.status_code == 200 and resp.headers['content-type'] == "text/plain":  
-             return resp.text
+         resp = fetch(url)
+         if resp.status_code == 200 and resp.headers.get('content-type') == "text/plain":
+             return DownloadedLicense(resp.text, url, textKind, resp)
+         recordFailure(failures, "download", resp)
          return None
-    except:
+    except Exception as e:
+      recordFailure(failures, "download", error=e)
       return None
+
+
+def getLicense(url):
+    """
+    Returns the license contents for a URL, None if no license was found. Licenses are taken from the license cache when possible,
+    cached licenses that are not fresh anymore are revalidated with a conditional request and only downloaded again if they changed
+    """
+
+    if url is None:
+        return None
+    repo = getGithubRepoOfRepoURL(url)  # Only URLs of whole repos share the license of their repo, links to files have their own
+    resolvedURL, entry = licenseCache.lookup(url, repo)
+    if entry is not None:
+        if licenseCache.isFresh(entry):
+            licenseCache.touch(url, resolvedURL)
+            return entry['content']
+
+        headers = licenseCache.getConditionalHeaders(entry)
+        if entry['kind'] == apiKind:
+            headers.update(getGithubAuthHeader())
+        try:
+            resp = fetch(resolvedURL, headers=headers)
+        except requests.exceptions.RequestException:
+            resp = None
+
+        # Unchanged, or the server could not be reached or is rate limited (the cached license is better than none)
+        if resp is None or resp.status_code == 304 or resp.status_code >= 500 or githubRateLimit.getRetryWait(resp) is not None:
+            licenseCache.touch(url, resolvedURL, revalidated=resp is not None and resp.status_code == 304)
+            return entry['content']
+        content = extractLicense(entry['kind'], resp) if resp.status_code == 200 else None
+        if content is not None:
+            licenseCache.store(url, resolvedURL, entry['kind'], content, resp.headers, entry['repo'])
+            return content
+        licenseCache.remove(resolvedURL)  # The license is gone from where it was cached from, look it up again
+
+    # URLs that did not have a license the last times they were tried are skipped, the artifacts go straight to the local map
+    if licenseCache.getFailure(url) is not None:
+        return None
+
+    failures = []
+    downloaded = getLicenseFromUrl(url, failures)
+    if downloaded is None or downloaded.content is None:
+        if len(failures) > 0 and not any(transient for reason, transient in failures):
+            licenseCache.recordFailure(url, "; ".join(reason for reason, transient in failures))
+        return None
+    licenseCache.clearFailure(url)
+    licenseCache.store(url, downloaded.resolvedURL, downloaded.kind, downloaded.content, downloaded.response.headers,
+                       repo if downloaded.kind == apiKind else None)
+    return downloaded.content
     
 
+def queryGithubLicenses(repos):
+    """
+    Looks up the license file of each given GitHub repo with a single GraphQL query.
+    Returns a map of repo -> (raw URL of the license file, license text, git blob id), (None, None, None) for repos that do not exist
+    or do not have a license.
+    Repos that have a license that was not found under one of the common file names are left out
+    """
+
+    declarations = []
+    selections = []
+    variables = {}
+    files = "".join(licenseFileQuery % {'j': j, 'name': name} for j, name in enumerate(licenseFileNames))
+    for i, repo in enumerate(repos):
+        owner, name = repo.split("/", 1)
+        declarations += ["$o%d: String!" % i, "$n%d: String!" % i]
+        selections.append(licenseRepoQuery % {'i': i, 'files': files})
+        variables.update({'o%d' % i: owner, 'n%d' % i: name})
+    query = "query(%s) {%s\n}" % (", ".join(declarations), "".join(selections))
+    url = githubAPIURL + "/graphql"
+    with getHostSlot(url):
+        resp = githubRateLimit.request("POST", url, session=getSession(), headers=getGithubAuthHeader(), timeout=requestTimeout,
+                                       json={'query': query, 'variables': variables})
+    resp.raise_for_status()
+    data = resp.json().get('data')  # Missing repos are reported in 'errors' next to the data of the other repos
+    if data is None:
+        raise Exception("; ".join(e.get('message', str(e)) for e in resp.json().get('errors', [])))
+
+    licenses = {}
+    for i, repo in enumerate(repos):
+        repository = data.get('l%d' % i)
+        if repository is None or repository['licenseInfo'] is None:
+            licenses[repo] = (None, None, None)  # Repo does not exist (or is not visible with our token) or GitHub did not detect a license
+            continue
+        for j, name in enumerate(licenseFileNames):
+            blob = repository.get('f%d' % j)
+            if blob is not None and blob.get('text') is not None and repository['defaultBranchRef'] is not None:
+                licenses[repo] = ("%s/%s/%s/%s" % (githubRawURL, repo, repository['defaultBranchRef']['name'], name), blob['text'], blob['oid'])
+                break
+    return licenses
+
+def resolveGithubLicenses(urls):
+    """
+    Looks up the licenses of the GitHub repo URLs in batches of graphQLBatchSize repos, instead of one REST request (or more) per URL.
+    Repo URLs that are not cached are looked up, as are stale licenses that were looked up with GraphQL before (they are revalidated
+    by their git blob id). Returns a map of url -> license contents (None if the repo has no license) for the URLs that were resolved,
+    the other URLs are left to getLicense
+    """
+
+    if graphQLBatchSize == 0:
+        return {}
+    repoURLs = {}  # Map of repo -> URLs of that repo
+    cached = {}  # Map of repo -> (resolved URL, entry) of the stale license to revalidate
+    for url in urls:
+        repo = getGithubRepoOfRepoURL(url)
+        if repo is None:
+            continue  # Links to license files are downloaded directly
+        resolvedURL, entry = licenseCache.lookup(url, repo)
+        if entry is not None and (licenseCache.isFresh(entry) or entry['kind'] != graphQLKind):
+            continue
+        if entry is None and licenseCache.hasFailure(url):
+            continue
+        repoURLs.setdefault(repo, []).append(url)
+        if entry is not None:
+            cached[repo] = (resolvedURL, entry)
+    repos = list(repoURLs)
+    batches = [repos[i:i + graphQLBatchSize] for i in range(0, len(repos), graphQLBatchSize)]
+    if len(batches) == 0:
+        return {}
+
+    def queryBatch(batch):
+        try:
+            return queryGithubLicenses(batch)
+        except Exception as e:
+            print("WARN: Failed to look up the licenses of %d GitHub repos with GraphQL, they will be fetched one by one: %s" % (len(batch), e))
+            return {}
+
+    print("DEBUG: Looking up the licenses of %d GitHub repos in %d GraphQL queries" % (len(repos), len(batches)))
+    with ThreadPoolExecutor(max_workers=fetchWorkers) as executor:
+        results = list(executor.map(queryBatch, batches))
+
+    licenses = {}
+    for repoLicenses in results:
+        for repo, (resolvedURL, text, oid) in repoLicenses.items():
+            cachedURL, entry = cached.get(repo, (None, None))
+            if text is None:
+                if entry is not None:
+                    licenseCache.remove(cachedURL)  # The repo or its license is gone
+                for url in repoURLs[repo]:
+                    licenseCache.recordFailure(url, "GraphQL: repository not found or no license")
+                    licenses[url] = None
+                continue
+
+            unchanged = entry is not None and cachedURL == resolvedURL and entry['etag'] == oid
+            content = entry['content'] if unchanged else base64.encodebytes(text.encode('utf-8')).decode('utf-8')  # base64 encoded like raw files
+            for i, url in enumerate(repoURLs[repo]):
+                licenses[url] = content
+                if i == 0 and not unchanged:
+                    licenseCache.clearFailure(url)
+                    licenseCache.store(url, resolvedURL, graphQLKind, content, {'ETag': oid}, repo)
+                else:
+                    licenseCache.touch(url, resolvedURL, revalidated=unchanged)
+    return licenses
+
 def getUrlFromLocalMap(artifact):
     """ Helper function to retreive URL for a given artifact from the local map """
     artifactWithoutVersion = ':'.join(artifact.split(':')[:-1])
@@ -200,45 +504,70 @@ def getUrlFromLocalMap(artifact):
     return localArtifactUrlMap[artifactWithoutVersion]
 
 
+def fetchLicenses(urls):
+    """
+    Downloads the licenses for several URLs concurrently, each URL only once. GitHub repos are looked up in GraphQL batches first.
+    Returns a map of url -> license contents (None if it failed)
+    """
+
+    urls = list(dict.fromkeys(url for url in urls if url is not None))
+    licenses = resolveGithubLicenses(urls)
+    urls = [url for url in urls if url not in licenses]
+    with ThreadPoolExecutor(max_workers=fetchWorkers) as executor:
+        licenses.update(zip(urls, executor.map(getLicense, urls)))
+    licenses[None] = None
+    return licenses
+
+
 def createArtifactLicenseMap(data):
     """ 
     Generates a map for artifacts to license contents (base64 encoded).
     This function will attempt to first get the license from the URL provided in the data.
     If that fails it will fall back to the local map in 'artifactToRepoMap.csv'.
-    If that also fails then 
+    If that also fails then the artifact is left out of the map.
+    The licenses are downloaded concurrently, but the result is the same as visiting the artifacts in order
     """
 
     artifactLicenseMap = {}  # Main map that stores results
     urlLicenseMap = {}  # Optimization map to avoid visiting the same url twice
-    for triple in data:
-        artifact, url, lic = triple
-
-        # If we've already been to this URL before then just use that license
-        # This can occur if multuple artifacts share the same Github repo
-        if url in urlLicenseMap:
-            artifactLicenseMap[artifact] = urlLicenseMap[url]
-            continue
 
-        # Attempt to get the license using the URL from the data
-        print("DEBUG: %s - Downloading license from mvn generated url %s" % (artifact, url))
-        licenseContents = getLicenseFromUrl(url)
-
-        # If we failed to get the license from that url then try the url from the local map
-        if licenseContents is None:
-            newUrl = getUrlFromLocalMap(artifact)
-            print("DEBUG: %s - Unable to fetch license from mvn generated url, falling back to local map." % artifact)
-            print("DEBUG: %s - Downloading license from local map url %s" % (artifact, newUrl))
-            licenseContents = getLicenseFromUrl(newUrl)
+    # Attempt to get the licenses using the URLs from the data, each URL is visited once
+    # This matters if multuple artifacts share the same Github repo
+    print("DEBUG: Downloading licenses from %d mvn generated urls" % len(set(url for artifact, url, lic in data)))
+    licenseCache.loadCache()
+    mvnLicenses = fetchLicenses([url for artifact, url, lic in data])
+    urlLicenseMap.update({url: licenseContents for url, licenseContents in mvnLicenses.items() if licenseContents is not None})
+
+    # If we failed to get the license from a url then try the url from the local map.
+    # Only the first artifact of each failed url is tried at a time, the license it finds is reused by the artifacts that share the url
+    pending = [(artifact, url) for artifact, url, lic in data if url not in urlLicenseMap]
+    while len(pending) > 0:
+        firstArtifacts = {}
+        for artifact, url in pending:
+            firstArtifacts.setdefault(url, artifact)
+        for artifact in firstArtifacts.values():
+            print("DEBUG: %s - Unable to fetch license from mvn generated url, falling back to local map url %s" % (artifact, getUrlFromLocalMap(artifact)))
+        localLicenses = fetchLicenses([getUrlFromLocalMap(artifact) for artifact in firstArtifacts.values()])
+
+        for url, artifact in firstArtifacts.items():
+            licenseContents = localLicenses[getUrlFromLocalMap(artifact)]
 
             # If we failed to get the license from the local map then skip it
             if licenseContents is None:
                 print("WARN: %s - Failed to fetch license" % artifact)
                 continue
+            urlLicenseMap[url] = licenseContents
+        tried = set(firstArtifacts.values())
+        pending = [(artifact, url) for artifact, url in pending if artifact not in tried and url not in urlLicenseMap]
 
-        artifactLicenseMap[artifact] = licenseContents
-        urlLicenseMap[url] = licenseContents
-        print("DEBUG: %s - Successfully downloaded license" % artifact)
+    for artifact, url, lic in data:
+        if url in urlLicenseMap:
+            artifactLicenseMap[artifact] = urlLicenseMap[url]
+            print("DEBUG: %s - Successfully downloaded license" % artifact)
 
+    licenseCache.saveCache()
+    print("DEBUG: License cache: %(fresh)d used as-is, %(revalidated)d revalidated, %(downloaded)d downloaded, %(skipped)d urls skipped that had no license before" % licenseCache.stats)
+    githubRateLimit.printQuota()
     return artifactLicenseMap
 
 
@@ -306,7 +635,7 @@ def createCDAPLicenses(version, existingLicensesMap):
         if localURL is not None:
              parsedData.append((artifact,localURL,lic))
         else:
-             missingLicenses.append('%s\t%s\t%s' % (artifact, 'no url defined', lic))
+             missingLicenses.append('%s\t%s\t%s\t' % (artifact, 'no url defined', lic))
 
     # Clean the raw data and fetch the base64 encoded license contents
     dataToBeFetched = []
@@ -331,7 +660,8 @@ def createCDAPLicenses(version, existingLicensesMap):
 
         if artifact not in artifactLicenseMap:
             print('WARN: %s - Could not find license' % artifact)
-            missingLicenses.append('%s\t%s\t%s' % (artifact, url, lic))
+            reasons = [licenseCache.describeFailure(u) for u in [url, getUrlFromLocalMap(artifact)] if u is not None]
+            missingLicenses.append('%s\t%s\t%s\t%s' % (artifact, url, lic, '; '.join(r for r in reasons if r is not None)))
             continue
 
         licenseContents = artifactLicenseMap[artifact]
@@ -358,7 +688,8 @@ def createCDAPLicenses(version, existingLicensesMap):
     summaryFile.close()
 
     missingFile = open(missingSumFilePath, 'w')
-    missingFile.write('\n'.join(missingLicenses))
+    missingFile.write(missingSumHeader + '\n')
+    missingFile.writelines(line + '\n' for line in missingLicenses)
     missingFile.close()
 
     # return #SuccessfullyAdded, #Failed
@@ -387,7 +718,7 @@ def createUILicenses(version, existingLicensesMap):
         commands.clear()
         commands.append('cd "%s"' % uiRepoPath)
         commands.append('cat pom.xml | grep -E "%s"' % uiPomVersionRegex)  # grep using regex to only return the 'nodeVersion' lines
-        nodeVersions = subprocess.check_output(" && ".join(commands), shell=True).decode('utf-8')
+        nodeVersions = tracing.check_output(" && ".join(commands), shell=True).decode('utf-8')
         nodeVersion = re.search(uiPomVersionRegex, nodeVersions).groups()[0]  # Use the regex again to extract the version number out of the line
         print("Got node version from pom.xml, using node v%s" % nodeVersion)
 
@@ -412,13 +743,13 @@ def createUILicenses(version, existingLicensesMap):
     commands.append('sudo npm install -g gh ') # Install the gh module
     commands.append('yarn install --production')  # Install UI dependancies
     commands.append('bower install')  # Install UI dependancies
-    subprocess.call(" && ".join(commands), shell=True)
+    tracing.call(" && ".join(commands), shell=True)
 
     # Run license-checker module and parse json output
     commands.clear()
     commands.append('cd "%s"' % uiRepoPath)
     commands.append('license-checker --json --production')
-    uiLicenses = subprocess.check_output(" && ".join(commands), shell=True).decode('utf-8')
+    uiLicenses = tracing.check_output(" && ".join(commands), shell=True).decode('utf-8')
     uiLicenses = json.loads(uiLicenses)
 
     missingLicenses = []
@@ -451,7 +782,7 @@ def createUILicenses(version, existingLicensesMap):
         # Make sure the local copy of the license exists, if it doesnt then mark this license as missing
         if not path.exists(srcFilePath):
             print('WARN: Could not find license for %s' % artifact)
-            missingLicenses.append('%s\t%s\t%s' % (artifact, url, lic))
+            missingLicenses.append('%s\t%s\t%s\t' % (artifact, url, lic))  # The reason column is empty, the license file is local
             continue
 
         # Create the path and copy the license folder to the correct location
@@ -467,13 +798,50 @@ def createUILicenses(version, existingLicensesMap):
     summaryFile.close()
 
     missingFile = open(missingSumFilePath, 'a')
-    missingFile.write('\n'.join(missingLicenses))
+    missingFile.writelines(line + '\n' for line in missingLicenses)
     missingFile.close()
 
     # return #SuccessfullyAdded, #Failed
     return added, len(missingLicenses)
 
 
+def createLicenseFiles(version, releaseBranch, changeBranch):
+    """ Generates the licenses for CDAP and UI on a new change branch in the cdap repo and commits them. Returns #SuccessfullyAdded, #Failed """
+
+    with tracing.phase("sync repos"):
+        # Init cdap-build repo
+        git.cloneRepo(cdapBuildRepo)
+        git.checkoutBranch(cdapBuildRepo, git.getReleaseBranch(cdapBuildRepo, version))
+
+        # Init cdap repo, any changes and branches left over from an earlier run are removed
+        git.cloneRepo(cdapRepo)
+        git.resetLocalRepo(cdapRepo, releaseBranch)
+        git.checkoutBranch(cdapRepo, releaseBranch)
+
+        # Create a new branch in cdap repo for changes and delete the existing copyright folder
+        git.checkoutBranch(cdapRepo, changeBranch, createBranch=True)
+    alreadyExistingLicenses = os.listdir(cdapCopyrightPath)
+    existingLicensesUsedMap = {l: False for l in alreadyExistingLicenses}  # This map will be used to skip licenses that are already present
+
+    # Populate licenses for CDAP and UI
+    with tracing.phase("cdap licenses"):
+        cdapAdded, cdapFailed = createCDAPLicenses(version, existingLicensesUsedMap)
+    with tracing.phase("ui licenses"):
+        uiAdded, uiFailed = createUILicenses(version, existingLicensesUsedMap)
+
+    # Delete licenses that are no longer needed
+    for licenseFolder, used in existingLicensesUsedMap.items():
+        if used:
+            continue
+        print("DEBUG: %s - Deleted unused license file" % licenseFolder)
+        shutil.rmtree(path.join(cdapCopyrightPath, licenseFolder))
+
+    # Commit the changes and return the final numbers
+    with tracing.phase("commit"):
+        git.addAndCommit(cdapRepo, "-A", "Updated dependancy copyright license files.")
+    return cdapAdded+uiAdded, cdapFailed+uiFailed
+
+
 def parseArgs():
     """ Parse command line arguments """
 
@@ -488,6 +856,39 @@ def parseArgs():
                         type=str,
                         help='Path to place the summary files for the missing and successfully added licenses')
 
+    parser.add_argument('--restart',
+                        action='store_true',
+                        help='ignore the journal of an earlier run for the same version and generate the licenses again')
+
+    parser.add_argument('-w', '--workers',
+                        type=int,
+                        default=fetchWorkers,
+                        help='number of licenses that are downloaded at the same time, default is %d' % fetchWorkers)
+
+    parser.add_argument('--max-per-host',
+                        type=int,
+                        default=maxRequestsPerHost,
+                        help='maximum number of requests in flight to a single host (ex. api.github.com), default is %d' % maxRequestsPerHost)
+
+    parser.add_argument('--graphql-batch-size',
+                        type=int,
+                        default=graphQLBatchSize,
+                        help='number of GitHub repos whose license is looked up with a single GraphQL query, default is %d. 0 uses the REST API for every repo' % graphQLBatchSize)
+
+    parser.add_argument('--license-cache-ttl',
+                        type=float,
+                        default=licenseCache.freshTTL/3600,
+                        help='hours a cached license is used without asking the server if it changed, default is 24. 0 revalidates every cached license')
+
+    parser.add_argument('--dead-url-ttl',
+                        type=float,
+                        default=licenseCache.failureTTL/3600,
+                        help='hours a URL that had no license is skipped before it is tried again, default is 168 (a week). 0 tries every URL')
+
+    parser.add_argument('--trace',
+                        type=str,
+                        help='write a Chrome trace (chrome://tracing or ui.perfetto.dev) of every command, request and phase to this file and print a per-phase timing summary')
+
     args = parser.parse_args()
     return args
 
@@ -510,47 +911,51 @@ def main():
     # Configure git helper library
     git.setWorkspaceFolder(workspaceFolder)
     git.setRepos(repos)
-
-    # Generate release branch name based on version
-    releaseBranch = ""
-    versionParts = version.split(".")
-    releaseBranch = "release/%s.%s" % (versionParts[0], versionParts[1])
-
-    # Init cdap-build repo
-    git.cloneRepo(cdapBuildRepo)
-    git.checkoutBranch(cdapBuildRepo, releaseBranch)
-
-    # Init cdap repo
-    git.deleteLocalRepo(cdapRepo)
-    git.cloneRepo(cdapRepo)
-    git.checkoutBranch(cdapRepo, releaseBranch)
-
-    # Create a new branch in cdap repo for changes and delete the existing copyright folder
+    setFetchWorkers(args.workers)
+    setMaxRequestsPerHost(args.max_per_host)
+    setGraphQLBatchSize(args.graphql_batch_size)
+    licenseCache.setFreshTTL(args.license_cache_ttl*3600)
+    licenseCache.setFailureTTL(args.dead_url_ttl*3600)
+    if args.trace:
+        tracing.setTraceFilename(args.trace)
+
+    # Get the release branches, this reuses the release manifest written by modifyVersions if it is still current.
+    # The refs of the repos that are checked out are refreshed first so a release branch that moved is fetched
+    with tracing.phase("map branches"):
+        refIndex.refreshIndex([cdapBuildRepo, cdapRepo], args.workers)
+        git.mapBranchVersions(version, cdapBuildRepo)
+    releaseBranch = git.getReleaseBranch(cdapRepo, version)
     changeBranch = "release-update-license-%s" % version.replace('.', '')
-    git.checkoutBranch(cdapRepo, changeBranch, createBranch=True)
-    alreadyExistingLicenses = os.listdir(cdapCopyrightPath)
-    existingLicensesUsedMap = {l: False for l in alreadyExistingLicenses}  # This map will be used to skip licenses that are already present
 
-    # Populate licenses for CDAP and UI
-    cdapAdded, cdapFailed = createCDAPLicenses(version, existingLicensesUsedMap)
-    uiAdded, uiFailed = createUILicenses(version, existingLicensesUsedMap)
-
-    # Delete licenses that are no longer needed
-    for licenseFolder, used in existingLicensesUsedMap.items():
-        if used:
-            continue
-        print("DEBUG: %s - Deleted unused license file" % licenseFolder)
-        shutil.rmtree(path.join(cdapCopyrightPath, licenseFolder))
-
-    # Collect final numbers
-    added = cdapAdded+uiAdded
-    failed = cdapFailed+uiFailed
+    # Stages completed by an earlier run for this version are skipped
+    journal.startRun("generate_licenses %s" % version, args.restart)
+    PRLink = journal.getStage(cdapRepo, journal.prStage)
+    if PRLink is not None:
+        print("The licenses for %s were already generated in an earlier run (pass --restart to generate them again). PR: %s" % (version, PRLink))
+        return 0
+    committed = journal.getStage(cdapRepo, journal.committedStage)
+    if committed is not None and not journal.isDone(cdapRepo, journal.pushedStage) and git.getLocalBranchSha(cdapRepo, changeBranch) != committed['sha']:
+        journal.resetRepo(cdapRepo)  # The commit is gone, the licenses have to be generated again
+        committed = None
+
+    if committed is None:
+        try:
+            added, failed = createLicenseFiles(version, releaseBranch, changeBranch)
+        except git.SkipRepo:
+            return 0  # The PR for the licenses already exists and has the correct changes
+        journal.record(cdapRepo, journal.committedStage, {'sha': git.getLocalSha(cdapRepo), 'added': added, 'failed': failed})
+    else:
+        print("Resuming, the licenses were generated and committed in an earlier run")
+        added, failed = committed['added'], committed['failed']
 
     # Create PR
-    git.addAndCommit(cdapRepo, "-A", "Updated dependancy copyright license files.")
-    PRLink = git.pushAndCreatePR(cdapRepo, "[RELEASE-%s] Update Licenses" % version,
-                                 "This is an automated PR to update the copyright licenses for all dependancies of CDAP.\n\n" +
-                                 "%d licenses were generated automatically, %d require manual intervention" % (added, failed), changeBranch, releaseBranch, outputURLToFile=False)
+    with tracing.phase("create PR"):
+        if not journal.isDone(cdapRepo, journal.pushedStage):
+            journal.record(cdapRepo, journal.pushedStage, git.pushBranch(cdapRepo, changeBranch))
+        PRLink = git.createPR(cdapRepo, "[RELEASE-%s] Update Licenses" % version,
+                              "This is an automated PR to update the copyright licenses for all dependancies of CDAP.\n\n" +
+                              "%d licenses were generated automatically, %d require manual intervention" % (added, failed), changeBranch, releaseBranch, outputURLToFile=False)
+        journal.record(cdapRepo, journal.prStage, PRLink)
     timeDiff = time.time()-startTime
 
     # Print summary data for operation
@@ -561,6 +966,7 @@ def main():
         print("Please manually address the failures and add the changes to this PR: %s" % PRLink)
     else:
         print("PR for approval: %s" % PRLink)
+    tracing.export()
 
 
 if __name__ == '__main__':
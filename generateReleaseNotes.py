@@ -1,4 +1,4 @@
-import subprocess
+import tracing
 import jira
 import os
 import sys
@@ -7,6 +7,9 @@ from urllib.parse import quote
 
 jiraURL = 'https://issues.cask.co/'
 jiraAgentUsername = 'releaseAgent'
+issueFilter = 'project in (CDAP, "CDAP Plugins") AND fixVersion = %s AND "Release Notes" is not EMPTY'
+issueFilterNoReleaseNotes = 'project in (CDAP, "CDAP Plugins") AND fixVersion = %s AND "Release Notes" is EMPTY'
+issueFields = 'status,resolution,issuetype,Release Notes'
 
 
 class ReleaseNote():
@@ -66,6 +69,10 @@ def parseArgs():
                         action='store_true',
                         help='Advanced use only. Use the predefined JIRA ReleaseAgent account.',)
 
+    parser.add_argument('--trace',
+                        type=str,
+                        help='write a Chrome trace (chrome://tracing or ui.perfetto.dev) of every command, request and phase to this file and print a per-phase timing summary')
+
     args = parser.parse_args()
     if args.username is None and not args.overrideUser :
         sys.stderr.write("ERROR: Username is a required paramater, please specify a JIRA username to use for fetching tickets.\n")
@@ -82,14 +89,14 @@ def getAgentPassword(args):
         gcloudSetProjectCommand = 'gcloud config set project %s > /dev/null 2>&1' % args.passwordProject
         gcloudGetPasswordCommand = 'gcloud secrets versions access %s --secret="%s"' % (args.passwordVersion, args.passwordId)
 
-        code = subprocess.call(gcloudSetProjectCommand, shell=True)
+        code = tracing.call(gcloudSetProjectCommand, shell=True)
         # If we could not point gcloud to this project
         if code != 0:
             sys.stderr.write(
                 "ERROR: Unable to update gcloud project to %s. Please ensure that this project exists and that you have access.\n" % args.passwordProject)
             return code
 
-        serviceCheck = subprocess.check_output('gcloud services list --filter="secretmanager.googleapis.com" 2>&1', shell=True).decode('utf-8')
+        serviceCheck = tracing.check_output('gcloud services list --filter="secretmanager.googleapis.com" 2>&1', shell=True).decode('utf-8')
         # If the Secret Manager API is not enabled in this project
         # (this check is needed because gcloud will prompt the user to enable it if we try to access the API without it being enabled)
         if '0 items' in serviceCheck:
@@ -99,7 +106,7 @@ def getAgentPassword(args):
             return None
 
         # Fetch the password
-        password = subprocess.check_output(gcloudGetPasswordCommand, shell=True).decode('utf-8')
+        password = tracing.check_output(gcloudGetPasswordCommand, shell=True).decode('utf-8')
     except Exception as e:
         sys.stderr.write("ERROR: '%s' returned an error\n" % gcloudGetPasswordCommand)
         sys.stderr.write(
@@ -107,43 +114,14 @@ def getAgentPassword(args):
         return None
     return password
 
-def main():
-    """ Main function that does all the work """
-    global jiraAgentUsername
+def fetchReleaseNotes(agent, version):
+    """
+    Searches JIRA for the tickets with a given Fix Version. Returns the release notes grouped by issue type
+    and the search result for the tickets that have no release notes
+    """
 
-    # Parse command args and setup constants
-    args = parseArgs()
-    version = args.version
-    issueFilter = 'project in (CDAP, "CDAP Plugins") AND fixVersion = %s AND "Release Notes" is not EMPTY' % version
-    issueFilterNoReleaseNotes = 'project in (CDAP, "CDAP Plugins") AND fixVersion = %s AND "Release Notes" is EMPTY' % version
-    issueFields = 'status,resolution,issuetype,Release Notes'
-
-    # Getting the password depending if we are overriding the user
-    if args.overrideUser:
-        jiraAgentPassword = getAgentPassword(args)
-        if jiraAgentPassword is None:
-            return 1
-    else:
-        jiraAgentUsername = args.username
-        jiraAgentPassword = input("Enter password for JIRA user '%s': "%jiraAgentUsername)
-    
-
-    # Try to init agent
-    try:
-        agent = jira.JIRA(jiraURL, auth=(jiraAgentUsername, jiraAgentPassword))
-    except Exception as e:
-        errorMessage = e
-        try:
-            errorMessage = e.response.content.decode("utf-8") #Get the response out of the JiraError
-        except Exception as r:
-            pass
-        sys.stderr.write("ERROR: Failed to login to JIRA using account '%s': %s\n"%(jiraAgentUsername,errorMessage))
-        return 1
-
-    print("DEBUG: JIRA Agent created successfully!")
-    print("DEBUG: Searching for JIRA tickets with 'Fix Version = %s'" % version)
-    searchResults = agent.search_issues(issueFilter, maxResults=1000, fields=issueFields, json_result=True)
-    noReleaseNotesResults = agent.search_issues(issueFilterNoReleaseNotes, maxResults=1000, fields=issueFields, json_result=True)
+    searchResults = agent.search_issues(issueFilter % version, maxResults=1000, fields=issueFields, json_result=True)
+    noReleaseNotesResults = agent.search_issues(issueFilterNoReleaseNotes % version, maxResults=1000, fields=issueFields, json_result=True)
 
     print("DEBUG: Found %d issues with release notes for version %s" % (searchResults['total'], version))
 
@@ -151,23 +129,28 @@ def main():
     releaseNotes = {'New Feature': [], 'Improvement': [], 'Bug': [], 'Task': [], 'Sub-task': []}
     for issue in searchResults['issues']:
 
-        issueFields = issue['fields']
-        note = issueFields['customfield_10300'].strip()
+        fields = issue['fields']
+        note = fields['customfield_10300'].strip()
         id = issue['key']
 
         # Print warnings if the tickets arent marked as Fixed and Closed which they should be at this stage of the release
-        if issueFields['resolution'] is None or issueFields['resolution']['name'] != 'Fixed':
+        if fields['resolution'] is None or fields['resolution']['name'] != 'Fixed':
             print('WARN: Issue %s is not marked as Fixed!' % id)
-        if issueFields['status'] is None or issueFields['status']['name'] != 'Closed':
+        if fields['status'] is None or fields['status']['name'] != 'Closed':
             print('WARN: Issue %s is not marked as Closed!' % id)
 
-        issueType = issueFields['issuetype']['name']
+        issueType = fields['issuetype']['name']
         if issueType not in releaseNotes:
             releaseNotes[issueType] = []
 
         # Add ReleaseNote object to dict under correct issueType
         releaseNotes[issueType].append(ReleaseNote(id, note, issueType))
 
+    return releaseNotes, noReleaseNotesResults
+
+def writeReleaseNotes(releaseNotes, filename):
+    """ Writes the release notes grouped by issue type to a reStructuredText file """
+
     releaseNotesOrder = ['New Feature', 'Improvement', 'Bug']  # Order that the sections will appear in the doc
     releaseNotesPrettyName = {'New Feature': 'New Features', 'Improvement': 'Improvements', 'Bug': 'Bug Fixes'}  # Better names for each issueType
     contentLines = []
@@ -182,25 +165,67 @@ def main():
         for note in sortedNotes:
             contentLines.append(note.toString())
 
-    # Save all results to file
     contentLines = [line+'\n' for line in contentLines]
-    filename = 'releaseNotes.rst'
-    if args.output:
-        filename = args.output
-        filename += '.rst' if not filename.endswith('.rst') else ""
     outputFile = open(filename, 'w')
     outputFile.writelines(contentLines)
     outputFile.close()
 
+def main():
+    """ Main function that does all the work """
+    global jiraAgentUsername
+
+    # Parse command args and setup constants
+    args = parseArgs()
+    version = args.version
+    if args.trace:
+        tracing.setTraceFilename(args.trace)
+
+    # Getting the password depending if we are overriding the user
+    if args.overrideUser:
+        with tracing.phase("fetch credentials"):
+            jiraAgentPassword = getAgentPassword(args)
+        if jiraAgentPassword is None:
+            return 1
+    else:
+        jiraAgentUsername = args.username
+        jiraAgentPassword = input("Enter password for JIRA user '%s': "%jiraAgentUsername)
     
+
+    # Try to init agent
+    try:
+        with tracing.phase("jira login"):
+            agent = jira.JIRA(jiraURL, auth=(jiraAgentUsername, jiraAgentPassword))
+    except Exception as e:
+        errorMessage = e
+        try:
+            errorMessage = e.response.content.decode("utf-8") #Get the response out of the JiraError
+        except Exception as r:
+            pass
+        sys.stderr.write("ERROR: Failed to login to JIRA using account '%s': %s\n"%(jiraAgentUsername,errorMessage))
+        return 1
+
+    print("DEBUG: JIRA Agent created successfully!")
+    print("DEBUG: Searching for JIRA tickets with 'Fix Version = %s'" % version)
+    tracing.instrumentSession(agent._session)  # Records the requests sent by the JIRA client
+    with tracing.phase("jira search"):
+        releaseNotes, noReleaseNotesResults = fetchReleaseNotes(agent, version)
+
+    # Save all results to file
+    filename = 'releaseNotes.rst'
+    if args.output:
+        filename = args.output
+        filename += '.rst' if not filename.endswith('.rst') else ""
+    writeReleaseNotes(releaseNotes, filename)
+
     if noReleaseNotesResults['total'] > 0:
         issueId = noReleaseNotesResults['issues'][0]['key']
-        url = '%sbrowse/%s?jql=%s'%(jiraURL, issueId, quote(issueFilterNoReleaseNotes))
+        url = '%sbrowse/%s?jql=%s'%(jiraURL, issueId, quote(issueFilterNoReleaseNotes % version))
         print("\nWARN: Found %d tickets with Fix Version %s but no release notes!"%(noReleaseNotesResults['total'], version))
         print("WARN: Go to this URL to see the issues without release notes: %s"%url)
 
     
     print("DEBUG: Done! Generated release notes in file '%s'" % filename)
+    tracing.export()
     return 0
 
 
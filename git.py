@@ -1,28 +1,65 @@
-from subprocess import call
 from os import path
-import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import os
 import shutil
-import sys
 import re
+import json
+import shlex
+import refIndex
+import gitExecutor
+import prIndex
+import githubClient
+import policy
+import webbrowser
+from collections import deque
 
 workspaceFolder = ""
+mirrorFolder = "workspace_mirrors"  # Shared by all scripts, update the entry in the .gitignore if this folder name is changed
 quiteMode = True
+sparseMode = False
+deleteOnRevert = False  # Delete the whole clone instead of rolling back local changes
+sparsePatterns = ["/pom.xml", "**/pom.xml"]
 repoBranchMap = {}
+trackedFilesCache = {}
 outputPRsFilename="outputPRs_tmp.txt"
+releaseManifestFilename = "releaseManifest.json"  # Update the entry in the .gitignore if this file name is changed
 repos = []
 releaseBranchMap = {}
 submoduleRepos = {}
+syncWorkers = 8
+fetchedBranches = {}  # Map of (repo, branch) -> remote sha that was fetched into the local copy during this run
 
 gitmodulesRegex = r"url = [\.\.\/]*(.*)$\n^.*branch = [\.\.\/]*(.*)$"
 
+
+class SkipRepo(Exception):
+    """ Raised when a repo is skipped on purpose (ex. a PR with the correct changes already exists), this is not a failure """
+    pass
+
+
 def setWorkspaceFolder(folder):
     global workspaceFolder
     workspaceFolder=folder
 
+def setMirrorFolder(folder):
+    """ Sets the folder for the shared bare mirrors, an empty string disables the mirrors """
+    global mirrorFolder
+    mirrorFolder=folder
+
+def setSparseMode(mode):
+    """ Enables partial clones with a sparse checkout that only contains the pom.xml files """
+    global sparseMode
+    sparseMode=mode
+
+def setDeleteOnRevert(mode):
+    global deleteOnRevert
+    deleteOnRevert=mode
+
 def setQuiteMode(mode):
     global quiteMode
     quiteMode=mode
+    refIndex.setQuiteMode(mode)
+    gitExecutor.setQuiteMode(mode)
 
 def setPROutputFilename(name):
     global outputPRsFilename
@@ -32,6 +69,10 @@ def setRepos(reposList):
     global repos
     repos=reposList
 
+def setSyncWorkers(workers):
+    global syncWorkers
+    syncWorkers=max(1, workers)
+
 def getFullRepoName(partialRepo):
     """
     Returns the full repo path given the repo name
@@ -61,38 +102,247 @@ def getRepoPath(repo):
 
     return path.join(os.getcwd(), workspaceFolder, repoNameToPath(repo))
 
+def getReleaseBranch(repo, version):
+    """
+    Returns the release branch for a given repo, using the releaseBranchMap if the repo was found in the submodules
+    or constructing the 'release/Major.Minor' name from the version otherwise
+    """
+
+    if repo in releaseBranchMap:
+        return releaseBranchMap[repo]
+    versionParts = version.split(".")
+    return "release/%s.%s" % (versionParts[0], versionParts[1])
+
+def getMirrorPath(repo):
+    """ Returns the filesystem path for the bare mirror of the given repo """
+
+    if repo.endswith(".git"):
+        repo = repo[:-len(".git")]
+    return path.join(os.getcwd(), mirrorFolder, repo + ".git")
+
+def updateMirror(repo):
+    """
+    Creates the bare mirror for a given repo, or incrementally fetches into it if it already exists.
+    Workspaces borrow objects from the mirror (via alternates) so each object is only downloaded once across
+    all workspaces and runs. Returns the mirror path, or None if the mirror could not be created/updated
+    """
+
+    if mirrorFolder == "":
+        return None
+
+    mirrorPath = getMirrorPath(repo)
+    mirrorExists = path.exists(mirrorPath)
+    if mirrorExists:
+        code = configureMirror(mirrorPath)
+        if code == 0:
+            code = gitExecutor.run(mirrorPath, ["fetch", "--prune", "origin"], showErrors=False).code
+    else:
+        os.makedirs(path.dirname(mirrorPath), exist_ok=True)
+        # A bare clone with the refspecs set below, 'clone --mirror' would also download every refs/pull/* ref from GitHub.
+        # In sparse mode only commits and trees are downloaded, the files that are read are fetched by readFilesAtCommit
+        filterArgs = ["--filter=blob:none"] if sparseMode else []
+        code = gitExecutor.run(path.dirname(mirrorPath), ["clone", "--bare"] + filterArgs + ["git@github.com:%s.git" % repo.replace(".git", ""), mirrorPath],
+                               showErrors=False).code
+        if code == 0:
+            code = configureMirror(mirrorPath)
+
+    if code != 0:
+        print("WARN: Failed to update mirror for repo '%s', falling back to a full clone" % repo)
+        if not mirrorExists:
+            shutil.rmtree(mirrorPath, ignore_errors=True)  # Do not leave a half-cloned mirror behind
+        return None
+    return mirrorPath
+
+def isPartialClone(gitDir):
+    """ Returns True if a repo was cloned without file contents (--filter), missing objects are then fetched from origin on demand """
+
+    return gitExecutor.run(gitDir, ["config", "--get", "remote.origin.promisor"], showErrors=False, query=True).output() == "true"
+
+def configureMirror(mirrorPath):
+    """
+    Makes the mirror fetch only branches and tags. Mirrors created by 'clone --mirror' are switched over and their
+    refs/pull/* refs are deleted. Objects are never pruned from the mirror since workspace clones may still depend on them
+    """
+
+    commands = [["config", "--replace-all", "remote.origin.fetch", "+refs/heads/*:refs/heads/*"],
+                ["config", "--add", "remote.origin.fetch", "+refs/tags/*:refs/tags/*"],
+                ["config", "gc.pruneExpire", "never"]]
+    if gitExecutor.run(mirrorPath, ["config", "--get", "remote.origin.mirror"], showErrors=False, query=True).output() == "true":
+        commands.append(["config", "--unset", "remote.origin.mirror"])
+        pullRefs = gitExecutor.run(mirrorPath, ["for-each-ref", "--format=delete %(refname)", "refs/pull"], check=True, query=True).stdout
+        if len(pullRefs) > 0:
+            gitExecutor.run(mirrorPath, ["update-ref", "--stdin"], input=pullRefs)
+    return gitExecutor.runAll(mirrorPath, commands)[-1].code
+
+def isSparseCheckout(repo):
+    """ Returns True if the local copy of the given repo only has a sparse checkout """
+
+    result = gitExecutor.run(getRepoPath(repo), ["config", "--get", "core.sparseCheckout"], showErrors=False, query=True)
+    return result.ok() and result.output() == "true"
+
+def enableSparseCheckout(repo):
+    """ Limits the working tree of the given repo to the pom.xml files """
+
+    return gitExecutor.run(getRepoPath(repo), ["sparse-checkout", "set", "--no-cone"] + sparsePatterns, showErrors=False).code
+
+def ensureFullCheckout(repo):
+    """
+    Restores the full working tree for a repo that was cloned in sparse mode.
+    This is needed by operations that use more than the pom files (ex. submodule updates and builds),
+    any missing file contents are downloaded on demand by git
+    """
+
+    if not path.exists(getRepoPath(repo)) or not isSparseCheckout(repo):
+        return 0
+    print("Switching repo '%s' to a full checkout" % repo)
+    return gitExecutor.run(getRepoPath(repo), ["sparse-checkout", "disable"], showErrors=False).code
+
 def cloneRepo(repo):
     """
-    Clones a given repo into the workspace folder.
+    Clones a given repo into the workspace folder, borrowing objects from the local mirror of the repo.
     If the repo is already cloned then this function clears all local changes and pulls the newest from remote
+
+    In sparse mode the repo is cloned without file contents (--filter=blob:none) and only the pom.xml files are
+    checked out, no new mirror is created in this mode. Outside of sparse mode a sparse checkout is made full again
     """
 
     repoPath = getRepoPath(repo)
     # If the repo already exists then just clear any local changes
     if path.exists(repoPath):
-        commands = []
-        commands.append('cd "%s"' % repoPath)
-        commands.append("git reset --hard")
-        commands = [c + " > /dev/null" if quiteMode else c for c in commands]
-        call(" && ".join(commands), shell=True)
+        gitExecutor.run(repoPath, ["reset", "--hard"])
+        if sparseMode:
+            enableSparseCheckout(repo)
+        else:
+            ensureFullCheckout(repo)
     else:
-        if not repo.endswith(".git"):
-            repo += ".git"
+        mirrorPath = getMirrorPath(repo) if sparseMode else updateMirror(repo)
+        # A full clone cannot borrow from a mirror without file contents, it would end up without them too
+        useMirror = mirrorPath is not None and path.exists(mirrorPath) and (sparseMode or not isPartialClone(mirrorPath))
+        cloneArgs = ["--reference-if-able", mirrorPath] if useMirror else []
+        if sparseMode:
+            cloneArgs += ["--filter=blob:none", "--sparse"]
+        remoteRepo = repo if repo.endswith(".git") else repo + ".git"
 
-        call("mkdir %s; cd %s && git clone git@github.com:%s" % (workspaceFolder, workspaceFolder, repo), shell=True)
+        os.makedirs(workspaceFolder, exist_ok=True)
+        gitExecutor.run(workspaceFolder, ["clone"] + cloneArgs + ["git@github.com:%s" % remoteRepo])
+        if sparseMode:
+            enableSparseCheckout(repo)
 
 
+def getTrackedFiles(repo, filename):
+    """
+    Returns the absolute paths of all files with the given name that are tracked in the current commit of a repo.
+    The list is read from the commit tree so untracked files and build output (ex. target/, node_modules/) are never
+    included. Results are cached per repo and commit sha and are returned in a stable order with the shallowest files first
+    """
+
+    repoPath = getRepoPath(repo)
+    sha = getLocalSha(repo)
+    if (repo, sha, filename) not in trackedFilesCache:
+        trackedFilesCache[(repo, sha, filename)] = listFilesAtCommit(path.join(repoPath, ".git"), sha, filename)
+    return [path.join(repoPath, f) for f in trackedFilesCache[(repo, sha, filename)]]
+
+def syncRepo(repo, branch):
+    """
+    Clones or refreshes a given repo and checks it out onto the given branch.
+    Output is always suppressed since several repos are synced at the same time. Returns True if the sync succeeded
+    """
+
+    cloneRepo(repo)
+    repoPath = getRepoPath(repo)
+    if not path.exists(repoPath):
+        return False
+    return updateBranch(repo, branch, showErrors=False) == 0
+
+def syncRepos(version, reposToSync=None):
+    """
+    Clones or refreshes all repos (defaults to every repo in repos.txt) and checks out their release branches
+    using a bounded pool of syncWorkers threads. This front-loads the slow network operations so that the
+    interactive steps that follow only operate on up-to-date local copies.
+    Returns a map of repo -> True/False for whether the sync succeeded
+    """
+
+    if reposToSync is None:
+        reposToSync = repos
+
+    print("Syncing %d repos using %d workers..." % (len(reposToSync), syncWorkers))
+    results = {}
+    with ThreadPoolExecutor(max_workers=syncWorkers) as executor:
+        futures = {executor.submit(syncRepo, repo, getReleaseBranch(repo, version)): repo for repo in reposToSync}
+        for future in as_completed(futures):
+            repo = futures[future]
+            try:
+                results[repo] = future.result()
+            except Exception as e:
+                results[repo] = False
+            print("%s: %s" % ("OK    " if results[repo] else "FAILED", repo))
+
+    failed = [repo for repo in reposToSync if not results[repo]]
+    if len(failed) > 0:
+        print("WARN: Failed to sync %d repos, they will be retried when they are processed: %s" % (len(failed), ', '.join(failed)))
+    return results
+
 def getAllBranches(repo):
-    """ Helper function that gets a full list of all remote branches for a given repo """
+    """ Helper function that gets a full list of all remote branches for a given repo, using the per-run ref index """
+
+    return refIndex.getBranches(repo)
+
+def getLocalBranchSha(repo, branch):
+    """ Returns the sha of a local branch in a given repo, or None if the branch does not exist """
+
+    if not path.exists(getRepoPath(repo)):
+        return None
+    return gitExecutor.resolveRefs(getRepoPath(repo), ["refs/heads/%s" % branch])["refs/heads/%s" % branch]
+
+def getLocalSha(repo, ref="HEAD"):
+    """ Returns the sha of a ref in the local copy of a given repo """
+
+    return gitExecutor.run(getRepoPath(repo), ["rev-parse", ref], check=True, query=True).output()
+
+def fetchBranch(repo, branch):
+    """
+    Makes sure the remote-tracking ref of a branch (origin/<branch>) in the local copy of a repo is at the remote tip.
+    Only this one branch is fetched, and only if its tip in the ref index differs from what was fetched before.
+    Returns the exit code of the fetch, 0 if nothing had to be fetched
+    """
+
+    repoPath = getRepoPath(repo)
+    trackingRef = "refs/remotes/origin/%s" % branch
+    try:
+        remoteSha = refIndex.getBranchSha(repo, branch)
+    except Exception:
+        remoteSha = None  # The remote refs could not be listed, fetch to find out
+    if remoteSha is not None:
+        if fetchedBranches.get((repo, branch)) == remoteSha:
+            return 0
+        if gitExecutor.resolveRefs(repoPath, [trackingRef])[trackingRef] == remoteSha:
+            fetchedBranches[(repo, branch)] = remoteSha
+            return 0
+
+    result = gitExecutor.run(repoPath, ["fetch", "origin", "+refs/heads/%s:%s" % (branch, trackingRef)], showErrors=False)
+    if result.ok():
+        fetchedBranches[(repo, branch)] = gitExecutor.resolveRefs(repoPath, [trackingRef])[trackingRef]
+    return result.code
+
+def updateBranch(repo, branch, showErrors=True):
+    """
+    Checks a given repo onto an existing branch and fast-forwards it to the remote tip of the branch.
+    Replaces 'git pull --all', only the branch that is checked out is fetched. Returns 0 on success
+    """
 
     repoPath = getRepoPath(repo)
-    commands = []
-    commands.append('cd "%s"' % repoPath)
-    commands.append('git ls-remote --heads origin')
-    out = subprocess.check_output(" && ".join(commands), shell=True).decode('utf-8')
-    lines = out.split("\n")
-    branchNames = [line.split('\t')[1].replace('refs/heads/', '')for line in lines if '\t' in line]
-    return branchNames
+    trackingRef = "refs/remotes/origin/%s" % branch
+    fetchCode = fetchBranch(repo, branch)
+    result = gitExecutor.run(repoPath, ["checkout", branch], showErrors=showErrors)
+    if not result.ok():
+        return result.code
+
+    shas = gitExecutor.resolveRefs(repoPath, ["HEAD", trackingRef])
+    if shas[trackingRef] is None:
+        return fetchCode  # Local only branch, there is nothing to update from
+    if shas["HEAD"] == shas[trackingRef]:
+        return 0
+    return gitExecutor.run(repoPath, ["merge", "--ff-only", trackingRef], showErrors=showErrors).code
 
 def checkoutBranch(repo, branch, createBranch=False):
     """ Checks a given repo onto a given branch, also has the ability to create a new branch.
@@ -116,56 +366,30 @@ def checkoutBranch(repo, branch, createBranch=False):
 
     global repoBranchMap
 
-    repoPath = getRepoPath(repo)
-    commands = []
-    commands.append('cd "%s"' % repoPath)
-    if createBranch:
-        repoBranchMap[repo] = getAllBranches(repo)
-        commands.append("git checkout -b %s" % branch)
-    else:
-        commands.append("git checkout %s" % branch)
-        commands.append("git pull --all")
-    commands = [c + " > /dev/null 2>&1" if quiteMode else c for c in commands]
+    if not createBranch:
+        updateBranch(repo, branch, showErrors=False)
+        return
 
-    createBranchExitCode = call(" && ".join(commands), shell=True)
-    existsInRemote = branch in repoBranchMap[repo] if createBranch else False
+    repoBranchMap[repo] = getAllBranches(repo)
+    createBranchExitCode = gitExecutor.run(getRepoPath(repo), ["checkout", "-b", branch], showErrors=False).code
+    existsInRemote = branch in repoBranchMap[repo]
 
     # This usually means the branch already exists, this would happen if the user re-ran the script after stopping it halfway
-    if (createBranchExitCode != 0 or existsInRemote) and createBranch:
+    if createBranchExitCode != 0 or existsInRemote:
         print("Failed to create branch '%s' in repo '%s', a branch with that name already exists" % (
             branch, repo))
         # Check if there is already a PR for this branch
-        commands.clear()
-        commands.append('cd "%s"' % repoPath)
-        commands.append('BRANCH=`git rev-parse --abbrev-ref HEAD`')
-        commands.append("gh pr checkout %s" % branch)
-        commands.append("git checkout $BRANCH")
-        commands = [
-            c + " > /dev/null 2>&1" if quiteMode else c for c in commands]
-        exitCode = call(" && ".join(commands), shell=True)
-
-        # If exit code is zero that means there is a PR for this branch
-        if exitCode == 0:
+        if hasOpenPR(repo, branch):
             print("A PR for this branch has already been created (maybe this script was already run for this release?)")
-            print("Please review the PR to determine if the correct changes are already present.")
-            input("To view this PR in a browser, press Enter...")
-            commands.clear()
-            commands.append('cd "%s"' % repoPath)
-            commands.append("gh pr view --web %s >> ../../%s" % (branch, outputPRsFilename))
-            commands = [c + "> /dev/null" if quiteMode else c for c in commands]
-            call(" && ".join(commands), shell=True)
-            isPRCorrect = getUserReponse("Does the PR contain the correct changes? (Y/n)")
+            isPRCorrect = policy.decide(policy.existingPRDecision, "Does the PR contain the correct changes? (Y/n)",
+                                        lambda prompt: reviewPR(repo, branch, prompt))
             if isPRCorrect:
                 print("Skipping re-processing this repo since correct PR already exists")
-                raise Exception()
+                raise SkipRepo()
 
             # PR is incorrect, it should be closed
             print("Closing incorrect PR")
-            commands.clear()
-            commands.append('cd "%s"' % repoPath)
-            commands.append("gh pr close %s" % branch)
-            commands = [c + "> /dev/null" if quiteMode else c for c in commands]
-            call(" && ".join(commands), shell=True)
+            closePR(repo, branch)
 
         # If there is no PR or the PR is not correct, delete the branch and try again
         print("Deleting existing branch and recreating it...")
@@ -183,119 +407,486 @@ def checkoutBranch(repo, branch, createBranch=False):
             checkoutBranch(repo, branch, createBranch)
 
 
+def hasOpenPR(repo, branch):
+    """ Returns True if there is an open PR for a given branch, the API is only asked if the PR index has no data for the repo """
+
+    pr = prIndex.getOpenPR(repo, branch)
+    if pr is None:
+        return getPRState(repo, branch) == "OPEN"
+    return pr is not False
+
+def findPR(repo, branch):
+    """ Returns the number and URL of the PR for a given branch, from the PR index if possible. (None, None) if there is no PR """
+
+    pr = prIndex.getOpenPR(repo, branch)
+    if pr:
+        return pr['number'], pr['url']
+    if pr is False:
+        return None, None
+    try:
+        pr = githubClient.findPR(repo, branch)
+    except githubClient.GitHubError as e:
+        print("WARN: Failed to look up the PR for branch '%s' in repo '%s': %s" % (branch, repo, e))
+        return None, None
+    if pr is None:
+        return None, None
+    return pr['number'], pr['html_url']
+
+def reviewPR(repo, branch, prompt):
+    """ Opens the PR for a given branch in the browser and asks the user if it is correct """
+
+    print("Please review the PR to determine if the correct changes are already present.")
+    input("To view this PR in a browser, press Enter...")
+    _, url = findPR(repo, branch)
+    if url is not None:
+        print(url)
+        with open(outputPRsFilename, 'a') as outputFile:
+            outputFile.write(url + "\n")
+        webbrowser.open(url)
+    return getUserReponse(prompt)
+
+def getPRState(repo, branch):
+    """ Returns the state of the PR for a given branch (OPEN, CLOSED or MERGED), or None if there is no PR """
+
+    try:
+        pr = githubClient.findPR(repo, branch)
+    except githubClient.GitHubError as e:
+        if not quiteMode:
+            print("WARN: Failed to get the PR state for branch '%s' in repo '%s': %s" % (branch, repo, e))
+        return None
+    return githubClient.getPRState(pr) if pr is not None else None
+
+def closePR(repo, branch):
+    """ Closes the PR for a given branch, returns a non-zero exit code if there is no PR to close """
+
+    number, _ = findPR(repo, branch)
+    if number is None:
+        return 1
+    try:
+        githubClient.closePR(repo, number)
+    except githubClient.GitHubError as e:
+        print("WARN: Failed to close PR #%d in repo '%s': %s" % (number, repo, e))
+        return 1
+    prIndex.recordPRClosed(repo, branch)
+    return 0
+
+def localBranchExists(repo, branch):
+    """ Returns True if the given branch exists in the local copy of the repo """
+
+    return getLocalBranchSha(repo, branch) is not None
+
 def deleteBranch(repo, branch, deleteInRemote=False):
     """ Deletes a branch in a given repo in either local or remote """
 
-    commands = []
     repoPath = getRepoPath(repo)
-    commands.append('cd "%s"' % repoPath)
     if deleteInRemote:
-        commands.append("git push origin --delete %s" % branch)
+        code = gitExecutor.run(repoPath, ["push", "origin", "--delete", branch]).code
     else:
-        commands.append("git branch -D %s" % branch)
-    commands = [c + " > /dev/null" if quiteMode else c for c in commands]
-    return call(" && ".join(commands), shell=True)
+        code = gitExecutor.run(repoPath, ["branch", "-D", branch]).code
+    if code == 0 and deleteInRemote:
+        refIndex.recordBranchDeleted(repo, branch)
+    return code
 
 
 def addAndCommit(repo, filesToAdd, commitMessage):
     """ Adds given files in a given repo and commits the changes """
 
     repoPath = getRepoPath(repo)
-    commands = []
-    commands.append('cd "%s"' % repoPath)
-    commands.append('git add %s' % filesToAdd)
-    commands.append('git commit -m "%s"' % commitMessage)
-    commands = [c + " > /dev/null" if quiteMode else c for c in commands]
-    call(" && ".join(commands), shell=True)
+    gitExecutor.runAll(repoPath, [["add"] + shlex.split(filesToAdd), ["commit", "-m", commitMessage]])
+
+
+def commitStaged(repo, commitMessage):
+    """ Commits the changes that are already staged in a given repo, without adding anything from the working tree """
+
+    return gitExecutor.run(getRepoPath(repo), ["commit", "-m", commitMessage]).code
 
 
+def pushBranch(repo, branch):
+    """ Force pushes a branch of a given repo, returns the sha that was pushed. Raises a GitError if the push fails """
+
+    gitExecutor.run(getRepoPath(repo), ["push", "origin", branch, "-f"], check=True)
+    sha = getLocalSha(repo, branch)
+    refIndex.recordBranch(repo, branch, sha)
+    return sha
+
+def createPR(repo, title, body, currentBranch, targetBranch, outputURLToFile=True):
+    """
+    Creates a PR for a branch that was already pushed, with the given title and body.
+    By default a link to the PR will be saved to a file, the link is always returned by this function
+    """
+
+    try:
+        prLink = githubClient.createPR(repo, title, body, currentBranch, targetBranch, [prIndex.releaseLabel])['html_url']
+    except githubClient.GitHubError as e:
+        # A run that stopped right after creating the PR leaves an open PR behind, reuse it
+        _, prLink = findPR(repo, currentBranch) if e.status == 422 else (None, None)
+        if prLink is None:
+            print("ERROR: Failed to create a PR for branch '%s' in repo '%s': %s" % (currentBranch, repo, e))
+            raise
+        print("A PR for branch '%s' in repo '%s' already exists, reusing it" % (currentBranch, repo))
+    prIndex.recordPR(repo, currentBranch, prLink, targetBranch)
+    if outputURLToFile:
+        print(prLink)
+        with open(outputPRsFilename, 'a') as outputFile:
+            outputFile.write(prLink + "\n")
+    return prLink
+
 def pushAndCreatePR(repo, title, body, currentBranch, targetBranch, outputURLToFile=True):
     """
     Pushes the commited changes in a given repo and creates a PR with the given title and body.
     By default a link to the PR will be saved to a file, if outputURLToFile is set to false the link will be returned by this function
     """
 
-    repoPath = getRepoPath(repo)
-    commands = []
-    commands.append('cd "%s"' % repoPath)
-    if outputURLToFile:
-        commands.append("git push origin %s -f" % currentBranch)
-        commands.append('gh pr create --title "%s" --body "%s" --base %s --label automated-release >> ../../%s' %
-                        (title, body, targetBranch, outputPRsFilename))
-    else:
-        commands.append("git push origin %s -f > /dev/null 2>&1" % currentBranch)
-        commands.append('gh pr create --title "%s" --body "%s" --base %s --label automated-release' % (title, body, targetBranch))
-    prLink = subprocess.check_output(" && ".join(commands), shell=True).decode('utf-8')
+    pushBranch(repo, currentBranch)
+    prLink = createPR(repo, title, body, currentBranch, targetBranch, outputURLToFile)
     if not outputURLToFile:
         return prLink  # Return PR URL
 
 def tagRepo(repo, tag):
+    """ Tags the commit the local copy of a repo is on, the tag is created through the API so the commit must already be pushed """
+
     print("Tagging repo %s with tag '%s'"%(repo, tag))
-    commands = []
-    repoPath = getRepoPath(repo)
-    commands.append('cd "%s"' % repoPath)
-    commands.append('git tag %s'%tag)
-    commands.append('git push origin %s'%tag)
-    code = call(" && ".join(commands), shell=True)
-    if code != 0:
-        print("Failed to tag repo, tag probably already exists")
+    if refIndex.tagExists(repo, tag):
+        print("Failed to tag repo, tag already exists")
+        return
+    sha = getLocalSha(repo)
+    try:
+        githubClient.createTag(repo, tag, sha)
+    except githubClient.GitHubError as e:
+        print("Failed to tag repo, tag probably already exists: %s" % e)
+        return
+    refIndex.recordTag(repo, tag, sha)
+
+
+def getCurrentRef(repo):
+    """ Returns the name of the branch the local copy of a repo is on, or the sha if it is in a detached state """
+
+    result = gitExecutor.run(getRepoPath(repo), ["symbolic-ref", "-q", "--short", "HEAD"], showErrors=False, query=True)
+    return result.output() if result.ok() else getLocalSha(repo)
+
+def getLocalBranches(repo):
+    """ Returns the set of all local branch names in a given repo """
+
+    out = gitExecutor.run(getRepoPath(repo), ["for-each-ref", "--format=%(refname:short)", "refs/heads"], check=True, query=True).output()
+    return set(line for line in out.split("\n") if line != "")
+
+def resetLocalRepo(repo, branch):
+    """
+    Brings the local copy of a repo back to the state of a fresh clone on the given branch: all local changes and
+    untracked files are removed and every other local branch is deleted. The object store is kept so nothing is downloaded again
+    """
 
+    code = gitExecutor.runAll(getRepoPath(repo), [["reset", "--hard"], ["clean", "-fd"], ["checkout", branch]])[-1].code
+    for localBranch in getLocalBranches(repo) - set([branch]):
+        code += deleteBranch(repo, localBranch)
+    return code
 
-def deleteLocalRepo(repo):
+class RepoTransaction():
+    """
+    Class to record the starting state of a local repo so that all local changes made by an operation can be
+    rolled back cheaply (reset, clean and deleting the branches that were created) instead of deleting the clone
+    """
+
+    def __init__(self, repo):
+        self.repo = repo
+        self.startRef = getCurrentRef(repo)
+        self.startBranches = getLocalBranches(repo)
+
+    def rollback(self, failed=True):
+        """
+        Rolls back all local changes made since the transaction started. The clone is only deleted if deleteOnRevert is set.
+        failed is False when the repo is skipped on purpose, the user is then not asked to resolve anything
+        """
+
+        if deleteOnRevert:
+            deleteLocalRepo(self.repo, failed)
+            return
+
+        if failed:
+            print("Reverting repo %s" % self.repo)
+        commands = [["reset", "--hard"], ["clean", "-fd"], ["checkout", self.startRef]]
+        code = gitExecutor.runAll(getRepoPath(self.repo), commands)[-1].code
+        for branch in getLocalBranches(self.repo) - self.startBranches:
+            code += deleteBranch(self.repo, branch)
+
+        if code != 0:
+            print("WARN: Failed to roll back repo %s, deleting the local copy instead" % self.repo)
+            deleteLocalRepo(self.repo, failed)
+            return
+        if failed:
+            print("Revert of %s is complete, please resolve this issue and try again. You may edit the repos.txt file to only target this affected repo in future runs." % self.repo)
+
+def deleteLocalRepo(repo, failed=True):
     """ Deletes the local copy of the repo to force-remove all local changes """
 
-    print("Reverting repo %s" % repo)
+    if failed:
+        print("Reverting repo %s" % repo)
     repoPath = getRepoPath(repo)
+    gitExecutor.closeReader(repoPath)
     shutil.rmtree(repoPath, ignore_errors=True)
-    print("Revert of %s is complete, please resolve this issue and try again. You may edit the repos.txt file to only target this affected repo in future runs." % repo)
+    if failed:
+        print("Revert of %s is complete, please resolve this issue and try again. You may edit the repos.txt file to only target this affected repo in future runs." % repo)
 
-def mapBranchVersionsRecurse(version, repo="cdapio/cdap-build"):
-    """ 
-    This generates repo-to-branch mappings for release branches. This is required because the version of 
-    CDAP (ex. 6.1.4) is not the same as the versions for the other repos that are bundled with it.
+def fetchBranchObjects(repo, branch):
+    """
+    Makes sure the objects for the tip of a remote branch are available locally without checking out a working tree.
+    The objects are fetched into the bare mirror of the repo, the mirror is only fetched if it does not already
+    contain the commit that the ref index reports for the branch. If mirrors are disabled the branch is fetched into the workspace clone.
+    Returns a (gitDir, sha) tuple, both are None if the branch does not exist
+    """
 
-    For example, the source code for CDAP 6.1.4 is in the cdap repo in the release/6.1 branch. The hydrator plugins
-    for this version are in the hydrator-plugins repo in the release/2.3 branch. We need a mapping that tells us which
-    branch should be targetted for each repo.
+    sha = refIndex.getBranchSha(repo, branch)
+    if sha is None:
+        return None, None
+
+    gitDir = None
+    if mirrorFolder != "":
+        gitDir = getMirrorPath(repo)
+        if not path.exists(gitDir):
+            gitDir = updateMirror(repo)
+        elif gitExecutor.resolveRefs(gitDir, ["%s^{commit}" % sha])["%s^{commit}" % sha] is None:
+            gitExecutor.run(gitDir, ["fetch", "origin", "+refs/heads/%s:refs/heads/%s" % (branch, branch)], showErrors=False)
+
+    # Fall back to the workspace clone if the mirror is not available
+    if gitDir is None:
+        cloneRepo(repo)
+        gitDir = path.join(getRepoPath(repo), ".git")
+        gitExecutor.run(gitDir, ["fetch", "origin", "+refs/heads/%s:refs/remotes/origin/%s" % (branch, branch)], showErrors=False)
+    return gitDir, sha
+
+def listFilesAtCommit(gitDir, sha, filename):
+    """ Returns the paths of all files with the given name in a commit, with the shallowest files first """
+
+    out = gitExecutor.run(gitDir, ["ls-tree", "-r", "-z", "--name-only", sha], check=True, query=True).stdout.decode('utf-8')
+    files = [f for f in out.split('\0') if path.basename(f) == filename]
+    return sorted(files, key=lambda f: (f.count('/'), f))
+
+def fetchMissingFiles(gitDir, sha, filePaths):
+    """
+    Downloads the contents of the given files of a commit with a single fetch if the repo is a partial clone and does not have them yet.
+    Without this every missing file would be fetched on its own when it is read, which is still what happens for a single file
+    """
 
-    This is accomplished by examining the .gitsubmodules file in the cdap-build repo in the corresponding release branch.
-    The branches in cdap-build follow the convention 'release/Major.Minor' so given a version string we can find the correct branch.
-    From there we can recursively visit the repos that appear in the submodules file and construct a mapping
+    if len(filePaths) < 2 or not isPartialClone(gitDir):
+        return 0
+    out = gitExecutor.run(gitDir, ["ls-tree", "-z", sha, "--"] + list(filePaths), check=True, query=True).stdout.decode('utf-8')
+    blobs = set(entry.split('\t', 1)[0].split(' ')[2] for entry in out.split('\0') if '\t' in entry)
+    out = gitExecutor.run(gitDir, ["rev-list", "--objects", "--missing=print", "--no-walk", sha], check=True, query=True).output()
+    missing = [line[1:] for line in out.split('\n') if line.startswith('?') and line[1:] in blobs]
+    if len(missing) == 0:
+        return 0
+    # The same fetch git runs to download missing objects, but for all of them at once
+    return gitExecutor.run(gitDir, ["fetch", "origin", "--no-tags", "--no-write-fetch-head", "--recurse-submodules=no", "--filter=blob:none", "--stdin"],
+                           input="".join("%s\n" % blob for blob in missing).encode('utf-8'), showErrors=False).code
+
+def readFilesAtCommit(gitDir, sha, filePaths):
+    """
+    Reads several files from a commit using the long-lived 'git cat-file --batch' process of the git dir.
+    Returns a map of file path -> contents, the contents are None for files that do not exist in the commit
     """
 
-    # Construct/fetch release branch name
-    print("Scanning repo '%s' for submodules" % repo)
-    global releaseBranchMap
-    versionParts = version.split(".")
-    branch = "release/%s.%s" % (versionParts[0], versionParts[1])
-    if repo in releaseBranchMap:
-        branch = releaseBranchMap[repo]
+    fetchMissingFiles(gitDir, sha, filePaths)
+    reader = gitExecutor.getObjectReader(gitDir)
+    contents = {}
+    for filePath in filePaths:
+        blob = reader.read("%s:%s" % (sha, filePath))
+        contents[filePath] = blob.decode('utf-8') if blob is not None else None
+    return contents
 
-    # Clone repo and checkout to release branch
-    cloneRepo(repo)
-    checkoutBranch(repo, branch)
-    gitModulesPath = path.join(getRepoPath(repo), ".gitmodules")
-    if not path.exists(gitModulesPath):
-        return
+def readFileAtBranch(repo, branch, filePath):
+    """
+    Reads a file at the tip of a remote branch without checking out a working tree.
+    Returns a (sha, contents) tuple, sha is None if the branch does not exist and contents is None if the file does not exist
+    """
+
+    gitDir, sha = fetchBranchObjects(repo, branch)
+    if sha is None:
+        return None, None
+    return sha, readFilesAtCommit(gitDir, sha, [filePath])[filePath]
+
+def submoduleURLToRepo(url):
+    """ Converts a submodule url (ex. '../cdap.git' or 'git@github.com:cdapio/cdap.git') into the full repo name """
+
+    parts = [p for p in re.split(r'[/:]', url.replace(".git", "")) if p not in ['', '.', '..']]
+    return getFullRepoName('/'.join(parts[-2:]) if len(parts) > 1 and '.' not in parts[-2] else parts[-1])
+
+def getSubmodules(repo):
+    """
+    Returns the direct submodules of the current commit of a given repo as a list of dicts with the keys
+    path, repo, branch and sha (the commit recorded by the gitlink in the parent tree). Nothing is fetched
+    """
+
+    repoPath = getRepoPath(repo)
+    if not path.exists(path.join(repoPath, ".gitmodules")):
+        return []
+
+    # Read the path, url and branch of every submodule from the .gitmodules file
+    out = gitExecutor.run(repoPath, ['config', '-f', '.gitmodules', '-z', '--get-regexp', r'^submodule\..*\.(path|url|branch)$'],
+                          check=True, query=True).stdout.decode('utf-8')
+    modules = {}
+    for entry in out.split('\0'):
+        if '\n' not in entry:
+            continue
+        key, value = entry.split('\n', 1)
+        name, setting = key[len('submodule.'):].rsplit('.', 1)
+        modules.setdefault(name, {})[setting] = value
+
+    # Read the commits recorded for the submodules in the parent tree, only the gitlinks are listed instead of the whole tree
+    modulePaths = [module['path'] for module in modules.values() if 'path' in module]
+    if len(modulePaths) == 0:
+        return []
+    gitlinks = {}
+    out = gitExecutor.run(repoPath, ['ls-tree', '-z', 'HEAD', '--'] + modulePaths, check=True, query=True).stdout.decode('utf-8')
+    for entry in out.split('\0'):
+        if not entry.startswith('160000 '):
+            continue
+        info, modulePath = entry.split('\t', 1)
+        gitlinks[modulePath] = info.split(' ')[2]
+
+    submodules = []
+    for name, module in sorted(modules.items()):
+        if 'path' not in module or 'url' not in module:
+            continue
+        submodules.append({'path': module['path'], 'repo': submoduleURLToRepo(module['url']),
+                           'branch': module.get('branch'), 'sha': gitlinks.get(module['path'])})
+    return submodules
+
+def countCommits(repo, branch, fromSha, toSha):
+    """ Returns the number of commits between two commits of a repo, fetching the branch into the mirror if needed. None if unknown """
+
+    gitDir, _ = fetchBranchObjects(repo, branch)
+    if gitDir is None or fromSha is None:
+        return None
+    result = gitExecutor.run(gitDir, ["rev-list", "--count", "%s..%s" % (fromSha, toSha)], showErrors=False, query=True)
+    return int(result.output()) if result.ok() else None
+
+def getSubmoduleDrift(repo):
+    """
+    Compares the commits recorded for the submodules of a repo with the current tips of the branches they track.
+    The remote tips of all submodules are fetched in one batched ref query, only submodules that moved are fetched to
+    count how far behind they are. Returns the list from getSubmodules with 'remoteSha' and 'behind' (commit count) added
+    """
 
-    modulesFile = open(gitModulesPath)
-    moduleContents = modulesFile.read()
-    modulesFile.close()
+    submodules = getSubmodules(repo)
+    refIndex.buildIndex(list(dict.fromkeys(m['repo'] for m in submodules)), syncWorkers, refresh=True)
+    for module in submodules:
+        module['remoteSha'] = None
+        module['behind'] = 0
+        if module['branch'] is None:
+            continue
+        module['remoteSha'] = refIndex.getBranchSha(module['repo'], module['branch'])
+        if module['remoteSha'] is not None and module['remoteSha'] != module['sha']:
+            module['behind'] = countCommits(module['repo'], module['branch'], module['sha'], module['remoteSha'])
+    return submodules
 
-    # Use RegEx to extract all repo names and corresponding release branches from the submodules file
-    repoQueue = []
-    matches = re.finditer(gitmodulesRegex, moduleContents, re.MULTILINE)
-    for matchNum, match in enumerate(matches, start=1):
-        newRepo, newBranch = match.groups()
-        newRepo = getFullRepoName(newRepo.replace(".git", ""))
-        releaseBranchMap[newRepo] = newBranch
-        repoQueue.append(newRepo)
+def stageSubmoduleCommits(repo, moduleShas):
+    """ Points the gitlinks of the given submodules (map of path -> sha) at new commits in the index, nothing is checked out """
 
-    submoduleRepos[repo] = repoQueue
-    print("Found %d submodules" % len(repoQueue))
-    for repo in repoQueue:
-        mapBranchVersionsRecurse(version, repo)
+    args = ['update-index', '--add']
+    for modulePath, sha in moduleShas.items():
+        args += ['--cacheinfo', "160000,%s,%s" % (sha, modulePath)]
+    return gitExecutor.run(getRepoPath(repo), args).code
+
+def getManifestPath():
+    """ Returns the filesystem path of the release manifest """
+
+    return path.join(os.getcwd(), releaseManifestFilename)
+
+def loadReleaseManifest(version, repo="cdapio/cdap-build"):
+    """
+    Loads the release manifest written by a previous run. The manifest is only returned if it was generated for
+    the same version and every branch still points to the recorded commit, otherwise None is returned
+    """
+
+    if not path.exists(getManifestPath()):
+        return None
+    try:
+        with open(getManifestPath()) as manifestFile:
+            manifest = json.load(manifestFile)
+    except (ValueError, OSError):
+        return None
+    if manifest.get('version') != version or manifest.get('root') != repo:
+        return None
+
+    refIndex.refreshIndex(list(manifest['repos'].keys()), syncWorkers)  # A manifest checked against stale refs would hide moved branches
+    for manifestRepo, entry in manifest['repos'].items():
+        try:
+            if refIndex.getBranchSha(manifestRepo, entry['branch']) != entry['sha']:
+                return None
+        except Exception as e:
+            return None
+    return manifest
+
+def saveReleaseManifest(version, repo, repoShas):
+    """ Writes the release manifest (repo -> branch -> commit sha) so later runs and other scripts can reuse it """
+
+    manifest = {
+        'version': version,
+        'root': repo,
+        'repos': {r: {'branch': branch, 'sha': sha} for r, (branch, sha) in repoShas.items()},
+        'submodules': submoduleRepos,
+    }
+    with open(getManifestPath(), 'w') as manifestFile:
+        json.dump(manifest, manifestFile, indent=2, sort_keys=True)
+    print("Wrote release manifest to '%s'" % getManifestPath())
 
 def mapBranchVersions(version, repo="cdapio/cdap-build"):
-    mapBranchVersionsRecurse(version)
+    """
+    This generates repo-to-branch mappings for release branches. This is required because the version of
+    CDAP (ex. 6.1.4) is not the same as the versions for the other repos that are bundled with it.
+
+    For example, the source code for CDAP 6.1.4 is in the cdap repo in the release/6.1 branch. The hydrator plugins
+    for this version are in the hydrator-plugins repo in the release/2.3 branch. We need a mapping that tells us which
+    branch should be targetted for each repo.
+
+    This is accomplished by examining the .gitsubmodules file in the cdap-build repo in the corresponding release branch.
+    The branches in cdap-build follow the convention 'release/Major.Minor' so given a version string we can find the correct branch.
+    From there we visit the repos that appear in the submodules file breadth-first (each repo/branch pair only once)
+    and construct a mapping. The .gitmodules files are read from the bare mirrors so no repo needs to be checked out.
+
+    The result is saved in a release manifest together with the commit sha of every branch. If the manifest is still
+    current (same version and no branch has moved) it is reused and nothing needs to be read at all
+    """
+
+    manifest = loadReleaseManifest(version, repo)
+    if manifest is not None:
+        print("Using release manifest '%s'" % getManifestPath())
+        for manifestRepo, entry in manifest['repos'].items():
+            if manifestRepo != repo:
+                releaseBranchMap[manifestRepo] = entry['branch']
+        submoduleRepos.update(manifest['submodules'])
+        return (releaseBranchMap, submoduleRepos)
+
+    # Fetch the refs of all known repos in parallel up front so the scan below only does local lookups
+    refIndex.refreshIndex(list(dict.fromkeys([repo] + repos)), syncWorkers)
+    repoShas = {}
+    visited = set()
+    repoQueue = deque([repo])
+    while len(repoQueue) > 0:
+        currentRepo = repoQueue.popleft()
+        branch = getReleaseBranch(currentRepo, version)
+        if (currentRepo, branch) in visited:
+            continue
+        visited.add((currentRepo, branch))
+
+        print("Scanning repo '%s' for submodules" % currentRepo)
+        sha, moduleContents = readFileAtBranch(currentRepo, branch, ".gitmodules")
+        repoShas[currentRepo] = (branch, sha)
+        if moduleContents is None:
+            continue
+
+        # Use RegEx to extract all repo names and corresponding release branches from the submodules file
+        modules = []
+        matches = re.finditer(gitmodulesRegex, moduleContents, re.MULTILINE)
+        for matchNum, match in enumerate(matches, start=1):
+            newRepo, newBranch = match.groups()
+            newRepo = getFullRepoName(newRepo.replace(".git", ""))
+            releaseBranchMap[newRepo] = newBranch
+            modules.append(newRepo)
+            repoQueue.append(newRepo)
+
+        submoduleRepos[currentRepo] = modules
+        print("Found %d submodules" % len(modules))
+
+    saveReleaseManifest(version, repo, repoShas)
     return (releaseBranchMap, submoduleRepos)
@@ -0,0 +1,199 @@
+from os import path
+import subprocess
+import os
+import threading
+import tracing
+import atexit
+import time
+import sys
+
+# Runs git directly (without a shell) and returns structured results.
+# Objects are read and refs are resolved through long-lived 'git cat-file --batch' and '--batch-check' processes,
+# one of each per repo, instead of a process per read
+quiteMode = True
+
+# Map of git subcommand -> {'count': <number of runs>, 'seconds': <total wall time>}
+stats = {}
+statsLock = threading.Lock()
+
+readers = {}
+readersLock = threading.Lock()
+
+
+class GitResult():
+    """ Class to hold the outcome of a single git command """
+
+    def __init__(self, args, cwd, code, stdout, stderr, duration):
+        self.args = args
+        self.cwd = cwd
+        self.code = code
+        self.stdout = stdout
+        self.stderr = stderr
+        self.duration = duration  # Seconds
+
+    def ok(self):
+        return self.code == 0
+
+    def output(self):
+        """ Returns stdout as a stripped string """
+
+        return self.stdout.decode('utf-8').strip()
+
+    def toString(self):
+        return "git %s (exit code %d, %.2fs)" % (" ".join(self.args), self.code, self.duration)
+
+
+class GitError(Exception):
+    """ Raised when a git command that is required to succeed fails """
+
+    def __init__(self, result):
+        Exception.__init__(self, "%s: %s" % (result.toString(), result.stderr.decode('utf-8', 'replace').strip()))
+        self.result = result
+
+
+def setQuiteMode(mode):
+    global quiteMode
+    quiteMode=mode
+
+def recordStats(subcommand, duration):
+    with statsLock:
+        entry = stats.setdefault(subcommand, {'count': 0, 'seconds': 0.0})
+        entry['count'] += 1
+        entry['seconds'] += duration
+
+def printStats():
+    """ Prints the number of runs and the total time of every git subcommand, slowest first """
+
+    print("git commands:")
+    for subcommand, entry in sorted(stats.items(), key=lambda item: -item[1]['seconds']):
+        print("  %-16s %5d runs %8.2fs" % (subcommand, entry['count'], entry['seconds']))
+
+def run(cwd, args, input=None, check=False, showErrors=True, query=False):
+    """
+    Runs 'git <args>' in the given directory and returns a GitResult. Output is captured, it is printed when quiteMode is off
+    unless the command is a query (its stdout is the result and is only used by the caller).
+    The stderr of failed commands is printed unless showErrors is False (for commands that are expected to fail sometimes).
+    If check is True a GitError is raised when the command fails
+    """
+
+    start = time.time()
+    process = subprocess.run(['git'] + args, cwd=cwd, input=input, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    result = GitResult(args, cwd, process.returncode, process.stdout, process.stderr, time.time() - start)
+    recordStats(args[0], result.duration)
+    tracing.recordSpan("git %s" % args[0], tracing.gitCategory, start, result.duration,
+                       {'args': args, 'repo': path.basename(path.abspath(cwd)), 'exitCode': result.code, 'bytes': len(result.stdout)})
+
+    if not quiteMode:
+        if not query:
+            sys.stdout.write(process.stdout.decode('utf-8', 'replace'))
+        sys.stdout.write(process.stderr.decode('utf-8', 'replace'))
+    elif result.code != 0 and showErrors:
+        sys.stderr.write(process.stderr.decode('utf-8', 'replace'))
+    if check and result.code != 0:
+        raise GitError(result)
+    return result
+
+def runAll(cwd, commands, showErrors=True):
+    """ Runs several git commands in order and stops at the first one that fails (like joining them with &&). Returns the results """
+
+    results = []
+    for args in commands:
+        results.append(run(cwd, args, showErrors=showErrors))
+        if results[-1].code != 0:
+            break
+    return results
+
+def resolveRefs(cwd, refs):
+    """ Resolves several refs with the shared 'cat-file --batch-check' process of a repo, returns a map of ref -> sha. Refs that do not exist map to None """
+
+    return getObjectReader(cwd, checkOnly=True).resolve(refs)
+
+
+def parseHeader(line):
+    """
+    Parses a reply of 'cat-file --batch' or '--batch-check' into (sha, type, size). Returns None for '<name> missing' and
+    '<name> ambiguous', the name is echoed as given so it can contain spaces (ex. '<sha>:some dir/pom.xml missing')
+    """
+
+    fields = line.decode('utf-8').rstrip('\n').rsplit(' ', 2)
+    if len(fields) != 3 or fields[-1] in ['missing', 'ambiguous'] or not fields[2].isdigit():
+        return None
+    return fields[0], fields[1], int(fields[2])
+
+
+class ObjectReader():
+    """
+    Long-lived 'git cat-file --batch' process for a repo (its git dir or working tree). Objects are read by sending their name and
+    reading the reply, so any number of reads only costs one process. Reads are serialized with a lock so a reader can be shared
+    between threads. With checkOnly the process runs 'cat-file --batch-check', which only resolves names to shas.
+    Refs are read again for every name, so the answers follow ref updates made by other git commands
+    """
+
+    def __init__(self, gitDir, checkOnly=False):
+        self.gitDir = gitDir
+        self.checkOnly = checkOnly
+        self.lock = threading.Lock()
+        self.process = subprocess.Popen(['git', 'cat-file', '--batch-check' if checkOnly else '--batch'],
+                                        cwd=gitDir, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def read(self, name):
+        """ Returns the contents of an object (ex. '<sha>:<path>') as bytes, or None if it does not exist """
+
+        start = time.time()
+        with self.lock:
+            self.process.stdin.write(("%s\n" % name).encode('utf-8'))
+            self.process.stdin.flush()
+            header = parseHeader(self.process.stdout.readline())
+            if header is None:
+                contents = None
+            else:
+                contents = self.process.stdout.read(header[2])
+                self.process.stdout.read(1)  # Trailing newline
+        recordStats('cat-file', time.time() - start)
+        tracing.recordSpan("git cat-file", tracing.gitCategory, start, time.time() - start,
+                           {'object': name, 'gitDir': self.gitDir, 'bytes': len(contents) if contents is not None else 0})
+        return contents
+
+    def resolve(self, names):
+        """ Returns a map of name (ex. 'HEAD' or 'refs/heads/<branch>') -> sha, names that do not exist map to None """
+
+        start = time.time()
+        shas = {}
+        with self.lock:
+            self.process.stdin.write("".join("%s\n" % name for name in names).encode('utf-8'))
+            self.process.stdin.flush()
+            for name in names:
+                header = parseHeader(self.process.stdout.readline())
+                shas[name] = header[0] if header is not None else None
+        recordStats('cat-file', time.time() - start)
+        tracing.recordSpan("git cat-file", tracing.gitCategory, start, time.time() - start, {'refs': names, 'gitDir': self.gitDir})
+        return shas
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait()
+
+
+def getObjectReader(gitDir, checkOnly=False):
+    """ Returns the shared object reader for a repo, starting it on first use """
+
+    key = (path.abspath(gitDir), checkOnly)
+    with readersLock:
+        if key not in readers or readers[key].process.poll() is not None:
+            readers[key] = ObjectReader(gitDir, checkOnly)
+        return readers[key]
+
+def closeReader(gitDir):
+    """ Stops the readers of a repo, this has to be done before the repo is deleted """
+
+    with readersLock:
+        for key in [key for key in readers if key[0] == path.abspath(gitDir) or key[0].startswith(path.abspath(gitDir) + os.sep)]:
+            readers.pop(key).close()
+
+def closeReaders():
+    with readersLock:
+        for reader in readers.values():
+            reader.close()
+        readers.clear()
+
+atexit.register(closeReaders)
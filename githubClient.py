@@ -0,0 +1,141 @@
+from requests.adapters import HTTPAdapter
+import githubRateLimit
+import subprocess
+import threading
+import requests
+import time
+import os
+
+# Client for the GitHub API. All requests share one session so connections (and their TLS handshakes) are reused
+apiURL = os.environ.get("GITHUB_API_URL", "https://api.github.com")  # Can be pointed at a local stand-in (see githubStandIn.py)
+requestTimeout = 60
+maxRetries = 5
+maxRetryWait = 15*60  # Seconds, a rate limit reset further away than this fails the request instead of waiting
+poolSize = 16
+
+session = None
+sessionLock = threading.Lock()
+token = None
+
+
+class GitHubError(Exception):
+    """ Raised when a request to the GitHub API fails """
+
+    def __init__(self, message, status=None):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+def setAPIURL(url):
+    global apiURL
+    apiURL=url.rstrip('/')
+
+def getToken():
+    """ Returns the GitHub token from the environment, or the one gh is logged in with. None if there is neither """
+
+    global token
+    if token is None:
+        token = os.environ.get("GITHUB_TOKEN") or os.environ.get("GH_TOKEN")
+    if token is None:
+        try:
+            token = subprocess.check_output("gh auth token", shell=True, stderr=subprocess.DEVNULL).decode('utf-8').strip()
+        except subprocess.CalledProcessError:
+            token = ""
+    return token or None
+
+def getSession():
+    """ Returns the shared keep-alive session, it is created on first use """
+
+    global session
+    with sessionLock:
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=poolSize, pool_maxsize=poolSize)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers['Accept'] = "application/vnd.github+json"
+            if getToken() is not None:
+                session.headers['Authorization'] = "token %s" % getToken()
+    return session
+
+def getRetryWait(response, attempt):
+    """
+    Returns the number of seconds to wait before retrying a failed response, or None if it should not be retried.
+    Rate limited responses wait for the time given in their headers, server errors back off exponentially
+    """
+
+    if response.status_code in [403, 429]:
+        return githubRateLimit.getRetryWait(response)  # None for a permission error
+    if response.status_code >= 500:
+        return 2**attempt
+    return None
+
+def request(method, endpoint, **kwargs):
+    """
+    Sends a request to the API (endpoint is relative to the API URL) and returns the response.
+    Rate limited requests and server errors are retried, a GitHubError is raised for responses that still fail
+    """
+
+    url = endpoint if endpoint.startswith("http") else "%s/%s" % (apiURL, endpoint.lstrip('/'))
+    for attempt in range(maxRetries + 1):
+        try:
+            response = githubRateLimit.request(method, url, session=getSession(), timeout=requestTimeout, **kwargs)
+        except requests.exceptions.ConnectionError as e:
+            if attempt == maxRetries:
+                raise GitHubError("%s %s failed: %s" % (method, url, e))
+            time.sleep(2**attempt)
+            continue
+        if response.status_code < 400:
+            return response
+
+        wait = getRetryWait(response, attempt)
+        if wait is None or wait > maxRetryWait or attempt == maxRetries:
+            raise GitHubError("%s %s failed with status %d: %s" % (method, url, response.status_code, response.text[:200]), response.status_code)
+        print("WARN: %s %s returned %d, retrying in %d seconds" % (method, url, response.status_code, wait))
+        if response.status_code >= 500:
+            time.sleep(wait)  # Rate limited requests are held back by githubRateLimit until the limit is lifted
+
+def graphQL(query, variables):
+    """ Runs a GraphQL query against the API and returns the data, raises a GitHubError on errors """
+
+    result = request("POST", "graphql", json={'query': query, 'variables': variables}).json()
+    if result.get('errors'):
+        raise GitHubError("; ".join(e.get('message', str(e)) for e in result['errors']))
+    return result['data']
+
+def createPR(repo, title, body, head, base, labels=None):
+    """ Creates a PR and applies the given labels, returns the PR (as returned by the API) """
+
+    pr = request("POST", "repos/%s/pulls" % repo, json={'title': title, 'body': body, 'head': head, 'base': base}).json()
+    if labels:
+        addLabels(repo, pr['number'], labels)
+    return pr
+
+def addLabels(repo, number, labels):
+    """ Adds labels to a PR or issue """
+
+    request("POST", "repos/%s/issues/%d/labels" % (repo, number), json={'labels': labels})
+
+def findPR(repo, branch):
+    """ Returns the most recent PR (in any state) for a given head branch, or None if there is none """
+
+    owner = repo.split("/")[0]
+    prs = request("GET", "repos/%s/pulls" % repo, params={'head': "%s:%s" % (owner, branch), 'state': 'all', 'per_page': 1}).json()
+    return prs[0] if len(prs) > 0 else None
+
+def getPRState(pr):
+    """ Returns the state of a PR as OPEN, CLOSED or MERGED """
+
+    if pr.get('merged_at'):
+        return 'MERGED'
+    return pr['state'].upper()
+
+def closePR(repo, number):
+    """ Closes a PR """
+
+    request("PATCH", "repos/%s/pulls/%d" % (repo, number), json={'state': 'closed'})
+
+def createTag(repo, tag, sha):
+    """ Creates a lightweight tag pointing at the given commit, the commit must already be pushed """
+
+    request("POST", "repos/%s/git/refs" % repo, json={'ref': "refs/tags/%s" % tag, 'sha': sha})
@@ -0,0 +1,151 @@
+from urllib.parse import urlparse
+import threading
+import tracing
+import time
+
+# Scheduler for all requests to the GitHub API. It tracks the quota GitHub reports in the X-RateLimit-* headers of every response
+# and works like a token bucket: requests go out at full speed while there is plenty of quota, once it runs low they are spread
+# evenly over the time left until the reset so it lasts, and when it is used up they wait until the advertised reset time.
+# Secondary rate limits hold back every request for as long as GitHub asks
+paceBelow = 0.1  # Fraction of the limit left below which requests are paced
+secondaryLimitWait = 60  # Seconds to wait after a secondary rate limit response that does not say how long to wait
+clockSkew = 1  # Seconds added to reset times, the clocks of GitHub and this machine are not exactly in sync
+
+# Map of resource (ex. 'core', 'graphql', see X-RateLimit-Resource) -> {'limit', 'remaining', 'used', 'reset', 'inFlight', 'nextSlot'}
+# remaining and reset are None until a response for the resource was seen, or after the reset passed
+quotas = {}
+blockedUntil = 0  # Epoch seconds until which a secondary rate limit holds back all requests
+quotaLock = threading.Condition()
+stats = {'requests': 0, 'rateLimited': 0, 'secondaryLimited': 0, 'waits': 0, 'waitSeconds': 0.0}
+
+
+def getResource(url):
+    """ Returns the rate limit resource a request to the API counts against """
+
+    urlPath = urlparse(url).path
+    if urlPath.rstrip('/').endswith('/graphql'):
+        return 'graphql'
+    if '/search/' in urlPath:
+        return 'search'
+    return 'core'
+
+def getQuota(resource):
+    """ Returns the quota of a resource, it must be called with the lock held """
+
+    if resource not in quotas:
+        quotas[resource] = {'limit': None, 'remaining': None, 'used': None, 'reset': None, 'inFlight': 0, 'nextSlot': 0}
+    return quotas[resource]
+
+def getLimitType(response):
+    """ Returns 'primary' or 'secondary' for a rate limited response, None for any other response (ex. a permission error) """
+
+    if response.status_code not in [403, 429]:
+        return None
+    if response.headers.get('X-RateLimit-Remaining') == '0' and 'Retry-After' not in response.headers:
+        return 'primary'
+    if 'Retry-After' in response.headers or response.status_code == 429 or 'secondary rate limit' in response.text.lower():
+        return 'secondary'
+    return None
+
+def getRetryWait(response):
+    """ Returns the number of seconds until a rate limited request can be retried, None if the response is not rate limited """
+
+    limitType = getLimitType(response)
+    if limitType == 'primary' and 'X-RateLimit-Reset' in response.headers:
+        return max(0, int(response.headers['X-RateLimit-Reset']) - time.time()) + clockSkew
+    if limitType is not None:
+        return int(response.headers.get('Retry-After', secondaryLimitWait))
+    return None
+
+def getWait(quota, now):
+    """ Returns the number of seconds a request has to wait for its turn, it must be called with the lock held """
+
+    if blockedUntil > now:
+        return blockedUntil - now
+    if quota['remaining'] is None:
+        return 0
+    available = quota['remaining'] - quota['inFlight']
+    if available <= 0:
+        return quota['reset'] + clockSkew - now
+    if available < quota['limit'] * paceBelow:
+        return quota['nextSlot'] - now
+    return 0
+
+def acquire(url):
+    """ Waits until a request to the given URL can be sent and reserves quota for it. Returns the resource to pass to release """
+
+    resource = getResource(url)
+    start = time.time()
+    with quotaLock:
+        quota = getQuota(resource)
+        while True:
+            now = time.time()
+            if quota['reset'] is not None and now >= quota['reset'] + clockSkew:
+                quota.update(remaining=None, reset=None, nextSlot=0)  # The quota was refilled, the next response tells by how much
+            wait = getWait(quota, now)
+            if wait <= 0:
+                break
+            quotaLock.wait(wait)
+
+        if quota['remaining'] is not None:
+            available = quota['remaining'] - quota['inFlight']
+            if available < quota['limit'] * paceBelow:
+                quota['nextSlot'] = max(now, quota['nextSlot']) + (quota['reset'] + clockSkew - now) / available
+        quota['inFlight'] += 1
+        waited = now - start
+        if waited > 0.001:
+            stats['waits'] += 1
+            stats['waitSeconds'] += waited
+
+    if waited > 0.001:
+        tracing.recordSpan("GitHub rate limit (%s)" % resource, tracing.waitCategory, start, waited, {'url': url})
+    return resource
+
+def release(resource, response):
+    """ Updates the quota from the rate limit headers of a response, response is None if the request failed without one """
+
+    global blockedUntil
+    with quotaLock:
+        getQuota(resource)['inFlight'] -= 1
+        stats['requests'] += 1
+        if response is not None and 'X-RateLimit-Remaining' in response.headers and 'X-RateLimit-Reset' in response.headers:
+            quota = getQuota(response.headers.get('X-RateLimit-Resource', resource))
+            remaining = int(response.headers['X-RateLimit-Remaining'])
+            reset = int(response.headers['X-RateLimit-Reset'])
+            if quota['reset'] is not None and reset == quota['reset']:
+                remaining = min(remaining, quota['remaining'])  # Responses of concurrent requests can arrive out of order
+            if quota['reset'] is None or reset >= quota['reset']:
+                quota.update(remaining=remaining, reset=reset, limit=int(response.headers.get('X-RateLimit-Limit', remaining)),
+                             used=int(response.headers['X-RateLimit-Used']) if 'X-RateLimit-Used' in response.headers else None)
+
+        limitType = getLimitType(response) if response is not None else None
+        if limitType == 'primary':
+            stats['rateLimited'] += 1
+        elif limitType == 'secondary':
+            stats['secondaryLimited'] += 1
+            blockedUntil = max(blockedUntil, time.time() + getRetryWait(response))
+        quotaLock.notify_all()
+
+def request(method, url, session=None, **kwargs):
+    """ Sends a request to the API with tracing.request once it is its turn, the quota is updated from the response """
+
+    resource = acquire(url)
+    response = None
+    try:
+        response = tracing.request(method, url, session=session, **kwargs)
+        return response
+    finally:
+        release(resource, response)
+
+def printQuota():
+    """ Prints the quota left for every resource and how often requests had to wait for it, nothing if no request was sent """
+
+    if stats['requests'] == 0:
+        return
+    with quotaLock:
+        for resource, quota in sorted(quotas.items()):
+            if quota['remaining'] is not None:
+                print("GitHub rate limit '%s': %d of %d left, resets at %s" %
+                      (resource, quota['remaining'], quota['limit'], time.strftime("%H:%M:%S", time.localtime(quota['reset']))))
+        print("GitHub requests: %(requests)d sent, %(rateLimited)d rate limited, %(secondaryLimited)d secondary rate limited, "
+              "waited %(waits)d times for %(waitSeconds).1f seconds" % stats)
@@ -0,0 +1,339 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import threading
+import argparse
+import hashlib
+import base64
+import json
+import time
+import re
+
+# Local stand-in for the parts of the GitHub API used by the release tools, so they can be run without GitHub access.
+# PRs can be listed (GraphQL), created, labeled and closed and tags can be created (REST).
+# Point the tools at it with GITHUB_API_URL=http://localhost:<port> (or --github-api).
+# The PR data is a JSON file that maps repos to their PRs, ex.
+# {"cdapio/cdap": [{"number": 1, "headRefName": "release-remove-snapshot-610", "baseRefName": "release/6.1", "labels": ["automated-release"], "state": "OPEN"}]}
+# Repo licenses can be served too (for generateLicenses), both through the API (/repos/<repo>/license) and as raw files
+# (/raw/<repo>/<path>, set GITHUB_RAW_URL=http://localhost:<port>/raw). The license data is a JSON file that maps repos to the license text.
+# The licenses can also be looked up with the aliased repository/licenseInfo query sent by generateLicenses.
+# A rate limit can be set, API responses then carry X-RateLimit-* headers and requests above the limit get a 403 like on GitHub
+
+repoAliasRegex = re.compile(r"r(\d+):\s*repository\(")
+licenseAliasRegex = re.compile(r"l(\d+):\s*repository\(")
+licenseFileRegex = re.compile(r'(f\d+):\s*object\(expression:\s*"HEAD:([^"]+)"\)')
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """ Request handler that answers from the PR data of the server it belongs to """
+
+    protocol_version = "HTTP/1.1"  # Keep connections alive like GitHub does, every response has a Content-Length
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def sendJSON(self, code, body):
+        if isinstance(body, str):
+            self.sendText(code, body)
+            return
+        self.sendContents(code, json.dumps(body).encode('utf-8'), "application/json")
+
+    def sendText(self, code, body):
+        self.sendContents(code, body.encode('utf-8'), "text/plain")
+
+    def sendContents(self, code, contents, contentType):
+        """ Sends a response, successful GET responses get an ETag and a conditional request with a matching ETag gets a 304 """
+
+        etag = '"%s"' % hashlib.md5(contents).hexdigest() if code == 200 and self.command == 'GET' else None
+        if etag is not None and self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.sendRateLimitHeaders()
+            self.end_headers()
+            return
+        self.send_response(code)
+        self.sendRateLimitHeaders()
+        self.send_header("Content-Type", contentType)
+        self.send_header("Content-Length", str(len(contents)))
+        if etag is not None:
+            self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(contents)
+
+    def handle_one_request(self):
+        # Headers of the rate limit the request counts against. The handler serves every request of a keep-alive connection,
+        # so they are reset per request, responses that do not count against the limit (ex. raw files) have none
+        self.rateLimitHeaders = {}
+        super().handle_one_request()
+
+    def sendRateLimitHeaders(self):
+        for name, value in self.rateLimitHeaders.items():
+            self.send_header(name, str(value))
+
+    def readJSON(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length).decode('utf-8')) if length > 0 else {}
+
+    def route(self, method):
+        """ Finds the server method for a request and sends its (status, body) result """
+
+        url = urlparse(self.path)
+        body = self.readJSON() if method != 'GET' else {}
+        if self.server.latency > 0:
+            time.sleep(self.server.latency)
+        if not url.path.startswith("/raw/"):
+            self.rateLimitHeaders, allowed = self.server.useQuota('graphql' if url.path.rstrip('/') == "/graphql" else 'core')
+            if not allowed:
+                self.sendJSON(403, {'message': 'API rate limit exceeded (stand-in)'})
+                return
+        if method == 'POST' and url.path.rstrip('/') == "/graphql":
+            query = body.get('query', '')
+            answer = self.server.answerLicenseQuery if licenseAliasRegex.search(query) else self.server.answerPRQuery
+            self.sendJSON(200, {'data': answer(query, body.get('variables') or {})})
+            return
+        for routeMethod, regex, handler in restRoutes:
+            match = regex.match(url.path)
+            if routeMethod == method and match:
+                self.sendJSON(*handler(self.server, *match.groups(), body=body, params=parse_qs(url.query)))
+                return
+        self.sendJSON(404, {'message': 'Not Found'})
+
+    def do_GET(self):
+        self.route('GET')
+
+    def do_POST(self):
+        self.route('POST')
+
+    def do_PATCH(self):
+        self.route('PATCH')
+
+
+class StandInServer(ThreadingHTTPServer):
+    """ HTTP server that holds the PR data in memory """
+
+    daemon_threads = True
+    handlerClass = StandInHandler
+
+    def __init__(self, address, prs, verbose=False, licenses=None, latency=0, rateLimit=None, rateLimitWindow=60):
+        ThreadingHTTPServer.__init__(self, address, self.handlerClass)
+        self.prs = prs
+        self.refs = {}  # Map of repo -> {ref: sha} for the refs created through the API
+        self.lastNumber = max([pr['number'] for repoPRs in prs.values() for pr in repoPRs] + [0])
+        self.licenses = licenses or {}  # Map of repo -> license text
+        self.latency = latency  # Seconds added to every response, to mimic the round trip to GitHub
+        self.rateLimit = rateLimit  # Requests allowed per resource in every window of rateLimitWindow seconds, None for no limit
+        self.rateLimitWindow = rateLimitWindow
+        self.rateLimitUsage = {}  # Map of resource -> [reset time, requests used in the window]
+        self.rateLimitRejected = 0  # Number of requests that were rejected because the limit was used up
+        self.onPRCreated = None  # Called with (repo, pr) for every new PR while the data lock is held, ex. to merge it right away
+        self.verbose = verbose
+        self.dataLock = threading.Lock()
+
+    def getURL(self):
+        return "http://%s:%d" % self.server_address[:2]
+
+    def useQuota(self, resource):
+        """ Counts a request against the rate limit of a resource, returns (rate limit headers, whether the request is allowed) """
+
+        if self.rateLimit is None:
+            return {}, True
+        with self.dataLock:
+            now = time.time()
+            usage = self.rateLimitUsage.setdefault(resource, [0, 0])
+            if now >= usage[0]:
+                usage[:] = [int(now) + self.rateLimitWindow, 0]  # A new window starts with the first request after the reset
+            allowed = usage[1] < self.rateLimit
+            if allowed:
+                usage[1] += 1
+            else:
+                self.rateLimitRejected += 1
+            return {'X-RateLimit-Limit': self.rateLimit, 'X-RateLimit-Remaining': self.rateLimit - usage[1], 'X-RateLimit-Reset': usage[0],
+                    'X-RateLimit-Used': usage[1], 'X-RateLimit-Resource': resource}, allowed
+
+    def toRestPR(self, repo, pr):
+        """ Returns a PR in the format of the REST API """
+
+        return {'number': pr['number'], 'html_url': pr.get('url', "https://github.com/%s/pull/%d" % (repo, pr['number'])),
+                'state': 'open' if pr.get('state', 'OPEN') == 'OPEN' else 'closed',
+                'merged_at': "2000-01-01T00:00:00Z" if pr.get('state') == 'MERGED' else None,
+                'head': {'ref': pr['headRefName']}, 'base': {'ref': pr['baseRefName']},
+                'labels': [{'name': label} for label in pr.get('labels', [])]}
+
+    def findPR(self, repo, number):
+        for pr in self.prs.get(repo, []):
+            if pr['number'] == int(number):
+                return pr
+        return None
+
+    def createPR(self, repo, body, params):
+        with self.dataLock:
+            prs = self.prs.setdefault(repo, [])
+            if any(pr['headRefName'] == body['head'] and pr.get('state', 'OPEN') == 'OPEN' for pr in prs):
+                return 422, {'message': 'A pull request already exists for %s' % body['head']}
+            self.lastNumber += 1
+            pr = {'number': self.lastNumber, 'headRefName': body['head'], 'baseRefName': body['base'], 'title': body.get('title'), 'state': 'OPEN'}
+            prs.append(pr)
+            if self.onPRCreated is not None:
+                self.onPRCreated(repo, pr)
+            return 201, self.toRestPR(repo, pr)
+
+    def listPRs(self, repo, body, params):
+        head = params.get('head', [None])[0]
+        state = params.get('state', ['open'])[0]
+        with self.dataLock:
+            prs = [self.toRestPR(repo, pr) for pr in reversed(self.prs.get(repo, []))
+                   if (head is None or "%s:%s" % (repo.split("/")[0], pr['headRefName']) == head)]
+        prs = [pr for pr in prs if state == 'all' or pr['state'] == state]
+        return 200, prs[:int(params.get('per_page', [30])[0])]
+
+    def updatePR(self, repo, number, body, params):
+        with self.dataLock:
+            pr = self.findPR(repo, number)
+            if pr is None:
+                return 404, {'message': 'Not Found'}
+            if body.get('state') == 'closed':
+                pr['state'] = 'CLOSED'
+            return 200, self.toRestPR(repo, pr)
+
+    def addLabels(self, repo, number, body, params):
+        with self.dataLock:
+            pr = self.findPR(repo, number)
+            if pr is None:
+                return 404, {'message': 'Not Found'}
+            pr['labels'] = sorted(set(pr.get('labels', []) + body.get('labels', [])))
+            return 200, [{'name': label} for label in pr['labels']]
+
+    def createRef(self, repo, body, params):
+        with self.dataLock:
+            refs = self.refs.setdefault(repo, {})
+            if body['ref'] in refs:
+                return 422, {'message': 'Reference already exists'}
+            refs[body['ref']] = body['sha']
+            return 201, {'ref': body['ref'], 'object': {'sha': body['sha'], 'type': 'commit'}}
+
+    def getLicense(self, repo, body, params):
+        if repo not in self.licenses:
+            return 404, {'message': 'Not Found'}
+        content = base64.encodebytes(self.licenses[repo].encode('utf-8')).decode('utf-8')
+        return 200, {'name': 'LICENSE', 'path': 'LICENSE', 'content': content, 'encoding': 'base64'}
+
+    def getRawFile(self, repo, filePath, body, params):
+        """ Serves the license of a repo as any file that has 'license' in its name """
+
+        if repo not in self.licenses or 'license' not in filePath.lower():
+            return 404, "404: Not Found"
+        return 200, self.licenses[repo]
+
+    def answerLicenseQuery(self, query, variables):
+        """ Answers the aliased repository/licenseInfo query sent by generateLicenses, the license is served as any file with 'license' in its name """
+
+        data = {}
+        files = dict(licenseFileRegex.findall(query))  # Map of alias -> file name
+        for alias in licenseAliasRegex.findall(query):
+            repo = "%s/%s" % (variables.get('o' + alias), variables.get('n' + alias))
+            if repo not in self.licenses:
+                data['l' + alias] = None
+                continue
+            repository = {'licenseInfo': {'spdxId': 'NOASSERTION'}, 'defaultBranchRef': {'name': 'master'}}
+            for fileAlias, name in files.items():
+                blob = {'oid': hashlib.sha1(self.licenses[repo].encode('utf-8')).hexdigest(), 'text': self.licenses[repo]}
+                repository[fileAlias] = blob if 'license' in name.lower() else None
+            data['l' + alias] = repository
+        return data
+
+    def answerPRQuery(self, query, variables):
+        """ Answers the aliased repository/pullRequests query sent by prIndex """
+
+        data = {}
+        with self.dataLock:
+            for alias in repoAliasRegex.findall(query):
+                repo = "%s/%s" % (variables.get('o' + alias), variables.get('n' + alias))
+                if repo not in self.prs:
+                    data['r' + alias] = None
+                    continue
+                label = variables.get('label')
+                prs = [pr for pr in self.prs[repo] if pr.get('state', 'OPEN') == 'OPEN' and (label is None or label in pr.get('labels', []))]
+                start = int(variables.get('c' + alias) or 0)
+                page = prs[start:start+100]
+                nodes = [{'number': pr['number'], 'url': pr.get('url', "https://github.com/%s/pull/%d" % (repo, pr['number'])),
+                          'headRefName': pr['headRefName'], 'baseRefName': pr['baseRefName']} for pr in page]
+                hasNextPage = start + len(page) < len(prs)
+                data['r' + alias] = {'pullRequests': {'nodes': nodes,
+                                                      'pageInfo': {'hasNextPage': hasNextPage, 'endCursor': str(start + len(page))}}}
+        return data
+
+
+# (method, path regex, server method) for the REST endpoints, the path groups are passed to the server method
+repoPath = r"^/repos/([^/]+/[^/]+)"
+restRoutes = [
+    ('POST', re.compile(repoPath + r"/pulls/?$"), StandInServer.createPR),
+    ('GET', re.compile(repoPath + r"/pulls/?$"), StandInServer.listPRs),
+    ('PATCH', re.compile(repoPath + r"/pulls/(\d+)$"), StandInServer.updatePR),
+    ('POST', re.compile(repoPath + r"/issues/(\d+)/labels$"), StandInServer.addLabels),
+    ('POST', re.compile(repoPath + r"/git/refs$"), StandInServer.createRef),
+    ('GET', re.compile(repoPath + r"/license$"), StandInServer.getLicense),
+    ('GET', re.compile(r"^/raw/([^/]+/[^/]+)/(.+)$"), StandInServer.getRawFile),
+]
+
+
+def startStandIn(prs, port=0, verbose=False, licenses=None, latency=0, rateLimit=None, rateLimitWindow=60):
+    """ Starts a stand-in server in a background thread and returns it, port 0 picks a free port """
+
+    return startServer(StandInServer(('127.0.0.1', port), prs, verbose, licenses, latency, rateLimit, rateLimitWindow))
+
+
+def startServer(server):
+    """ Serves requests with the given server in a background thread, returns the server """
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def parseArgs():
+    parser = argparse.ArgumentParser(description='Local stand-in for the GitHub API used by the release tools')
+    parser.add_argument('--data',
+                        help='JSON file that maps repos to their PRs, default is no PRs')
+    parser.add_argument('--licenses',
+                        help='JSON file that maps repos to their license text, default is no licenses')
+    parser.add_argument('--latency',
+                        type=float,
+                        default=0,
+                        help='milliseconds to wait before every response, default is 0')
+    parser.add_argument('--rate-limit',
+                        type=int,
+                        help='API requests allowed per resource (core, graphql) in every rate limit window, default is no limit')
+    parser.add_argument('--rate-limit-window',
+                        type=int,
+                        default=60,
+                        help='seconds after which the rate limit is reset, default is 60')
+    parser.add_argument('-p', '--port',
+                        type=int,
+                        default=8080,
+                        help='port to listen on, default is 8080')
+    parser.add_argument('-v', '--verbose',
+                        action='store_true',
+                        help='log every request')
+    return parser.parse_args()
+
+
+def main():
+    args = parseArgs()
+    prs = {}
+    if args.data:
+        with open(args.data) as dataFile:
+            prs = json.load(dataFile)
+    licenses = {}
+    if args.licenses:
+        with open(args.licenses) as licensesFile:
+            licenses = json.load(licensesFile)
+    server = StandInServer(('127.0.0.1', args.port), prs, args.verbose, licenses, args.latency/1000, args.rate_limit, args.rate_limit_window)
+    print("Serving the GitHub API stand-in on %s" % server.getURL())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
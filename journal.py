@@ -0,0 +1,116 @@
+from os import path
+import threading
+import json
+import time
+import os
+
+# The journal records which stages of a run were completed for each repo, so a run that stopped partway can be resumed.
+# Runs are identified by their operation and version (ex. 'remove_snapshot 6.1.4'), each run has its own entries
+journalFilename = "releaseJournal.json"  # Update the entry in the .gitignore if this file name is changed
+
+# Stages of a repo, in the order they are completed
+syncedStage = 'synced'
+rewrittenStage = 'rewritten'
+committedStage = 'committed'
+pushedStage = 'pushed'
+prStage = 'pr_created'
+taggedStage = 'tagged'
+doneStage = 'done'
+
+# Map of run -> repo -> stage -> {'value': <stage result, ex. a sha or PR URL>, 'at': <epoch seconds>}
+journal = {}
+journalLock = threading.Lock()
+currentRun = None  # Nothing is recorded until a run is started
+
+
+def setJournalFilename(name):
+    global journalFilename
+    journalFilename=name
+
+def getJournalPath():
+    """ Returns the filesystem path of the journal """
+
+    return path.join(os.getcwd(), journalFilename)
+
+def loadJournal():
+    """ Loads the journal from disk, an unreadable journal is ignored """
+
+    if not path.exists(getJournalPath()):
+        return
+    try:
+        with open(getJournalPath()) as journalFile:
+            persisted = json.load(journalFile)
+    except (ValueError, OSError):
+        print("WARN: Ignoring unreadable journal '%s'" % getJournalPath())
+        return
+    with journalLock:
+        journal.update(persisted)
+
+def saveJournal():
+    """ Persists the journal to disk """
+
+    with journalLock:
+        contents = json.dumps(journal, indent=2, sort_keys=True)
+        tmpPath = getJournalPath() + ".tmp"
+        with open(tmpPath, 'w') as journalFile:
+            journalFile.write(contents)
+        os.replace(tmpPath, getJournalPath())
+
+def startRun(run, restart=False):
+    """
+    Starts recording stages for a run. Stages recorded by earlier attempts of the same run are kept so they can be skipped,
+    unless restart is set. Returns the number of repos that have stages recorded already
+    """
+
+    global currentRun
+    loadJournal()
+    currentRun = run
+    with journalLock:
+        if restart:
+            journal[run] = {}
+        journal.setdefault(run, {})
+    saveJournal()
+    return len(journal[run])
+
+def getStage(repo, stage):
+    """ Returns the value recorded for a stage of a repo in the current run, None if the stage was not completed """
+
+    if currentRun is None:
+        return None
+    entry = journal[currentRun].get(repo, {}).get(stage)
+    return entry['value'] if entry is not None else None
+
+def isDone(repo, stage):
+    return currentRun is not None and stage in journal[currentRun].get(repo, {})
+
+def getLastStage(repo):
+    """ Returns the name of the last stage completed for a repo in the current run, None if no stage was completed """
+
+    if currentRun is None or len(journal[currentRun].get(repo, {})) == 0:
+        return None
+    return max(journal[currentRun][repo].items(), key=lambda item: item[1]['at'])[0]
+
+def getValues(stage):
+    """ Returns a map of repo -> value for every repo that completed the given stage in the current run """
+
+    if currentRun is None:
+        return {}
+    return {repo: stages[stage]['value'] for repo, stages in journal[currentRun].items() if stage in stages}
+
+def record(repo, stage, value=True):
+    """ Records that a repo completed a stage in the current run """
+
+    if currentRun is None:
+        return
+    with journalLock:
+        journal[currentRun].setdefault(repo, {})[stage] = {'value': value, 'at': time.time()}
+    saveJournal()
+
+def resetRepo(repo):
+    """ Forgets all stages of a repo in the current run, it will be processed from the start """
+
+    if currentRun is None:
+        return
+    with journalLock:
+        journal[currentRun].pop(repo, None)
+    saveJournal()
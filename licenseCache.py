@@ -0,0 +1,190 @@
+from os import path
+import threading
+import json
+import time
+import os
+
+# Licenses downloaded by generateLicenses are cached on disk so reruns and later releases do not download them again.
+# Entries younger than freshTTL are used as-is, older entries are revalidated with a conditional request (ETag/Last-Modified)
+# which costs a round trip but no rate limit on GitHub. Entries that were not used for maxAge are evicted
+cacheFilename = "licenseCache.json"  # Update the entry in the .gitignore if this file name is changed
+freshTTL = 24*60*60  # Seconds
+maxAge = 90*24*60*60  # Seconds since an entry was last used before it is evicted
+maxEntries = 10000  # The least recently used entries are evicted above this
+failureTTL = 7*24*60*60  # Seconds a URL that had no license is skipped before it is tried again
+
+# 'licenses': resolved URL (the URL the license was downloaded from) -> {'kind', 'content', 'etag', 'lastModified', 'fetchedAt', 'usedAt', 'repo'}
+# 'urls': URL of an artifact (mvn generated or from the local map) -> resolved URL
+# 'repos': GitHub repo (ex. 'cdapio/cdap') -> resolved URL of its license
+# 'failures': URL that had no license -> {'reason', 'firstFailedAt', 'failedAt', 'count': <number of times it was tried and failed>}
+cache = {'licenses': {}, 'urls': {}, 'repos': {}, 'failures': {}}
+cacheLock = threading.Lock()
+cacheLoaded = False
+stats = {'fresh': 0, 'revalidated': 0, 'downloaded': 0, 'skipped': 0}  # How the licenses were found during this run
+
+
+def setCacheFilename(name):
+    global cacheFilename
+    cacheFilename=name
+
+def setFreshTTL(seconds):
+    global freshTTL
+    freshTTL=seconds
+
+def setFailureTTL(seconds):
+    global failureTTL
+    failureTTL=seconds
+
+def getCachePath():
+    """ Returns the filesystem path of the persisted cache """
+
+    return path.join(os.getcwd(), cacheFilename)
+
+def loadCache():
+    """ Loads the persisted cache from disk (once per run) """
+
+    global cacheLoaded
+    if cacheLoaded:
+        return
+    cacheLoaded = True
+    if not path.exists(getCachePath()):
+        return
+    try:
+        with open(getCachePath()) as cacheFile:
+            persisted = json.load(cacheFile)
+    except (ValueError, OSError):
+        print("WARN: Ignoring unreadable license cache '%s'" % getCachePath())
+        return
+    with cacheLock:
+        for section in cache:
+            cache[section].update(persisted.get(section, {}))
+
+def evict():
+    """ Drops the entries that were not used for maxAge and the least recently used entries above maxEntries """
+
+    now = time.time()
+    licenses = cache['licenses']
+    for resolvedURL in [u for u, entry in licenses.items() if now - entry['usedAt'] > maxAge]:
+        del licenses[resolvedURL]
+    if len(licenses) > maxEntries:
+        for resolvedURL in sorted(licenses, key=lambda u: licenses[u]['usedAt'])[:len(licenses) - maxEntries]:
+            del licenses[resolvedURL]
+    for section in ['urls', 'repos']:
+        cache[section] = {key: resolvedURL for key, resolvedURL in cache[section].items() if resolvedURL in licenses}
+    cache['failures'] = {url: failure for url, failure in cache['failures'].items() if now - failure['failedAt'] <= maxAge}
+
+def saveCache():
+    """ Evicts old entries and persists the cache to disk """
+
+    with cacheLock:
+        evict()
+        contents = json.dumps(cache, indent=1, sort_keys=True)
+        tmpPath = getCachePath() + ".tmp"
+        with open(tmpPath, 'w') as cacheFile:
+            cacheFile.write(contents)
+        os.replace(tmpPath, getCachePath())
+
+def lookup(url, repo=None):
+    """
+    Returns (resolvedURL, entry) for the license of an artifact URL, or (None, None) if it is not cached.
+    If the URL itself is not cached the license of the GitHub repo is used (if repo is given)
+    """
+
+    loadCache()
+    with cacheLock:
+        resolvedURL = cache['urls'].get(url)
+        if resolvedURL is None and repo is not None:
+            resolvedURL = cache['repos'].get(repo)
+        entry = cache['licenses'].get(resolvedURL)
+        if entry is None:
+            return None, None
+        return resolvedURL, dict(entry)
+
+def isFresh(entry):
+    return time.time() - entry['fetchedAt'] < freshTTL
+
+def getConditionalHeaders(entry):
+    """ Returns the headers for revalidating a cached license, a 304 response means it did not change """
+
+    headers = {}
+    if entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+    if entry.get('lastModified'):
+        headers['If-Modified-Since'] = entry['lastModified']
+    return headers
+
+def store(url, resolvedURL, kind, content, responseHeaders, repo=None):
+    """
+    Caches the license downloaded from resolvedURL for an artifact URL, kind is how the content was extracted from the response.
+    repo is given if this is the license of a whole GitHub repo, any URL of that repo can use it then
+    """
+
+    now = time.time()
+    with cacheLock:
+        stats['downloaded'] += 1
+        cache['licenses'][resolvedURL] = {'kind': kind, 'content': content, 'etag': responseHeaders.get('ETag'),
+                                          'lastModified': responseHeaders.get('Last-Modified'), 'fetchedAt': now, 'usedAt': now, 'repo': repo}
+        cache['urls'][url] = resolvedURL
+        if repo is not None:
+            cache['repos'][repo] = resolvedURL
+
+def touch(url, resolvedURL, revalidated=False):
+    """ Marks a cached license as used by an artifact URL, revalidated means the server confirmed it did not change """
+
+    now = time.time()
+    with cacheLock:
+        entry = cache['licenses'].get(resolvedURL)
+        if entry is None:
+            return
+        entry['usedAt'] = now
+        if revalidated:
+            entry['fetchedAt'] = now
+        stats['revalidated' if revalidated else 'fresh'] += 1
+        cache['urls'][url] = resolvedURL
+
+def remove(resolvedURL):
+    """ Drops a cached license that no longer exists """
+
+    with cacheLock:
+        cache['licenses'].pop(resolvedURL, None)
+
+def getFailure(url):
+    """ Returns the failure entry of a URL that had no license within the failure TTL, None if the URL should be tried """
+
+    loadCache()
+    with cacheLock:
+        failure = cache['failures'].get(url)
+        if failure is None or time.time() - failure['failedAt'] >= failureTTL:
+            return None
+        stats['skipped'] += 1
+        return dict(failure)
+
+def hasFailure(url):
+    """ Returns True if a URL had no license within the failure TTL, unlike getFailure it is not counted as skipped """
+
+    loadCache()
+    with cacheLock:
+        failure = cache['failures'].get(url)
+        return failure is not None and time.time() - failure['failedAt'] < failureTTL
+
+def recordFailure(url, reason):
+    """ Records that a URL had no license, it is skipped until the failure TTL passes """
+
+    now = time.time()
+    with cacheLock:
+        failure = cache['failures'].setdefault(url, {'firstFailedAt': now, 'count': 0})
+        failure.update({'reason': reason, 'failedAt': now, 'count': failure['count'] + 1})
+
+def clearFailure(url):
+    with cacheLock:
+        cache['failures'].pop(url, None)
+
+def describeFailure(url):
+    """ Returns a description of why a URL has no license for the summary files, None if it is not known to fail """
+
+    with cacheLock:
+        failure = cache['failures'].get(url)
+        if failure is None:
+            return None
+        return "%s: %s (no license since %s, tried %d times)" % (url, failure['reason'], time.strftime("%Y-%m-%d", time.localtime(failure['firstFailedAt'])),
+                                                              failure['count'])
@@ -1,12 +1,22 @@
-from subprocess import call
+from tracing import call
 from os import path
-import subprocess
 import os
-import glob
-import re
 import sys
 import argparse
+import json
+import difflib
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
 import git
+import gitExecutor
+import refIndex
+import prIndex
+import githubClient
+import githubRateLimit
+import pomVersions
+import policy
+import journal
+import tracing
 
 # Contants for controlling level of output and interaction with filesystem
 quiteMode = False
@@ -14,11 +24,10 @@ workspaceFolder = 'workspace_versions'  # Update the entry in the .gitignore if
 outputPRsFilename = "PRsToApprove.txt"
 reposFilename = "repos.txt"
 
-# Regex patterns needed for updating versions
-pomVersionSnapshotRegex = r"<version>([\d\.]*)-SNAPSHOT</version>"
-pomVersionRegex = r"<version>([\d\.]*)</version>"
-pomCDAPVersionRegex = r"<cdap.version>(.*)</cdap.version>"
-pomVersionSub = "<version>\\1</version>"
+# Polling settings used while waiting for submodule PRs to be merged (seconds)
+mergePollInterval = 30
+mergePollMaxInterval = 5*60
+mergeTimeout = 24*60*60
 
 # Init variables needed later on
 submoduleRepos = {}
@@ -45,11 +54,302 @@ def getUserResponse(prompt):
     return resp == 'y'
 
 
+def getRetryResponse(prompt):
+    """ Helper function to get a retry/skip response from the user, returns True for retry """
+
+    resp = input(prompt+'\n')
+    while resp.lower() not in ['r', 's']:
+        print("Invalid option.")
+        resp = input(prompt+'\n')
+    return resp.lower() == 'r'
+
+
 def getRepoPath(repo):
     """ Returns the filesystem path for the given repo """
 
     return path.join(os.getcwd(), workspaceFolder, git.repoNameToPath(repo))
 
+class Decision():
+    """ Class to hold a question about a repo that needs a human decision before the repo can be processed """
+
+    def __init__(self, repo, kind, prompt, rejectMessage=None, pomPlan=None, updates=None, proceedAnswer=True):
+        self.repo = repo
+        self.kind = kind  # One of the decision points defined in policy.py
+        self.prompt = prompt  # Yes/no question, any answer other than proceedAnswer skips the repo
+        self.rejectMessage = rejectMessage  # Printed when the repo is skipped
+        self.pomPlan = pomPlan  # The pom this decision is about (if any)
+        self.updates = updates  # Version updates to use for the pom if the answer is 'y'
+        self.proceedAnswer = proceedAnswer
+        self.answer = None
+
+
+class PomPlan():
+    """ Class to hold the planned version updates for a single pom file """
+
+    def __init__(self, pomFile, prettyPomFile, pom, fields, updates):
+        self.pomFile = pomFile
+        self.prettyPomFile = prettyPomFile
+        self.pom = pom
+        self.fields = fields
+        self.updates = updates
+        self.decision = None
+
+
+class RepoPlan():
+    """ Class to hold everything that was planned for a repo by scanRepo """
+
+    def __init__(self, repo, operation, releaseBranch, changeBranch):
+        self.repo = repo
+        self.operation = operation
+        self.releaseBranch = releaseBranch
+        self.changeBranch = changeBranch
+        self.pomPlans = []
+        self.decisions = []
+        self.firstValidVersion = None  # First non-SNAPSHOT version seen, used to tag the repo after bumping
+        self.changes = []
+        self.status = "pending"
+        self.resumed = False  # True if the changes were committed by an earlier run and only the remaining stages are left
+
+
+# Settings for each of the version operations
+operationSettings = {
+    'remove_snapshot': {
+        'header': "Removing SNAPSHOT for repo '%s' in branch '%s'",
+        'changeBranch': "release-remove-snapshot-%s",
+        'commitMessage': "Removed SNAPSHOT from pom files.",
+        'prTitle': "[RELEASE-%s] Remove SNAPSHOTs",
+        'prBody': "This is an automated PR to remove -SNAPSHOT from artifact versions to prepare for release.",
+    },
+    'bump_to_snapshot': {
+        'header': "Bumping versions in repo '%s' on branch '%s'",
+        'changeBranch': "release-bump-versions-%s",
+        'commitMessage': "Bumped versions to next SNAPSHOT.",
+        'prTitle': "[RELEASE-%s] Bump to SNAPSHOT",
+        'prBody': "This is an automated PR to bump artifact versions to SNAPSHOT after a release is completed.",
+    },
+}
+
+
+def askDecision(decision):
+    """
+    Answers a decision using the policy, or by asking the user if the policy does not cover it.
+    Prints the reject message if the answer skips the repo. Returns True if the repo can be processed
+    """
+
+    decision.answer = policy.decide(decision.kind, decision.prompt, getUserResponse)
+    if decision.answer != decision.proceedAnswer and decision.rejectMessage is not None:
+        print(decision.rejectMessage)
+    return decision.answer == decision.proceedAnswer
+
+
+def planRemoveSnapshot(repo, pomPlan):
+    """
+    Plans the updates to remove -SNAPSHOT from the project and parent versions of a pom file.
+    Returns a Decision if the pom is already at a non-SNAPSHOT version or depends on a SNAPSHOT version of CDAP
+    """
+
+    fields = pomPlan.fields
+    for field in [pomVersions.projectVersionField, pomVersions.parentVersionField]:
+        if field in fields and fields[field].value.endswith('-SNAPSHOT'):
+            pomPlan.updates[field] = fields[field].value[:-len('-SNAPSHOT')]
+
+    # If there is nothing to remove that means the version is already a non-SNAPSHOT version, ask the user if thats expected
+    if len(pomPlan.updates) == 0:
+        currentVersion = pomVersions.getVersion(fields)
+        if currentVersion is None:
+            print("WARN: POM file ('%s') does not define a version, skipping it" % pomPlan.prettyPomFile)
+            return None
+        return Decision(repo, policy.nonSnapshotPomDecision,
+                        "POM file ('%s') is already set to a non-SNAPSHOT version (%s), is this expected? (Y/n)" % (pomPlan.prettyPomFile, currentVersion),
+                        "This script expects all repos to be in the SNAPSHOT stage. All changes to this repo (%s) will be reverted and it will be skipped." % repo,
+                        pomPlan, {})
+
+    # Check if the CDAP dependancy is a SNAPSHOT version, we do not allow a release with a SNAPSHOT dependancy
+    if pomVersions.cdapVersionField in fields:
+        cdapVersion = fields[pomVersions.cdapVersionField].value
+        if cdapVersion.endswith("-SNAPSHOT"):
+            updates = dict(pomPlan.updates)
+            updates[pomVersions.cdapVersionField] = cdapVersion[:-len('-SNAPSHOT')]
+            return Decision(repo, policy.snapshotCDAPDecision,
+                            "POM file ('%s') depends on a SNAPSHOT version of CDAP(%s). This is not allowed.\n" % (pomPlan.prettyPomFile, cdapVersion)
+                            + "Would you like to remove the SNAPSHOT from the CDAP version dependancy? "
+                            + "If you are unsure please consult the team, you can skip this repo for now by responding with 'N'. (Y/n)",
+                            None, pomPlan, updates)
+    return None
+
+
+def planBumpToSnapshot(repo, pomPlan):
+    """
+    Plans the updates to bump the version of a pom file to the next SNAPSHOT (ex. 6.1.4 -> 6.1.5-SNAPSHOT).
+    Every version field that is set to the current version is bumped. Returns a Decision if the pom is already at a SNAPSHOT version
+    """
+
+    currentVersion = pomVersions.getVersion(pomPlan.fields)
+    if currentVersion is None:
+        print("WARN: POM file ('%s') does not define a version, skipping it" % pomPlan.prettyPomFile)
+        return None
+
+    # Check if the version is already a SNAPSHOT version, that is not expected
+    if '-SNAPSHOT' in currentVersion:
+        return Decision(repo, policy.snapshotPomDecision,
+                        "POM file ('%s') is already set to a SNAPSHOT version (%s), is this expected? (Y/n)" % (pomPlan.prettyPomFile, currentVersion),
+                        "This script expects all repos to be in a non-SNAPSHOT stage. All changes to this repo (%s) will be reverted and it will be skipped." % repo,
+                        pomPlan, {})
+
+    newVersion = pomVersions.nextSnapshotVersion(currentVersion)
+    for field in [pomVersions.projectVersionField, pomVersions.parentVersionField]:
+        if field in pomPlan.fields and pomPlan.fields[field].value == currentVersion:
+            pomPlan.updates[field] = newVersion
+    return None
+
+
+def scanRepo(plan, decide=None):
+    """
+    Reads every pom file tracked in the repo and plans the version updates for it, nothing is written.
+    Decisions are passed to the decide function as soon as they come up, if it answers no the scan stops and None is returned.
+    If no decide function is given all decisions are collected in the plan so they can be answered later on
+    """
+
+    planPom = planRemoveSnapshot if plan.operation == 'remove_snapshot' else planBumpToSnapshot
+    for pomFile in git.getTrackedFiles(plan.repo, "pom.xml"):
+        pom, fields = pomVersions.readPom(pomFile)
+        pomPlan = PomPlan(pomFile, pomFile.replace(os.getcwd(), ''), pom, fields, {})
+        pomPlan.decision = planPom(plan.repo, pomPlan)
+        plan.pomPlans.append(pomPlan)
+
+        if pomPlan.decision is not None:
+            if decide is None:
+                plan.decisions.append(pomPlan.decision)
+            elif not decide(pomPlan.decision):
+                return None
+
+        # Keep track of the first valid version we see for tagging step later on
+        if plan.firstValidVersion is None and pomPlan.decision is None and len(pomPlan.updates) > 0:
+            plan.firstValidVersion = pomVersions.getVersion(fields)
+    return plan
+
+
+def applyPlan(plan):
+    """ Writes the planned version updates to the pom files, returns the list of changes that were made """
+
+    for pomPlan in plan.pomPlans:
+        updates = pomPlan.updates
+        if pomPlan.decision is not None:
+            updates = pomPlan.decision.updates
+        plan.changes += pomVersions.writeUpdates(pomPlan.pomFile, pomPlan.pom, pomPlan.fields, updates, pomPlan.prettyPomFile)
+    return plan.changes
+
+
+def finishRepo(plan, version):
+    """
+    Commits the changes of a plan and creates the PR. After bumping versions the release branch is also tagged.
+    Every stage is recorded in the journal, stages that were already completed by an earlier run are skipped
+    """
+
+    repo = plan.repo
+    settings = operationSettings[plan.operation]
+
+    if not journal.isDone(repo, journal.committedStage):
+        # If no changes were made to this repo then delete the branch and return
+        if len(plan.changes) == 0:
+            print("No changes were made to repo '%s'...deleting local branch and continuing. No PR will be generated for this repo." % repo)
+            git.checkoutBranch(repo, plan.releaseBranch)
+            git.deleteBranch(repo, plan.changeBranch)
+            plan.status = "no changes"
+            journal.record(repo, journal.doneStage, plan.status)
+            return plan
+
+        print("Updated %d versions in %d POM files in repo '%s'" % (len(plan.changes), len(set(c.pomFile for c in plan.changes)), repo))
+        journal.record(repo, journal.rewrittenStage, {'changes': len(plan.changes), 'firstValidVersion': plan.firstValidVersion})
+        git.addAndCommit(repo, "-A", settings['commitMessage'])
+        journal.record(repo, journal.committedStage, git.getLocalSha(repo))
+
+    # Create PR
+    if not journal.isDone(repo, journal.pushedStage):
+        journal.record(repo, journal.pushedStage, git.pushBranch(repo, plan.changeBranch))
+    if not journal.isDone(repo, journal.prStage):
+        journal.record(repo, journal.prStage, git.createPR(repo, settings['prTitle'] % version, settings['prBody'], plan.changeBranch, plan.releaseBranch))
+    plan.status = "PR created"
+
+    #Tag the release branch in the repo with the current version
+    if plan.operation == 'bump_to_snapshot' and plan.firstValidVersion is not None and not journal.isDone(repo, journal.taggedStage):
+        git.checkoutBranch(repo, plan.releaseBranch)
+        git.tagRepo(repo, 'v'+plan.firstValidVersion)
+        journal.record(repo, journal.taggedStage, 'v'+plan.firstValidVersion)
+    journal.record(repo, journal.doneStage, plan.status)
+    return plan
+
+
+def resumePlan(repo, version, operation):
+    """
+    Returns a plan to finish a repo whose changes were already committed by an earlier run that stopped partway,
+    or None if the repo has to be processed from the start. The local change branch has to still be at the journaled commit
+    """
+
+    commitSha = journal.getStage(repo, journal.committedStage)
+    if commitSha is None:
+        return None
+    releaseBranch = git.getReleaseBranch(repo, version)
+    changeBranch = operationSettings[operation]['changeBranch'] % version.replace('.', '')
+    localSha = git.getLocalBranchSha(repo, changeBranch)
+    if localSha is None and not journal.isDone(repo, journal.pushedStage):
+        journal.resetRepo(repo)  # The commit was never pushed and is gone, nothing to resume from
+        return None
+    if localSha is not None and localSha != commitSha:
+        print("WARN: Branch '%s' in repo '%s' changed since the last run, processing the repo from the start" % (changeBranch, repo))
+        journal.resetRepo(repo)
+        return None
+
+    print("Resuming repo '%s' after stage '%s'" % (repo, journal.getLastStage(repo)))
+    plan = RepoPlan(repo, operation, releaseBranch, changeBranch)
+    plan.firstValidVersion = (journal.getStage(repo, journal.rewrittenStage) or {}).get('firstValidVersion')
+    return plan
+
+
+def isRepoDone(repo):
+    """ Returns True (and says so) if a repo was already finished by an earlier attempt of this run """
+
+    if not journal.isDone(repo, journal.doneStage):
+        return False
+    print("Skipping repo '%s', it was already finished in an earlier run (%s)" % (repo, journal.getStage(repo, journal.doneStage)))
+    return True
+
+
+def processRepo(repo, version, operation):
+    """ Runs a version operation on a single repo, asking the user about every decision as soon as it comes up """
+
+    if isRepoDone(repo):
+        return
+    git.cloneRepo(repo)
+    plan = resumePlan(repo, version, operation)
+    if plan is not None:
+        finishRepo(plan, version)
+        return
+
+    transaction = git.RepoTransaction(repo)
+    releaseBranch = git.getReleaseBranch(repo, version)
+    changeBranch = operationSettings[operation]['changeBranch'] % version.replace('.', '')
+    printHeader(operationSettings[operation]['header'] % (repo, releaseBranch))
+
+    try:
+        # Checkout to correct branches
+        git.checkoutBranch(repo, releaseBranch)
+        git.checkoutBranch(repo, changeBranch, createBranch=True)
+
+        plan = scanRepo(RepoPlan(repo, operation, releaseBranch, changeBranch), askDecision)
+        if plan is None:
+            # The user did not accept one of the decisions, we cannot recover so roll back all changes so far
+            transaction.rollback()
+            return
+        applyPlan(plan)
+        finishRepo(plan, version)
+    except git.SkipRepo:
+        transaction.rollback(failed=False)  # Only removes the local branches, the repo is skipped on purpose
+    except Exception:
+        transaction.rollback()
+        raise
+
+
 def removeSnapshot(repo, version):
     """
     Removes -SNAPSHOT from all pom.xml files in a given repo in the given release branch.
@@ -63,81 +363,8 @@ def removeSnapshot(repo, version):
         7. Add a link to the PR in the outputPRsFilename file
     """
 
-    git.cloneRepo(repo)
-    releaseBranch = ""
-    if repo in releaseBranchMap:
-        releaseBranch = releaseBranchMap[repo]
-    else:
-        versionParts = version.split(".")
-        releaseBranch = "release/%s.%s" % (versionParts[0], versionParts[1])
-    
-    message="Removing SNAPSHOT for repo '%s' in branch '%s'" % (repo, releaseBranch)
-    printHeader(message)
-
-    # Checkout to correct branches
-    git.checkoutBranch(repo, releaseBranch)
-    changeBranch = "release-remove-snapshot-%s" % version.replace('.', '')
-    git.checkoutBranch(repo, changeBranch, createBranch=True)
-
-    # Get all pom files
-    pomFilePaths = glob.glob("/%s/**/pom.xml" % getRepoPath(repo), recursive=True)
-    totalChanges = 0
-    for pomFile in pomFilePaths:
-        pom = ""
-        prettyPomFile = pomFile.replace(os.getcwd(), '')
-        with open(pomFile) as pf:
-            pom = pf.read()
-
-        # Replace remove -SNAPSHOT from version field
-        beforeLength = len(pom)
-        pom = re.sub(pomVersionSnapshotRegex, pomVersionSub, pom, 1, re.MULTILINE)
-        afterLength = len(pom)
-
-        # Check if the pom file was changed
-        totalChanges += afterLength-beforeLength
-        if beforeLength == afterLength:
-            # If the pom file was not changed that means the version is already a non-SNAPSHOT version, ask the user if thats expected
-            currentVersion = re.search(pomVersionRegex, pom, re.MULTILINE).groups()[0]
-            skipPom = getUserResponse(
-                "POM file ('%s') is already set to a non-SNAPSHOT version (%s), is this expected? (Y/n)" % (prettyPomFile, currentVersion))
-            if skipPom:
-                continue
+    processRepo(repo, version, 'remove_snapshot')
 
-            # If the user does not skip this pom file then we cannot recover, we need to quit and delete the repo to undo all changes so far
-            print("This script expects all repos to be in the SNAPSHOT stage. All changes to this repo (%s) will be reverted and it will be skipped." % repo)
-            git.deleteLocalRepo(repo)
-            return
-
-        # Check if the CDAP dependancy is a SNAPSHOT version
-        cdapVersionMatch = re.search(pomCDAPVersionRegex, pom, re.MULTILINE)
-        if cdapVersionMatch:
-            cdapVersion = cdapVersionMatch.groups()[0]
-            if cdapVersion.endswith("-SNAPSHOT"):
-                print("POM file ('%s') depends on a SNAPSHOT version of CDAP(%s). This is not allowed." % (prettyPomFile, cdapVersion))
-                autoUpdate = getUserResponse("Would you like to remove the SNAPSHOT from the CDAP version dependancy? "
-                                            + "If you are unsure please consult the team, you can skip this repo for now by responding with 'N'. (Y/n)")
-
-                # If the user does not want to update this dependacy then we need to skip this repo, we do not allow a release with a SNAPSHOT dependancy
-                if not autoUpdate:
-                    git.deleteLocalRepo(repo)
-                    return
-                newCdapVersion = '<version>%s</version>' % cdapVersion.replace("-SNAPSHOT", '')
-                pom = re.sub(pomCDAPVersionRegex, newCdapVersion, pom, 1, re.MULTILINE)
-
-        with open(pomFile, 'w') as pf:
-            pf.write(pom)
-
-    # If no changes were made to this repo then delete the branch and return
-    if totalChanges == 0:
-        print("No changes were made to repo '%s'...deleting local branch and continuing. No PR will be generated for this repo." % repo)
-        git.checkoutBranch(releaseBranch)
-        git.deleteBranch(changeBranch)
-        return
-
-    # Create PR
-    git.addAndCommit(repo, "-A", "Removed SNAPSHOT from pom files.")
-    git.pushAndCreatePR(repo, "[RELEASE-%s] Remove SNAPSHOTs" % version,
-                    "This is an automated PR to remove -SNAPSHOT from artifact versions to prepare for release.", changeBranch, releaseBranch)
 
 def printHeader(message):
     print('\n'+'='*len(message))
@@ -157,158 +384,370 @@ def bumpVersionToSnapshot(repo, version):
         6. Commit changes and create a PR
         7. Add a link to the PR in the outputPRsFilename file
     """
-    
-    git.cloneRepo(repo)
-    releaseBranch = ""
-    if repo in releaseBranchMap:
-        releaseBranch = releaseBranchMap[repo]
-    else:
-        versionParts = version.split(".")
-        releaseBranch = "release/%s.%s" % (versionParts[0], versionParts[1])
-
-    message="Bumping versions in repo '%s' on branch '%s'"%(repo, releaseBranch)
-    printHeader(message)
 
-    # Checkout branches
+    processRepo(repo, version, 'bump_to_snapshot')
+
+
+def scanRepoStage(repo, version, operation):
+    """
+    First stage of the pipeline: checks out the release branch and plans the updates for a repo without asking anything.
+    An open PR for the change branch is turned into the same existing_pr decision checkoutBranch asks about in sequential mode,
+    a change branch without an open PR is deleted and recreated without asking
+    """
+
+    releaseBranch = git.getReleaseBranch(repo, version)
+    changeBranch = operationSettings[operation]['changeBranch'] % version.replace('.', '')
+    git.cloneRepo(repo)
+    plan = resumePlan(repo, version, operation)
+    if plan is not None:
+        plan.resumed = True
+        return plan
+    plan = RepoPlan(repo, operation, releaseBranch, changeBranch)
     git.checkoutBranch(repo, releaseBranch)
-    changeBranch = "release-bump-versions-%s" % version.replace('.', '')
-    git.checkoutBranch(repo, changeBranch, createBranch=True)
-
-    changesMade = False
-    firstValidVersion = None
-    pomFilePaths = glob.glob("/%s/**/pom.xml" % getRepoPath(repo), recursive=True)
-    for pomFile in pomFilePaths:
-        pom = ""
-        with open(pomFile) as pf:
-            pom = pf.read()
-
-        # Get current version
-        currentVersion = re.search(pomVersionRegex, pom, re.MULTILINE).groups()[0]
-
-        # Check if the version is already a SNAPSHOT version, that is not expected
-        if '-SNAPSHOT' in currentVersion:
-            # Give the user the option to skip this POM file if they expected this
-            prettyPomFile = pomFile.replace(os.getcwd(), '')
-            skipPom = getUserResponse(
-                "POM file ('%s') is already set to a SNAPSHOT version (%s), is this expected? (Y/n)" % (prettyPomFile, currentVersion))
-            if skipPom:
+
+    if refIndex.branchExists(repo, changeBranch) and git.hasOpenPR(repo, changeBranch):
+        _, url = git.findPR(repo, changeBranch)
+        plan.decisions.append(Decision(repo, policy.existingPRDecision,
+                                       "A PR for branch '%s' in repo '%s' has already been created (maybe this script was already run for this release?): %s\n" % (changeBranch, repo, url)
+                                       + "Does the PR contain the correct changes? Responding with 'Y' keeps the PR and skips this repo, 'N' closes it and recreates the branch. (Y/n)",
+                                       "Skipping re-processing repo '%s' since correct PR already exists" % repo, proceedAnswer=False))
+    return scanRepo(plan)
+
+
+def finishRepoStage(plan, version):
+    """ Last stage of the pipeline: creates the change branch, writes the poms, commits, pushes and creates the PR """
+
+    repo = plan.repo
+    if plan.resumed:
+        return finishRepo(plan, version)
+    transaction = git.RepoTransaction(repo)
+    try:
+        return finishRepoInPipeline(plan, version)
+    except Exception:
+        transaction.rollback()
+        raise
+
+
+def finishRepoInPipeline(plan, version):
+    """ Helper function for finishRepoStage that does the actual work """
+
+    repo = plan.repo
+    if refIndex.branchExists(repo, plan.changeBranch):
+        if any(decision.kind == policy.existingPRDecision for decision in plan.decisions):
+            git.closePR(repo, plan.changeBranch)
+        if git.deleteBranch(repo, plan.changeBranch, deleteInRemote=True) != 0:
+            raise RuntimeError("failed to delete branch '%s'" % plan.changeBranch)
+
+    # The branch does not exist in remote so any local branch is left over from an earlier run
+    git.checkoutBranch(repo, plan.releaseBranch)
+    if git.localBranchExists(repo, plan.changeBranch):
+        git.deleteBranch(repo, plan.changeBranch)
+    git.checkoutBranch(repo, plan.changeBranch, createBranch=True)
+    applyPlan(plan)
+    return finishRepo(plan, version)
+
+
+def runPipeline(version, operation):
+    """
+    Runs a version operation for all repos concurrently. Every repo is scanned first, repos that do not need any
+    decisions are finished right away while the others wait. Once all repos have been scanned the decisions are
+    presented together and the remaining repos are finished in the background.
+    """
+
+    printHeader("Running %s for %d repos" % (operation, len(repos)))
+    plans = {}
+    waitingPlans = []
+    finishFutures = {}
+    with ThreadPoolExecutor(max_workers=git.syncWorkers) as executor:
+        scanFutures = {executor.submit(scanRepoStage, repo, version, operation): repo for repo in repos if not isRepoDone(repo)}
+        for future in as_completed(scanFutures):
+            repo = scanFutures[future]
+            try:
+                plans[repo] = future.result()
+            except Exception as e:
+                print("ERROR: Failed to scan repo '%s': %s" % (repo, e))
                 continue
+            if len(plans[repo].decisions) == 0:
+                finishFutures[executor.submit(finishRepoStage, plans[repo], version)] = repo
+            else:
+                waitingPlans.append(plans[repo])
+
+        # Present all decisions together, repos without decisions keep being processed in the meantime.
+        # Decisions the policy answers are not counted since nobody is asked about them
+        questions = [decision for p in waitingPlans for decision in p.decisions if policy.needsInput(decision.kind)]
+        if len(questions) > 0:
+            printHeader("%d decisions are needed for %d repos" % (len(questions), len(set(decision.repo for decision in questions))))
+        for plan in sorted(waitingPlans, key=lambda p: repos.index(p.repo)):
+            print("\nRepo '%s':" % plan.repo)
+            if all(askDecision(decision) for decision in plan.decisions):
+                finishFutures[executor.submit(finishRepoStage, plan, version)] = plan.repo
+            else:
+                plan.status = "skipped"
+
+        for future in as_completed(finishFutures):
+            repo = finishFutures[future]
+            try:
+                future.result()
+            except Exception as e:
+                print("ERROR: Failed to finish repo '%s': %s" % (repo, e))
+                plans[repo].status = "failed"
 
-            # If the user chooses not to skip then we need to delete changes to this repo and skip it
-            print("This script expects all repos to be in a non-SNAPSHOT stage. All changes to this repo (%s) will be reverted and it will be skipped." % repo)
-            git.deleteLocalRepo(repo)
-            return
+    printHeader("Summary")
+    for repo in repos:
+        if repo not in plans and journal.isDone(repo, journal.doneStage):
+            print("%-50s %s" % (repo, journal.getStage(repo, journal.doneStage)))
+            continue
+        print("%-50s %s" % (repo, plans[repo].status if repo in plans else "failed"))
 
-        #Keep track of the first valid version we see for tagging step later on
-        if firstValidVersion is None:
-            firstValidVersion = currentVersion
-
-        # Calculate new version and replace it
-        currentVersionParts = currentVersion.split(".")
-        currentVersionParts[-1] = str(int(currentVersionParts[-1])+1)
-        newVersion = '<version>%s-SNAPSHOT</version>' % '.'.join(currentVersionParts)
-        pom = re.sub(pomVersionRegex, newVersion, pom, 1, re.MULTILINE)
-        changesMade = True
-        with open(pomFile, 'w') as pf:
-            pf.write(pom)
-
-     # If no changes were made to this repo then delete the branch and return
-    if not changesMade:
-        print("No changes were made to repo '%s'...deleting local branch and continuing. No PR will be generated for this repo." % repo)
-        git.checkoutBranch(releaseBranch)
-        git.deleteBranch(changeBranch)
-        return
 
-    # Create PR
-    git.addAndCommit(repo, "-A", "Bumped versions to next SNAPSHOT.")
-    git.pushAndCreatePR(repo, "[RELEASE-%s] Bump to SNAPSHOT" % version,
-                    "This is an automated PR to bump artifact versions to SNAPSHOT after a release is completed.", changeBranch, releaseBranch)
+def planRepoFromObjects(repo, version, operation):
+    """
+    Plans a version operation for a repo straight from the objects of its release branch, nothing is checked out,
+    created or pushed. All pom files are read with a single batch read. Returns a (planJson, diffLines) tuple
+    """
 
-    #Tag the release branch in the repo with the current version
+    releaseBranch = git.getReleaseBranch(repo, version)
+    repoJson = {'branch': releaseBranch, 'sha': None, 'changes': [], 'decisions': []}
+    gitDir, sha = git.fetchBranchObjects(repo, releaseBranch)
+    if sha is None:
+        repoJson['error'] = "branch '%s' does not exist" % releaseBranch
+        return repoJson, []
+    repoJson['sha'] = sha
+
+    planPom = planRemoveSnapshot if operation == 'remove_snapshot' else planBumpToSnapshot
+    pomFiles = git.listFilesAtCommit(gitDir, sha, "pom.xml")
+    poms = git.readFilesAtCommit(gitDir, sha, pomFiles)
+    diffLines = []
+    for pomFile in pomFiles:
+        pom = poms[pomFile]
+        fields = pomVersions.scanPom(pom)
+        pomPlan = PomPlan(pomFile, "%s/%s" % (git.repoNameToPath(repo), pomFile), pom, fields, {})
+        decision = planPom(repo, pomPlan)
+        updates = pomPlan.updates
+        if decision is not None:
+            repoJson['decisions'].append({'pom': pomFile, 'kind': decision.kind, 'question': decision.prompt.split('\n')[0]})
+            updates = decision.updates  # Show what would change if the decision is accepted
+
+        newPom, changed = pomVersions.applyUpdates(pom, fields, updates)
+        for field, oldVersion, newVersion in changed:
+            repoJson['changes'].append({'pom': pomFile, 'field': field, 'from': oldVersion, 'to': newVersion})
+        if len(changed) > 0:
+            diffLines += difflib.unified_diff(pom.splitlines(True), newPom.splitlines(True),
+                                              'a/%s/%s' % (repo, pomFile), 'b/%s/%s' % (repo, pomFile))
+    return repoJson, diffLines
+
+
+def generatePlan(version, operation, outputPath):
+    """
+    Computes which pom files would change for every repo if the given operation was run, without touching any branches.
+    The plan is written as JSON to '<outputPath>.json' and as a unified diff to '<outputPath>.diff'
+    """
+
+    printHeader("Planning %s for %d repos" % (operation, len(repos)))
+    plan = {'version': version, 'operation': operation, 'repos': {}}
+    diffs = {}
+    with ThreadPoolExecutor(max_workers=git.syncWorkers) as executor:
+        futures = {executor.submit(planRepoFromObjects, repo, version, operation): repo for repo in repos}
+        for future in as_completed(futures):
+            repo = futures[future]
+            try:
+                plan['repos'][repo], diffs[repo] = future.result()
+            except Exception as e:
+                plan['repos'][repo], diffs[repo] = {'error': str(e)}, []
+
+    with open(outputPath + '.json', 'w') as planFile:
+        json.dump(plan, planFile, indent=2, sort_keys=True)
+    with open(outputPath + '.diff', 'w') as diffFile:
+        for repo in repos:
+            diffFile.writelines(diffs[repo])
+
+    for repo in repos:
+        repoJson = plan['repos'][repo]
+        if 'error' in repoJson:
+            print("%-50s ERROR: %s" % (repo, repoJson['error']))
+            continue
+        print("%-50s %d changes in %d POM files, %d decisions needed" % (repo, len(repoJson['changes']),
+              len(set(c['pom'] for c in repoJson['changes'])), len(repoJson['decisions'])))
+        for decision in repoJson['decisions']:
+            print("    %s: %s" % (decision['kind'], decision['question']))
+    print("Plan written to %s.json and %s.diff" % (outputPath, outputPath))
+
+
+def waitForMerge(repo, branch):
+    """
+    Polls the state of the PR for a given branch until it is merged, closed or the merge timeout is reached.
+    The polling interval starts at mergePollInterval and doubles up to mergePollMaxInterval. If the state cannot be read
+    (ex. a network error or a PR the API does not list yet) polling goes on. Returns the final status of the repo
+    """
+
+    print("Waiting for the PR for branch '%s' in repo '%s' to be reviewed and merged..." % (branch, repo))
+    delay = mergePollInterval
+    deadline = time.time() + mergeTimeout
+    while True:
+        state = git.getPRState(repo, branch)
+        if state == 'MERGED':
+            print("PR for branch '%s' in repo '%s' was merged" % (branch, repo))
+            refIndex.buildIndex([repo], refresh=True)  # The release branch moved, later checkouts have to fetch it
+            return 'merged'
+        if state == 'CLOSED':
+            print("WARN: PR for branch '%s' in repo '%s' was closed without merging, repos that depend on it will not be updated" % (branch, repo))
+            return 'failed'
+        if state is None:
+            print("WARN: Could not get the state of the PR for branch '%s' in repo '%s', checking again later" % (branch, repo))
+        if time.time() + delay > deadline:
+            print("WARN: Timed out waiting for the PR for branch '%s' in repo '%s' to be merged" % (branch, repo))
+            return 'timed out'
+        time.sleep(delay)
+        delay = min(delay*2, mergePollMaxInterval)
+
+
+def updateRepoSubmodules(repo, version):
+    """ Updates the submodules in a single repo, creates a PR for them and waits for it to be merged. Returns the final status of the repo """
+
+    releaseBranch = git.getReleaseBranch(repo, version)
+    printHeader("Updating submodules in %s"%repo)
+    changeBranch = 'release-update-submodules-%s' % version.replace('.', '')
+    if journal.isDone(repo, journal.doneStage):
+        print("Submodules in repo '%s' were already updated in an earlier run (%s)" % (repo, journal.getStage(repo, journal.doneStage)))
+        return journal.getStage(repo, journal.doneStage)
+    if journal.isDone(repo, journal.prStage):
+        print("Resuming repo '%s', the PR was created in an earlier run: %s" % (repo, journal.getStage(repo, journal.prStage)))
+        return recordSubmoduleStatus(repo, waitForMerge(repo, changeBranch))
+
+    print("Setting up for submodule update in repo '%s'" % repo)
+    git.cloneRepo(repo)
+    git.ensureFullCheckout(repo)
     git.checkoutBranch(repo, releaseBranch)
-    git.tagRepo(repo, 'v'+firstValidVersion)
-        
 
-def updateSubmodules(version):
-    """ This function updates submodules in hydrator-plugins and cdap-build and creates PR for them """
+    # Try to create the branch for changes
+    try:
+        git.checkoutBranch(repo, changeBranch, createBranch=True)
+    except policy.PolicyError:
+        raise
+    except RuntimeError as e:  # This means there was some unrecoverable error
+        sys.stderr.write("ERROR: Branch creation failed, cannot update submodules in repo '%s'\n" % repo)
+        return 'failed'
+    except git.SkipRepo:  # There is already a PR and it has the correct changes
+        return recordSubmoduleStatus(repo, waitForMerge(repo, changeBranch))
+
+    # Run the update and confirm that at least one submodule was updated
+    result = updateModulesAndCheck(repo)
+    if result == 'updated':
+        print("Creating PR...")
+        git.commitStaged(repo, "Updated submodules for release")
+        url = git.pushAndCreatePR(repo, "[RELEASE-%s] Update submodules" % version,
+                              "This is an automated PR to update submodules in preperation for release.", changeBranch, releaseBranch, outputURLToFile=False)
+        journal.record(repo, journal.prStage, url)
+        print("PR for updating submodules in %s: %s" % (repo, url))
+        return recordSubmoduleStatus(repo, waitForMerge(repo, changeBranch))
+
+    # If no changes were made then no need to create a PR, just go back to the release branch to undo changes
+    git.checkoutBranch(repo, releaseBranch)
+    git.deleteBranch(repo, changeBranch)
+    return recordSubmoduleStatus(repo, result)
 
-    submoduleRepos = ['cdapio/hydrator-plugins','cdapio/cdap','cdapio/cdap-build']
-    for repo in submoduleRepos:
 
-        # Construct release branch name and checkout the branches
-        releaseBranch = ""
-        if repo in releaseBranchMap:
-            releaseBranch = releaseBranchMap[repo]
-        else:
-            versionParts = version.split(".")
-            releaseBranch = "release/%s.%s" % (versionParts[0], versionParts[1])
+def recordSubmoduleStatus(repo, status):
+    """ Records a final submodule update status in the journal so a rerun skips the repo, returns the status """
 
-        printHeader("Updating submodules in %s"%repo)
-        print("Setting up for submodule update in repo '%s'" % repo)
-        git.cloneRepo(repo)
-        git.checkoutBranch(repo, releaseBranch)
-        changeBranch = 'release-update-submodules-%s' % version.replace('.', '')
+    if status in ['merged', 'no changes']:
+        journal.record(repo, journal.doneStage, status)
+    return status
 
-        # Try to create the branch for changes
-        try:
-            git.checkoutBranch(repo, changeBranch, createBranch=True)
-        except RuntimeError as e:  # This means there was some unrecoverable error
-            sys.stderr.write("ERROR: Branch creation failed, cannot update submodules")
-            return
-        except Exception as e:  # This means there is already a PR and it has the correct changes
-            input("Press Enter once the PR is reviewed and merged...")
-            continue
 
-        # Run the update and confirm that at least one submodule was updated
-        if updateModulesAndCheck(repo):
-            print("Creating PR...")
-            git.addAndCommit(repo, '-A', "Updated submodules for release")
-            url = git.pushAndCreatePR(repo, "[RELEASE-%s] Update submodules" % version,
-                                  "This is an automated PR to update submodules in preperation for release.", changeBranch, releaseBranch, outputURLToFile=False)
-            print("PR for updating submodules in %s: %s" % (repo, url))
-            input("Press Enter once the PR is reviewed and merged...")
-        else:
-            git.deleteLocalRepo(changeBranch)  # If no changes were made then no need to create a PR, just delete the repo to undo changes
+def updateSubmodules(version, restart=False):
+    """
+    This function updates submodules in every repo that has submodules (ex. hydrator-plugins, cdap and cdap-build) and creates PRs for them.
+    The repos are processed in dependency order using the submoduleRepos map from git.mapBranchVersions: a repo is only updated once
+    the PRs of all of its submodules that have submodules themselves are merged. Repos that do not depend on each other are updated concurrently.
+    """
 
+    journal.startRun("update_submodules %s" % version, restart)
+
+    # Map each repo with submodules to the submodules it has to wait for
+    dependencies = {repo: [m for m in modules if m in submoduleRepos] for repo, modules in submoduleRepos.items()}
+    statuses = {}
+    running = {}
+    with ThreadPoolExecutor(max_workers=git.syncWorkers) as executor:
+        while len(statuses) + len(running) < len(dependencies):
+            started = set(statuses) | set(running.values())
+            for repo in dependencies:
+                if repo in started or not all(m in statuses for m in dependencies[repo]):
+                    continue
+                blockedBy = [m for m in dependencies[repo] if statuses[m] not in ['merged', 'no changes']]
+                if len(blockedBy) > 0:
+                    print("WARN: Not updating submodules in repo '%s' since these submodules were not updated: %s" % (repo, ', '.join(blockedBy)))
+                    statuses[repo] = 'blocked'
+                else:
+                    running[executor.submit(updateRepoSubmodules, repo, version)] = repo
+
+            if len(running) == 0:
+                if len(statuses) < len(dependencies):
+                    sys.stderr.write("ERROR: Submodules contain a cycle, cannot update: %s\n" % ', '.join(r for r in dependencies if r not in statuses))
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                repo = running.pop(future)
+                try:
+                    statuses[repo] = future.result()
+                except policy.PolicyError:
+                    raise
+                except Exception as e:
+                    print("ERROR: Failed to update submodules in repo '%s': %s" % (repo, e))
+                    statuses[repo] = 'failed'
+
+    printHeader("Submodule update summary")
+    for repo in dependencies:
+        statuses.setdefault(repo, 'not started')
+        print("%-50s %s" % (repo, statuses[repo]))
+    return statuses
 
-def updateModulesAndCheck(repo):
-    """ Helper function to perform submodule update and check that the update was successful """
 
-    # Update modules
+def updateModulesAndCheck(repo):
+    """
+    Helper function to perform submodule update and check that the update was successful.
+    The commits recorded for the submodules are compared with the remote tips of the branches they track, and the
+    submodules that moved are pointed at the new tips in the index. Submodules are never checked out or fetched in full.
+    Returns 'updated' if submodules were staged, 'no changes' if every submodule is up to date, 'skipped' if the repo was
+    skipped while the tip of a submodule branch is unknown and 'failed' if the submodules could not be staged
+    """
 
     message="Attempting to update submodules in repo '%s'" % repo
     printHeader(message)
 
-    repoPath = getRepoPath(repo)
-    commands = []
-    commands.append('cd "%s"' % repoPath)
-    commands.append('git submodule update')  # This resets the submodules if there are some modifications from a previous attempt
-    commands.append('git submodule update --init --recursive --remote')
-    call(" && ".join(commands), shell=True)
-
-    # Check git status to make sure at least one module was updated
-    commands.clear()
-    commands.append('cd "%s"' % repoPath)
-    commands.append("git status")
-    statusText = subprocess.check_output(" && ".join(commands), shell=True).decode('utf-8')
+    submodules = git.getSubmoduleDrift(repo)
+    movedModules = {}
+    for module in submodules:
+        if module['branch'] is None or module['remoteSha'] is None:
+            print("WARN: %s (%s): branch '%s' not found, skipping it" % (module['path'], module['repo'], module['branch']))
+        elif module['remoteSha'] == module['sha']:
+            print("%s (%s @ %s): up to date" % (module['path'], module['repo'], module['branch']))
+        else:
+            behind = "unknown number of" if module['behind'] is None else module['behind']
+            print("%s (%s @ %s): behind by %s commits (%s -> %s)" % (module['path'], module['repo'], module['branch'], behind,
+                                                                      (module['sha'] or 'none')[:8], module['remoteSha'][:8]))
+            movedModules[module['path']] = module['remoteSha']
 
     # If there were no submodules updated
-    if 'nothing to commit, working tree clean' in statusText:
+    if len(movedModules) == 0:
         # If nothing was updated give the user the option to retry this operation (incase they forgot to merge the PRs for the submodules)
         print('No submodule changes were detected. If this is not expected then please ensure all PRs for submodules were merged. This repo depends on the following submodules: \n%s' %
-              '\n'.join(submoduleRepos[repo]))
+              '\n'.join(submoduleRepos.get(repo, [])))
         prompt = "Would you like to (r)etry updating the submodules or (s)kip this repo? (R/s)"
-        resp = input(prompt+'\n')
-        while resp.lower() not in ['r', 's']:
-            print("Invalid option.")
-            resp = input(prompt+'\n')
-        if resp == 'r':
+        if policy.decide(policy.noSubmoduleChangesDecision, prompt, getRetryResponse):
             return updateModulesAndCheck(repo)
-        print("Skipping submodule update for repo '%s'...local repo will be deleted to clean up" % repo)
-        return False
-
+        print("Skipping submodule update for repo '%s'..." % repo)
+        # Only a repo whose submodules are all known to be up to date is finished, otherwise a rerun has to check it again
+        if all(module['remoteSha'] is not None and module['remoteSha'] == module['sha'] for module in submodules):
+            return 'no changes'
+        return 'skipped'
+
+    if git.stageSubmoduleCommits(repo, movedModules) != 0:
+        sys.stderr.write("ERROR: Failed to update the submodule commits in repo '%s'\n" % repo)
+        return 'failed'
     print("Update successful.")
-    return True
+    return 'updated'
 
 def parseArgs():
     """ Parse command line arguments """
@@ -321,9 +760,66 @@ def parseArgs():
                         help='Version string of this release. Ex. 6.1.4')
 
     parser.add_argument('operation',
-                        choices=['remove_snapshot', 'bump_to_snapshot', 'update_submodules'],
+                        choices=['remove_snapshot', 'bump_to_snapshot', 'update_submodules', 'plan'],
                         help='remove_snapshot will update all versions to the next non-SNAPSHOT version (ex. 6.1.4-SNAPSHOT -> 6.1.4). '
-                        + 'bump_to_snapshot will update all versions to the SNAPSHOT version (ex. 6.1.4 -> 6.1.5-SNAPSHOT)')
+                        + 'bump_to_snapshot will update all versions to the SNAPSHOT version (ex. 6.1.4 -> 6.1.5-SNAPSHOT). '
+                        + 'plan shows what --plan-operation would change without changing anything')
+
+    parser.add_argument('--plan-operation',
+                        choices=['remove_snapshot', 'bump_to_snapshot'],
+                        default='remove_snapshot',
+                        help='Operation to plan when running the plan operation, default is remove_snapshot')
+
+    parser.add_argument('--plan-output',
+                        type=str,
+                        default='releasePlan',
+                        help='Path (without extension) for the .json and .diff files generated by the plan operation')
+
+    parser.add_argument('-w', '--workers',
+                        type=int,
+                        default=8,
+                        help='Number of repos to clone/refresh at the same time before processing them')
+
+    parser.add_argument('--sparse',
+                        action='store_true',
+                        help='use partial clones that only check out pom.xml files, repos are switched to a full checkout for submodule updates')
+
+    parser.add_argument('--pipeline',
+                        action='store_true',
+                        help='process all repos concurrently and ask all questions together once every repo has been scanned')
+
+    parser.add_argument('--policy',
+                        type=str,
+                        help='JSON file that answers decision points ahead of time, ex. {"existing_pr": "recreate", "snapshot_cdap_version": "fail"}')
+
+    parser.add_argument('--on',
+                        action='append',
+                        metavar='DECISION=ACTION',
+                        help='answer a decision point ahead of time, overrides the policy file. Can be used several times')
+
+    parser.add_argument('--no-input',
+                        action='store_true',
+                        help='never prompt, decision points that are not covered by the policy fail the run')
+
+    parser.add_argument('--merge-timeout',
+                        type=float,
+                        default=mergeTimeout/3600,
+                        help='Hours to wait for each submodule PR to be merged before giving up on the repos that depend on it, default is 24')
+
+    parser.add_argument('--github-api',
+                        help='URL of the GitHub API used to list, create and close the release PRs, default is the GITHUB_API_URL environment variable or https://api.github.com')
+
+    parser.add_argument('--restart',
+                        action='store_true',
+                        help='ignore the journal of an earlier run of the same operation and version and process every repo from the start')
+
+    parser.add_argument('--delete-on-revert',
+                        action='store_true',
+                        help='delete the local copy of a repo when its changes are reverted, by default the changes are rolled back and the clone is kept')
+
+    parser.add_argument('--trace',
+                        type=str,
+                        help='write a Chrome trace (chrome://tracing or ui.perfetto.dev) of every git command, API request and phase to this file and print a per-phase timing summary')
 
     parser.add_argument('-v', '--verbose',
                         action='store_true',
@@ -334,34 +830,89 @@ def parseArgs():
 
 
 def main():
-    global quiteMode, releaseBranchMap, submoduleRepos
+    global quiteMode, releaseBranchMap, submoduleRepos, mergeTimeout
     args = parseArgs()
     quiteMode = not args.verbose
+    mergeTimeout = args.merge_timeout*3600
     if path.exists(outputPRsFilename):
         os.remove(outputPRsFilename)
     version = args.version
+    if args.trace:
+        tracing.setTraceFilename(args.trace)
+    if args.operation != 'plan' and journal.startRun("%s %s" % (args.operation, version), args.restart) > 0:
+        print("Resuming an earlier %s run for version %s, pass --restart to start over" % (args.operation, version))
+        with open(outputPRsFilename, 'w') as outputFile:
+            outputFile.writelines(url + "\n" for url in journal.getValues(journal.prStage).values())
     git.setWorkspaceFolder(workspaceFolder)
     git.setQuiteMode(quiteMode)
     git.setPROutputFilename(outputPRsFilename)
     git.setRepos(repos)
-    releaseBranchMap, submoduleRepos = git.mapBranchVersions(version)
+    git.setSyncWorkers(args.workers)
+    git.setSparseMode(args.sparse)
+    git.setDeleteOnRevert(args.delete_on_revert)
+    policy.loadPolicy(args.policy, args.on)
+    policy.setNoInput(args.no_input)
+    if args.github_api:
+        githubClient.setAPIURL(args.github_api)
+    printHeader("Fetching remote refs and open PRs for all repos")
+    with tracing.phase("index refs and PRs"):
+        # Branches are fetched, checked out and compared for drift based on the index, so every run starts from the current remote refs
+        refIndex.refreshIndex(repos, args.workers)
+        prIndex.buildIndex(repos)
+        releaseBranchMap, submoduleRepos = git.mapBranchVersions(version)
+    if args.operation == 'plan':
+        with tracing.phase("plan"):
+            generatePlan(version, args.plan_operation, args.plan_output)
+        return 0
+    printHeader("Syncing all repos")
+    with tracing.phase("sync repos"):
+        syncResults = git.syncRepos(version, [repo for repo in repos if not journal.isDone(repo, journal.doneStage)])
+        for repo, synced in syncResults.items():
+            if synced and not journal.isDone(repo, journal.syncedStage):
+                journal.record(repo, journal.syncedStage, git.getLocalSha(repo))
     if args.operation != 'update_submodules':
-        for repo in repos:
-            try:
-                if args.operation == 'remove_snapshot':
-                    removeSnapshot(repo, version)
-                else:
-                    bumpVersionToSnapshot(repo, version)
-            except Exception as e:
-                continue  # Error logging should have been done before getting to this stage
+        with tracing.phase(args.operation):
+            if args.pipeline:
+                runPipeline(version, args.operation)
+            else:
+                for repo in repos:
+                    try:
+                        if args.operation == 'remove_snapshot':
+                            removeSnapshot(repo, version)
+                        else:
+                            bumpVersionToSnapshot(repo, version)
+                    except policy.PolicyError:
+                        raise
+                    except Exception as e:
+                        continue  # Error logging should have been done before getting to this stage
 
         print("PRs for approval:")
         call("cat %s" % outputPRsFilename, shell=True)
 
-        input("Please review and merge all PRs listed above then press Enter to proceed with updating submodules")
-    updateSubmodules(version)
+        # Without input we cannot wait for the PRs to be merged, the submodules have to be updated in a separate run
+        if policy.noInput:
+            print("Run the update_submodules operation once all PRs listed above are merged")
+            return 0
+        with tracing.phase("review PRs"):
+            input("Please review and merge all PRs listed above then press Enter to proceed with updating submodules")
+    with tracing.phase("update submodules"):
+        statuses = updateSubmodules(version, args.restart)
+    # Skipped repos are left out on purpose, everything else that did not finish needs a rerun
+    failed = [repo for repo, status in statuses.items() if status not in ['merged', 'no changes', 'skipped']]
+    if len(failed) > 0:
+        sys.stderr.write("ERROR: Submodules were not updated in these repos, rerun update_submodules once the problems are fixed: %s\n" % ', '.join(failed))
+        return 1
+    return 0
 
 
 if __name__ == '__main__':
-    exit_code = main()
+    try:
+        exit_code = main()
+    except policy.PolicyError as e:
+        sys.stderr.write("ERROR: %s\n" % e)
+        exit_code = 1
+    if not quiteMode:
+        gitExecutor.printStats()
+    githubRateLimit.printQuota()
+    tracing.export()
     sys.exit(exit_code)
@@ -0,0 +1,93 @@
+import json
+import sys
+import threading
+
+# Decision points that can be answered by the policy
+existingPRDecision = 'existing_pr'
+nonSnapshotPomDecision = 'non_snapshot_pom'
+snapshotPomDecision = 'snapshot_pom'
+snapshotCDAPDecision = 'snapshot_cdap_version'
+noSubmoduleChangesDecision = 'no_submodule_changes'
+
+# Actions that can be configured for each decision point, mapped to the answer they give to the question that would be asked.
+# Every decision point also accepts 'ask' (prompt the user, the default) and 'fail' (stop the whole run)
+decisionActions = {
+    existingPRDecision: {'keep': True, 'recreate': False},  # Keep the existing PR and skip the repo / close the PR and recreate it
+    nonSnapshotPomDecision: {'skip': True, 'skip_repo': False},  # Leave the POM file as-is / skip the whole repo
+    snapshotPomDecision: {'skip': True, 'skip_repo': False},  # Leave the POM file as-is / skip the whole repo
+    snapshotCDAPDecision: {'fix': True, 'skip_repo': False},  # Remove the SNAPSHOT from cdap.version / skip the whole repo
+    noSubmoduleChangesDecision: {'skip': False},  # Skip the submodule update for the repo
+}
+askAction = 'ask'
+failAction = 'fail'
+
+policy = {}
+promptLock = threading.Lock()  # Only one prompt is shown at a time when repos are processed concurrently
+noInput = False  # If True decision points without a policy fail instead of prompting
+
+
+class PolicyError(Exception):
+    """ Raised when the policy says a decision point should fail the run """
+    pass
+
+
+def setNoInput(mode):
+    global noInput
+    noInput=mode
+
+def setAction(kind, action):
+    """ Sets the action for a decision point, exits with an error if the decision point or action is not known """
+
+    if kind not in decisionActions:
+        sys.stderr.write("ERROR: Unknown decision point '%s' in policy. Valid decision points are: %s\n" % (kind, ', '.join(decisionActions)))
+        sys.exit(1)
+    validActions = list(decisionActions[kind].keys()) + [askAction, failAction]
+    if action not in validActions:
+        sys.stderr.write("ERROR: Unknown action '%s' for decision point '%s' in policy. Valid actions are: %s\n" % (action, kind, ', '.join(validActions)))
+        sys.exit(1)
+    policy[kind] = action
+
+def loadPolicy(policyFilePath=None, overrides=None):
+    """
+    Loads the policy from a JSON file that maps decision points to actions (ex. {"existing_pr": "recreate"}),
+    then applies the overrides which are 'decision_point=action' strings from the command line
+    """
+
+    if policyFilePath is not None:
+        try:
+            with open(policyFilePath) as policyFile:
+                filePolicy = json.load(policyFile)
+        except (OSError, ValueError) as e:
+            sys.stderr.write("ERROR: Failed to read policy file '%s': %s\n" % (policyFilePath, e))
+            sys.exit(1)
+        for kind, action in filePolicy.items():
+            setAction(kind, action)
+
+    for override in overrides or []:
+        if '=' not in override:
+            sys.stderr.write("ERROR: Policy override '%s' is not in the format decision_point=action\n" % override)
+            sys.exit(1)
+        kind, action = override.split('=', 1)
+        setAction(kind.strip(), action.strip())
+
+def needsInput(kind):
+    """ Returns True if answering a decision point prompts the user, False if the policy answers it (or fails the run) """
+
+    return policy.get(kind, failAction if noInput else askAction) == askAction
+
+def decide(kind, prompt, ask):
+    """
+    Answers a decision point. If the policy has an action for it the answer is given without any user input,
+    otherwise the ask function is called with the prompt. Raises a PolicyError if the decision point should fail the run
+    """
+
+    action = policy.get(kind, failAction if noInput else askAction)
+    if action == askAction:
+        with promptLock:
+            return ask(prompt)
+
+    question = prompt.split('\n')[0]
+    if action == failAction:
+        raise PolicyError("Policy does not allow '%s': %s" % (kind, question))
+    print("POLICY: %s -> %s" % (question, action))
+    return decisionActions[kind][action]
@@ -0,0 +1,132 @@
+import re
+
+# Names of the version fields tracked in each pom file
+projectVersionField = 'project.version'
+parentVersionField = 'parent.version'
+cdapVersionField = 'cdap.version'
+
+# Matches everything in a pom that affects element nesting, comments/CDATA/declarations are matched so they can be skipped
+pomTokenRegex = re.compile(r'<!--.*?-->|<!\[CDATA\[.*?\]\]>|<[?!][^>]*>|<(/?)([^\s>/]+)[^>]*?(/?)>', re.DOTALL)
+
+# Element paths (from the root element) of the fields we track
+fieldPaths = {
+    ('project', 'version'): projectVersionField,
+    ('project', 'parent', 'version'): parentVersionField,
+}
+
+
+class VersionField():
+    """ Class to hold the location and value of a version field in a pom file """
+
+    def __init__(self, name, start, end, value):
+        self.name = name
+        self.start = start  # Offset of the first character of the value
+        self.end = end  # Offset just past the last character of the value
+        self.value = value
+
+
+class VersionChange():
+    """ Class to hold a single change made to a version field """
+
+    def __init__(self, pomFile, field, oldVersion, newVersion):
+        self.pomFile = pomFile
+        self.field = field
+        self.oldVersion = oldVersion
+        self.newVersion = newVersion
+
+    def toString(self):
+        return '%s: %s %s -> %s' % (self.pomFile, self.field, self.oldVersion, self.newVersion)
+
+
+def scanPom(pom):
+    """
+    Scans the contents of a pom file once and returns a map of field name -> VersionField for the project version,
+    the parent version and the cdap.version property (the first one defined in a <properties> block).
+    Fields that are not present in the pom are not included in the map
+    """
+
+    fields = {}
+    stack = []
+    openFields = []  # (name, offset) for tracked elements that are currently open
+    for match in pomTokenRegex.finditer(pom):
+        closing, tag, selfClosing = match.groups()
+        if tag is None or selfClosing:
+            continue
+
+        if not closing:
+            stack.append(tag)
+            name = fieldPaths.get(tuple(stack))
+            if name is None and tag == 'cdap.version' and len(stack) > 1 and stack[-2] == 'properties':
+                name = cdapVersionField
+            if name is not None and name not in fields:
+                openFields.append((name, match.end(), len(stack)))
+            continue
+
+        # Closing tag, record the value if this closes a tracked element
+        if len(openFields) > 0 and openFields[-1][2] == len(stack):
+            name, start, _ = openFields.pop()
+            value = pom[start:match.start()]
+            start += len(value) - len(value.lstrip())
+            value = value.strip()
+            fields[name] = VersionField(name, start, start + len(value), value)
+        if len(stack) > 0:
+            stack.pop()
+    return fields
+
+
+def getVersion(fields):
+    """ Returns the effective version of a pom (its own version, or the inherited parent version), None if there is neither """
+
+    for name in [projectVersionField, parentVersionField]:
+        if name in fields:
+            return fields[name].value
+    return None
+
+
+def nextSnapshotVersion(version):
+    """ Returns the next SNAPSHOT version for a given release version. Ex. 6.1.4 -> 6.1.5-SNAPSHOT """
+
+    versionParts = version.split(".")
+    versionParts[-1] = str(int(versionParts[-1])+1)
+    return '%s-SNAPSHOT' % '.'.join(versionParts)
+
+
+def readPom(pomFile):
+    """ Reads a pom file and scans it, returns the contents and the map of version fields """
+
+    with open(pomFile, newline='') as pf:
+        pom = pf.read()
+    return pom, scanPom(pom)
+
+
+def applyUpdates(pom, fields, updates):
+    """
+    Patches the given field values (map of field name -> new value) into the pom contents.
+    Only the ranges of the changed values are replaced, everything else is kept as-is.
+    Returns the new contents and the list of (field, oldVersion, newVersion) that were actually changed
+    """
+
+    changed = []
+    for name in sorted(updates, key=lambda n: fields[n].start, reverse=True):
+        field = fields[name]
+        if field.value == updates[name]:
+            continue
+        pom = pom[:field.start] + updates[name] + pom[field.end:]
+        changed.append((name, field.value, updates[name]))
+    changed.reverse()
+    return pom, changed
+
+
+def writeUpdates(pomFile, pom, fields, updates, prettyPomFile=None):
+    """
+    Applies the updates to a pom file that was read with readPom.
+    The file is only written if at least one value actually changed. Returns the list of VersionChange objects
+    """
+
+    newPom, changed = applyUpdates(pom, fields, updates)
+    if len(changed) == 0:
+        return []
+    with open(pomFile, 'w', newline='') as pf:
+        pf.write(newPom)
+    prettyPomFile = pomFile if prettyPomFile is None else prettyPomFile
+    return [VersionChange(prettyPomFile, name, old, new) for name, old, new in changed]
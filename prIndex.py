@@ -0,0 +1,109 @@
+import threading
+import githubClient
+
+# All PRs created by the release tools have this label, only those PRs are indexed
+releaseLabel = "automated-release"
+pageSize = 100
+
+# Map of repo -> {head branch: {'number': <PR number>, 'url': <PR URL>, 'base': <base branch>}} for all open PRs with the release label.
+# Repos whose PRs could not be listed are not in the map, callers look up the PR of each branch for those
+prIndex = {}
+failedRepos = set()
+indexLock = threading.Lock()
+
+# Every repo is aliased (r0, r1, ...) so the PRs of all repos are listed with a single request
+repoQuery = """
+  r%(i)d: repository(owner: $o%(i)d, name: $n%(i)d) {
+    pullRequests(states: OPEN, labels: [$label], first: %(pageSize)d, after: $c%(i)d) {
+      nodes { number url headRefName baseRefName }
+      pageInfo { hasNextPage endCursor }
+    }
+  }"""
+
+
+def queryPRs(repoCursors):
+    """
+    Lists one page of open release PRs for each given (repo, cursor) pair with a single query.
+    Returns a map of repo -> (list of PR nodes, cursor of the next page or None if this was the last page)
+    """
+
+    declarations = ["$label: String!"]
+    selections = []
+    variables = {'label': releaseLabel}
+    for i, (repo, cursor) in enumerate(repoCursors):
+        owner, name = repo.split("/", 1)
+        declarations += ["$o%d: String!" % i, "$n%d: String!" % i, "$c%d: String" % i]
+        selections.append(repoQuery % {'i': i, 'pageSize': pageSize})
+        variables.update({'o%d' % i: owner, 'n%d' % i: name, 'c%d' % i: cursor})
+    query = "query(%s) {%s\n}" % (", ".join(declarations), "".join(selections))
+    data = githubClient.graphQL(query, variables)
+
+    pages = {}
+    for i, (repo, _) in enumerate(repoCursors):
+        repository = data.get('r%d' % i)
+        if repository is None:
+            pages[repo] = ([], None)  # Repo does not exist or is not visible with our token
+            continue
+        pullRequests = repository['pullRequests']
+        nextCursor = pullRequests['pageInfo']['endCursor'] if pullRequests['pageInfo']['hasNextPage'] else None
+        pages[repo] = (pullRequests['nodes'], nextCursor)
+    return pages
+
+def buildIndex(repos):
+    """
+    Lists all open PRs with the release label across the given repos and stores them in memory.
+    This is meant to be called once at the start of a run so later PR checks are local lookups
+    """
+
+    pending = [(repo, None) for repo in repos]
+    index = {repo: {} for repo in repos}
+    try:
+        while len(pending) > 0:
+            pages = queryPRs(pending)
+            pending = []
+            for repo, (nodes, nextCursor) in pages.items():
+                for pr in nodes:
+                    index[repo][pr['headRefName']] = {'number': pr['number'], 'url': pr['url'], 'base': pr['baseRefName']}
+                if nextCursor is not None:
+                    pending.append((repo, nextCursor))
+    except Exception as e:
+        print("WARN: Failed to list the open PRs, they will be looked up for each branch: %s" % e)
+        with indexLock:
+            failedRepos.update(repos)
+        return prIndex
+
+    with indexLock:
+        prIndex.update(index)
+    return prIndex
+
+def getRepoPRs(repo):
+    """ Returns the open release PRs of a repo keyed by head branch, or None if they could not be listed """
+
+    if repo not in prIndex and repo not in failedRepos:
+        buildIndex([repo])
+    return prIndex.get(repo)
+
+def getOpenPR(repo, branch):
+    """ Returns the open release PR for a branch, False if there is none and None if the index has no data for the repo """
+
+    prs = getRepoPRs(repo)
+    if prs is None:
+        return None
+    return prs.get(branch, False)
+
+def recordPR(repo, branch, url, base=None):
+    """ Updates the index after we created a PR """
+
+    if repo not in prIndex:
+        return
+    number = url.rstrip('/').split('/')[-1]
+    with indexLock:
+        prIndex[repo][branch] = {'number': int(number) if number.isdigit() else None, 'url': url, 'base': base}
+
+def recordPRClosed(repo, branch):
+    """ Updates the index after we closed a PR """
+
+    if repo not in prIndex:
+        return
+    with indexLock:
+        prIndex[repo].pop(branch, None)
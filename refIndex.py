@@ -0,0 +1,196 @@
+from os import path
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import gitExecutor
+import json
+import time
+import os
+
+# The index is kept in memory for the whole run and persisted so that reruns within the TTL do not hit the network
+indexFilename = "refIndex.json"  # Update the entry in the .gitignore if this file name is changed
+indexTTL = 10*60  # Seconds before the refs of a repo are considered stale and fetched again, see refreshIndex for runs that need current refs
+quiteMode = True
+
+# Map of repo -> {'fetchedAt': <epoch seconds>, 'heads': {branch: sha}, 'tags': {tag: sha}}
+refIndex = {}
+indexLock = threading.Lock()
+indexLoaded = False
+runStart = time.time()  # Refs fetched after this are current for the rest of the run
+
+
+def setIndexFilename(name):
+    global indexFilename
+    indexFilename=name
+
+def setIndexTTL(seconds):
+    global indexTTL
+    indexTTL=seconds
+
+def setQuiteMode(mode):
+    global quiteMode
+    quiteMode=mode
+
+def getIndexPath():
+    """ Returns the filesystem path of the persisted index """
+
+    return path.join(os.getcwd(), indexFilename)
+
+def getRemoteURL(repo):
+    """ Returns the remote URL for a given repo """
+
+    if not repo.endswith(".git"):
+        repo += ".git"
+    return "git@github.com:%s" % repo
+
+def parseRefs(lsRemoteOutput):
+    """
+    Parses the output of 'git ls-remote --heads --tags' into branch->sha and tag->sha maps.
+    Annotated tags are resolved to the commit they point to using the peeled ('^{}') entries
+    """
+
+    heads = {}
+    tags = {}
+    for line in lsRemoteOutput.split("\n"):
+        if '\t' not in line:
+            continue
+        sha, ref = line.split('\t', 1)
+        if ref.startswith('refs/heads/'):
+            heads[ref[len('refs/heads/'):]] = sha
+        elif ref.startswith('refs/tags/'):
+            tag = ref[len('refs/tags/'):]
+            if tag.endswith('^{}'):
+                tags[tag[:-len('^{}')]] = sha  # Peeled entries always come after the tag entry so they win
+            elif tag not in tags:
+                tags[tag] = sha
+    return heads, tags
+
+def fetchRefs(repo):
+    """ Fetches all heads and tags for a given repo from remote and stores them in the index """
+
+    out = gitExecutor.run(os.getcwd(), ['ls-remote', '--heads', '--tags', getRemoteURL(repo)],
+                          check=True, showErrors=not quiteMode, query=True).stdout.decode('utf-8')
+    heads, tags = parseRefs(out)
+    with indexLock:
+        refIndex[repo] = {'fetchedAt': time.time(), 'heads': heads, 'tags': tags}
+    return refIndex[repo]
+
+def isFresh(repo):
+    """ Returns True if the index has refs for this repo that are younger than the TTL """
+
+    return repo in refIndex and time.time() - refIndex[repo]['fetchedAt'] < indexTTL
+
+def loadIndex():
+    """ Loads the persisted index from disk (once per run), entries older than the TTL are dropped """
+
+    global indexLoaded
+    if indexLoaded:
+        return
+    indexLoaded = True
+    if not path.exists(getIndexPath()):
+        return
+    try:
+        with open(getIndexPath()) as indexFile:
+            persisted = json.load(indexFile)
+    except (ValueError, OSError):
+        print("WARN: Ignoring unreadable ref index '%s'" % getIndexPath())
+        return
+    with indexLock:
+        for repo, refs in persisted.items():
+            if time.time() - refs.get('fetchedAt', 0) < indexTTL:
+                refIndex.setdefault(repo, refs)
+
+def saveIndex():
+    """ Persists the in-memory index to disk """
+
+    with indexLock:
+        contents = json.dumps(refIndex, indent=2, sort_keys=True)
+        tmpPath = getIndexPath() + ".tmp"
+        with open(tmpPath, 'w') as indexFile:
+            indexFile.write(contents)
+        os.replace(tmpPath, getIndexPath())
+
+def buildIndex(repos, workers=8, refresh=False):
+    """
+    Fetches the refs for all given repos in parallel, skipping repos that already have fresh refs unless refresh is set.
+    This is meant to be called once at the start of a run so later branch checks are local lookups
+    """
+
+    loadIndex()
+    staleRepos = [repo for repo in repos if refresh or not isFresh(repo)]
+    if len(staleRepos) > 0:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            for repo, error in zip(staleRepos, executor.map(tryFetchRefs, staleRepos)):
+                if error is not None:
+                    print("WARN: Failed to fetch refs for repo '%s', they will be fetched on demand" % repo)
+        saveIndex()
+    return refIndex
+
+def refreshIndex(repos, workers=8):
+    """
+    Fetches the refs of all given repos that were not fetched during this run yet, persisted refs are never trusted.
+    Runs that fetch, check out or compare branches based on the index use this, the TTL is only for read-only queries
+    """
+
+    loadIndex()
+    return buildIndex([repo for repo in repos if repo not in refIndex or refIndex[repo]['fetchedAt'] < runStart], workers, refresh=True)
+
+def tryFetchRefs(repo):
+    """ Wrapper around fetchRefs for use in a thread pool, returns the exception instead of raising it """
+
+    try:
+        fetchRefs(repo)
+        return None
+    except Exception as e:
+        return e
+
+def getRefs(repo):
+    """ Returns the index entry for a given repo, fetching it from remote if it is missing or stale """
+
+    loadIndex()
+    if not isFresh(repo):
+        fetchRefs(repo)
+        saveIndex()
+    return refIndex[repo]
+
+def getBranches(repo):
+    """ Returns a list of all remote branch names for a given repo """
+
+    return list(getRefs(repo)['heads'].keys())
+
+def getBranchSha(repo, branch):
+    """ Returns the remote sha of a branch, or None if the branch does not exist """
+
+    return getRefs(repo)['heads'].get(branch)
+
+def branchExists(repo, branch):
+    return branch in getRefs(repo)['heads']
+
+def tagExists(repo, tag):
+    return tag in getRefs(repo)['tags']
+
+def recordBranch(repo, branch, sha):
+    """ Updates the index after we pushed a branch so it does not need to be fetched again """
+
+    if repo not in refIndex:
+        return
+    with indexLock:
+        refIndex[repo]['heads'][branch] = sha
+    saveIndex()
+
+def recordBranchDeleted(repo, branch):
+    """ Updates the index after we deleted a remote branch """
+
+    if repo not in refIndex:
+        return
+    with indexLock:
+        refIndex[repo]['heads'].pop(branch, None)
+    saveIndex()
+
+def recordTag(repo, tag, sha):
+    """ Updates the index after we pushed a tag """
+
+    if repo not in refIndex:
+        return
+    with indexLock:
+        refIndex[repo]['tags'][tag] = sha
+    saveIndex()
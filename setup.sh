@@ -1,2 +1,3 @@
 ./gh repo view
-pip3 install jira
\ No newline at end of file
+pip3 install jira
+pip3 install requests
\ No newline at end of file
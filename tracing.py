@@ -0,0 +1,184 @@
+from contextlib import contextmanager
+from os import path
+import subprocess
+import threading
+import json
+import time
+import re
+import os
+
+# Wall-clock tracing for external commands, HTTP requests and the phases of a run.
+# Spans are only recorded once a trace file is set, they are exported as a Chrome trace (open it in chrome://tracing
+# or https://ui.perfetto.dev) and summarized per phase at the end of the run
+traceFilename = None
+
+# Span categories
+phaseCategory = 'phase'
+gitCategory = 'git'
+httpCategory = 'http'
+subprocessCategory = 'subprocess'
+waitCategory = 'wait'  # Time spent waiting for a rate limit
+
+spans = []  # {'name', 'cat', 'start', 'duration', 'tid', 'phase', 'args'}
+spansLock = threading.Lock()
+threadNames = {}  # Map of thread ident -> name
+currentPhase = None
+
+cdRegex = re.compile(r'^cd\s+"?([^"]*)"?$')
+
+
+class Span():
+    """ Class to hold the details of a span while it is running, extra details can be added with set """
+
+    def __init__(self, name, category, args):
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def set(self, **args):
+        self.args.update(args)
+
+
+def setTraceFilename(name):
+    """ Enables tracing, the trace is written to the given file by export """
+    global traceFilename
+    traceFilename=name
+
+def isEnabled():
+    return traceFilename is not None
+
+def recordSpan(name, category, start, duration, args):
+    """ Records a finished span, start is in epoch seconds and duration in seconds """
+
+    if not isEnabled():
+        return
+    thread = threading.current_thread()
+    with spansLock:
+        threadNames[thread.ident] = thread.name
+        spans.append({'name': name, 'cat': category, 'start': start, 'duration': duration, 'tid': thread.ident,
+                      'phase': currentPhase, 'args': args})
+
+@contextmanager
+def span(name, category, **args):
+    """ Records a span for the code run inside the with block, yields a Span that more details can be added to """
+
+    current = Span(name, category, args)
+    start = time.time()
+    try:
+        yield current
+    finally:
+        recordSpan(current.name, category, start, time.time() - start, current.args)
+
+@contextmanager
+def phase(name):
+    """ Marks the code run inside the with block as a logical phase of the run, every span recorded meanwhile belongs to it """
+
+    global currentPhase
+    previousPhase = currentPhase
+    currentPhase = name
+    try:
+        with span(name, phaseCategory):
+            yield
+    finally:
+        currentPhase = previousPhase
+
+def describeCommand(command):
+    """
+    Returns a short name (ex. 'mvn' or 'git fetch') and the repo (the folder of a leading 'cd') for a shell command string.
+    The commands in this project are joined with ' && ' and usually start with a cd into the repo
+    """
+
+    repo = None
+    names = []
+    for part in command.split(" && "):
+        part = part.strip().lstrip('(')
+        match = cdRegex.match(part)
+        if match:
+            repo = path.basename(match.group(1).rstrip('/')) or repo
+            continue
+        words = part.split()
+        if len(words) == 0:
+            continue
+        names.append(" ".join(words[:2]) if words[0] in ['git', 'gh', 'gcloud'] and len(words) > 1 else words[0])
+    return " && ".join(dict.fromkeys(names)) or command[:40], repo
+
+def call(command, **kwargs):
+    """ Drop-in replacement for subprocess.call that records a span for the command """
+
+    name, repo = describeCommand(command if isinstance(command, str) else " ".join(command))
+    with span(name, subprocessCategory, command=command, repo=repo) as current:
+        code = subprocess.call(command, **kwargs)
+        current.set(exitCode=code)
+    return code
+
+def check_output(command, **kwargs):
+    """ Drop-in replacement for subprocess.check_output that records a span for the command """
+
+    name, repo = describeCommand(command if isinstance(command, str) else " ".join(command))
+    with span(name, subprocessCategory, command=command, repo=repo) as current:
+        try:
+            out = subprocess.check_output(command, **kwargs)
+        except subprocess.CalledProcessError as e:
+            current.set(exitCode=e.returncode)
+            raise
+        current.set(exitCode=0, bytes=len(out))
+    return out
+
+def request(method, url, session=None, **kwargs):
+    """ Sends an HTTP request with the given session (or a one-off request) and records a span for it """
+
+    import requests
+    with span("%s %s" % (method, url.split('/')[2] if '://' in url else url), httpCategory, url=url) as current:
+        response = (session or requests).request(method, url, **kwargs)
+        current.set(status=response.status_code, bytes=len(response.content))
+    return response
+
+def instrumentSession(session):
+    """ Records a span for every request made with a requests session that is owned by a library (ex. the JIRA client) """
+
+    def recordResponse(response, *args, **kwargs):
+        duration = response.elapsed.total_seconds()
+        recordSpan("%s %s" % (response.request.method, response.url.split('/')[2]), httpCategory, time.time() - duration, duration,
+                   {'url': response.url, 'status': response.status_code, 'bytes': len(response.content)})
+    session.hooks.setdefault('response', []).append(recordResponse)
+
+def getSummary():
+    """ Returns a list of (phase, wall seconds, {category: (count, seconds)}) in the order the phases started """
+
+    phases = {}
+    for s in sorted(spans, key=lambda s: s['start']):
+        if s['cat'] == phaseCategory:
+            phases.setdefault(s['name'], [0.0, {}])[0] += s['duration']
+    for s in spans:
+        if s['cat'] == phaseCategory:
+            continue
+        entry = phases.setdefault(s['phase'] or "(no phase)", [0.0, {}])
+        count, seconds = entry[1].get(s['cat'], (0, 0.0))
+        entry[1][s['cat']] = (count + 1, seconds + s['duration'])
+    return [(name, wall, categories) for name, (wall, categories) in phases.items()]
+
+def printSummary():
+    """ Prints the wall time of every phase with the number and total time of the commands and requests run in it """
+
+    categories = [gitCategory, subprocessCategory, httpCategory, waitCategory]
+    print("%-30s %10s %20s %20s %20s %20s" % ("Phase", "Wall", "git", "subprocess", "http", "rate limit wait"))
+    for name, wall, counts in getSummary():
+        cells = ["%5d / %8.2fs" % counts[c] if c in counts else "-" for c in categories]
+        print("%-30s %9.2fs %20s %20s %20s %20s" % (name[:30], wall, cells[0], cells[1], cells[2], cells[3]))
+    print("(command and request times overlap when they run concurrently, so they can add up to more than the wall time)")
+
+def export():
+    """ Writes all spans to the trace file in the Chrome trace event format and prints the per-phase summary """
+
+    if not isEnabled():
+        return
+    pid = os.getpid()
+    events = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}} for tid, name in threadNames.items()]
+    for s in spans:
+        events.append({'name': s['name'], 'cat': s['cat'], 'ph': 'X', 'pid': pid, 'tid': s['tid'],
+                       'ts': int(s['start']*1000000), 'dur': int(s['duration']*1000000), 'args': dict(s['args'], phase=s['phase'])})
+    with open(traceFilename, 'w') as traceFile:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, traceFile, default=str)
+
+    print("\nTrace written to %s" % traceFilename)
+    printSummary()